@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+
+import click
+from loguru import logger
+from polygon.rest.models import Agg
+
+from market_check import MARKET_TZ
+from settings import AGGS_CACHE_DIR
+
+SUFFIX = ".json.gz"
+
+# Agg attributes stored under the keys Polygon's aggregates response uses, so
+# entries are plain API payloads and decode with Agg.from_dict
+AGG_FIELDS = (("o", "open"), ("h", "high"), ("l", "low"), ("c", "close"), ("v", "volume"),
+              ("vw", "vwap"), ("t", "timestamp"), ("n", "transactions"), ("otc", "otc"))
+
+
+def window_key(ticker, timespan, multiplier, from_, to):
+    """The cache key of one ``list_aggs`` request; ``from_`` and ``to`` as passed to the API."""
+    return {"ticker": ticker, "timespan": timespan, "multiplier": multiplier, "from_": from_, "to": to}
+
+
+def window_day(value):
+    """ET date of a ``list_aggs`` bound: a YYYY-MM-DD string or a millisecond timestamp."""
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return datetime.fromtimestamp(int(value) / 1000, MARKET_TZ).date()
+
+
+def window_closed(to):
+    """True if a request ending at ``to`` ends before today's ET date, so its bars can't change."""
+    return window_day(to) < datetime.now(MARKET_TZ).date()
+
+
+class AggsCache:
+    """Compressed on-disk store of complete ``list_aggs`` responses.
+
+    Each response is one gzip file at ``<directory>/<TICKER>/<sha256 of key>.json.gz``
+    holding a line with its key and a line with its aggregates. Files are
+    written to a temporary name and renamed, so a crash never leaves a
+    truncated entry; an unreadable entry is treated as a miss.
+    """
+
+    def __init__(self, directory=AGGS_CACHE_DIR):
+        self.directory = directory
+        self.hits = 0
+        self.stored = 0
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.directory, key["ticker"], digest + SUFFIX)
+
+    def get(self, ticker, timespan, multiplier, from_, to):
+        """Return the cached aggregates for a request as a list of Agg, or None."""
+        key = window_key(ticker, timespan, multiplier, from_, to)
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            stored_key, aggs = read_entry(path)
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable aggregates cache entry {path}: {type(e).__name__}: {e}")
+            return None
+        if stored_key != key:
+            logger.warning(f"Ignoring aggregates cache entry {path} stored for {stored_key}")
+            return None
+        with self.lock:
+            self.hits += 1
+        return aggs
+
+    def put(self, ticker, timespan, multiplier, from_, to, aggs):
+        """Store the complete response to a request."""
+        key = window_key(ticker, timespan, multiplier, from_, to)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        records = [{field: getattr(agg, attr) for field, attr in AGG_FIELDS if getattr(agg, attr) is not None}
+                   for agg in aggs]
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(key, sort_keys=True).encode() + b"\n")
+                f.write(json.dumps(records, separators=(",", ":")).encode() + b"\n")
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self.lock:
+            self.stored += 1
+
+    def entries(self, tickers=None):
+        """Yield (key, path) for every stored response, for ``tickers`` if given, in path order."""
+        if not os.path.isdir(self.directory):
+            return
+        for ticker in sorted(tickers or os.listdir(self.directory)):
+            folder = os.path.join(self.directory, ticker)
+            if not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder)):
+                if not name.endswith(SUFFIX):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    # The key is the first line, so only the start of the file is decompressed
+                    with gzip.open(path, "rt") as f:
+                        key = json.loads(f.readline())
+                except (OSError, EOFError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable aggregates cache entry {path}: {type(e).__name__}: {e}")
+                    continue
+                yield key, path
+
+
+def read_entry(path):
+    """Return (key, [Agg, ...]) from a cache file."""
+    with gzip.open(path, "rt") as f:
+        key = json.loads(f.readline())
+        records = json.loads(f.readline())
+    return key, [Agg.from_dict(record) for record in records]
+
+
+@click.command()
+@click.argument("tickers", nargs=-1)
+@click.option("--cache-dir", default=AGGS_CACHE_DIR, help=f"Cache directory (default: {AGGS_CACHE_DIR})")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+def main(tickers, cache_dir, debug):
+    """Summarize the cached Polygon aggregate responses for TICKERS (default: all).
+
+    backfill.py fills the cache as it fetches closed windows and serves them
+    from it on later runs; `python backfill.py TICKERS --replay` rebuilds
+    stocks from the cache alone.
+    """
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    cache = AggsCache(cache_dir)
+    # (ticker, timespan, multiplier) -> [responses, bytes, first day, last day]
+    summary = defaultdict(lambda: [0, 0, date.max, date.min])
+    for key, path in cache.entries([ticker.upper() for ticker in tickers]):
+        logger.debug(f"{path}: {key}")
+        entry = summary[key["ticker"], key["timespan"], key["multiplier"]]
+        entry[0] += 1
+        entry[1] += os.path.getsize(path)
+        entry[2] = min(entry[2], window_day(key["from_"]))
+        entry[3] = max(entry[3], window_day(key["to"]))
+
+    if not summary:
+        logger.info(f"No cached responses in {cache_dir}")
+        return
+    for (ticker, timespan, multiplier), (responses, size, first, last) in sorted(summary.items()):
+        logger.info(f"{ticker} {multiplier} {timespan}: {responses} response(s), {size / 1024:,.1f} KiB, "
+                    f"{first}..{last}")
+    logger.info(f"Total: {sum(entry[0] for entry in summary.values())} response(s), "
+                f"{sum(entry[1] for entry in summary.values()) / 1024 / 1024:,.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
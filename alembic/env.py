@@ -19,6 +19,10 @@ if config.config_file_name is not None:
 from database import Base
 target_metadata = Base.metadata
 
+# Use the same DATABASE_URL as the application (escape % for configparser)
+from settings import DATABASE_URL
+config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
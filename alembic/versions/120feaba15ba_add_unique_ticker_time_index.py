@@ -0,0 +1,39 @@
+"""Add unique ticker time index
+
+Revision ID: 120feaba15ba
+Revises: 00ff7b4e4bb5
+Create Date: 2026-10-17 04:29:17.840923
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '120feaba15ba'
+down_revision: Union[str, Sequence[str], None] = '00ff7b4e4bb5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    existing = {index["name"] for index in inspector.get_indexes("stocks")}
+    if "uq_stocks_ticker_time" in existing:
+        # Fresh databases get the index from Base.metadata.create_all
+        return
+
+    # Keep the first copy of each (ticker, time) bar written by earlier re-runs
+    op.execute(
+        "DELETE FROM stocks WHERE id NOT IN "
+        "(SELECT MIN(id) FROM stocks GROUP BY ticker, time)"
+    )
+    op.create_index("uq_stocks_ticker_time", "stocks", ["ticker", "time"], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("uq_stocks_ticker_time", table_name="stocks")
@@ -0,0 +1,102 @@
+"""Promote hot meta fields to columns
+
+Revision ID: 125fca7c95c8
+Revises: 7baffcd74ded
+Create Date: 2026-10-17 04:33:01.272061
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '125fca7c95c8'
+down_revision: Union[str, Sequence[str], None] = '7baffcd74ded'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Fields moved out of meta, with their column types
+PROMOTED = {
+    "open": sa.Float(),
+    "close": sa.Float(),
+    "volume": sa.Float(),
+    "vwap": sa.Float(),
+    "transactions": sa.Integer(),
+    "source": sa.String(length=16),
+}
+
+# Rows updated per statement while copying values out of meta
+BATCH_SIZE = 50000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    existing = {column["name"] for column in sa.inspect(bind).get_columns("stocks")}
+    for name, type_ in PROMOTED.items():
+        # Fresh databases get the columns from Base.metadata.create_all
+        if name not in existing:
+            op.add_column("stocks", sa.Column(name, type_, nullable=True))
+
+    if bind.dialect.name == "postgresql":
+        update = """
+            UPDATE stocks SET
+                open = COALESCE(open, (meta->>'open')::double precision),
+                close = COALESCE(close, (meta->>'close')::double precision),
+                volume = COALESCE(volume, (meta->>'volume')::double precision),
+                vwap = COALESCE(vwap, (meta->>'vwap')::double precision),
+                transactions = COALESCE(transactions, (meta->>'transactions')::numeric::integer),
+                source = COALESCE(source, meta->>'source', 'polygon'),
+                meta = CASE WHEN json_typeof(meta) = 'object'
+                    THEN NULLIF((meta::jsonb - 'open' - 'close' - 'volume' - 'vwap'
+                                 - 'transactions' - 'source')::text, '{}')::json
+                    ELSE meta END
+            WHERE id BETWEEN :lo AND :hi
+        """
+    else:
+        update = """
+            UPDATE stocks SET
+                open = COALESCE(open, json_extract(meta, '$.open')),
+                close = COALESCE(close, json_extract(meta, '$.close')),
+                volume = COALESCE(volume, json_extract(meta, '$.volume')),
+                vwap = COALESCE(vwap, json_extract(meta, '$.vwap')),
+                transactions = COALESCE(transactions, json_extract(meta, '$.transactions')),
+                source = COALESCE(source, json_extract(meta, '$.source'), 'polygon'),
+                meta = NULLIF(json_remove(meta, '$.open', '$.close', '$.volume', '$.vwap',
+                                          '$.transactions', '$.source'), '{}')
+            WHERE id BETWEEN :lo AND :hi
+        """
+
+    lo, hi = bind.execute(sa.text("SELECT MIN(id), MAX(id) FROM stocks")).one()
+    if lo is None:
+        return
+
+    # Commit each batch so live writers are never blocked behind one huge UPDATE;
+    # the COALESCEs make a rerun after an interruption safe
+    with op.get_context().autocommit_block():
+        for start in range(lo, hi + 1, BATCH_SIZE):
+            bind.execute(sa.text(update), {"lo": start, "hi": start + BATCH_SIZE - 1})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        op.execute("""
+            UPDATE stocks SET meta = (COALESCE(meta::jsonb, '{}'::jsonb) || jsonb_strip_nulls(jsonb_build_object(
+                'open', open, 'close', close, 'volume', volume, 'vwap', vwap,
+                'transactions', transactions, 'source', source)))::json
+        """)
+    else:
+        op.execute("""
+            UPDATE stocks SET meta = json_patch(COALESCE(meta, '{}'), json_object(
+                'open', open, 'close', close, 'volume', volume, 'vwap', vwap,
+                'transactions', transactions, 'source', source))
+        """)
+
+    with op.batch_alter_table("stocks") as batch_op:
+        for name in PROMOTED:
+            batch_op.drop_column(name)
@@ -0,0 +1,111 @@
+"""Covering ticker/time index and monthly time partitions
+
+Revision ID: 3f1c9a7d2e54
+Revises: 125fca7c95c8
+Create Date: 2026-10-17 09:12:03.418227
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2e54'
+down_revision: Union[str, Sequence[str], None] = '125fca7c95c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COVERING_COLUMNS = "high, low, avg, sale, open, close, volume, vwap, transactions, source"
+
+# Monthly partitions created past the newest row (mirrors settings.PARTITION_MONTHS_AHEAD)
+MONTHS_AHEAD = 3
+
+
+def month_partition(lower):
+    """Return (name, lower, upper) for the UTC month starting at Unix timestamp ``lower``."""
+    moment = datetime.fromtimestamp(lower, timezone.utc)
+    year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+    upper = int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+    return f"stocks_p{moment:%Y%m}", lower, upper
+
+
+def sync_indexes(bind):
+    """Drop the ticker index, which the unique (ticker, time) index already serves, and add the time index."""
+    existing = {index["name"] for index in sa.inspect(bind).get_indexes("stocks")}
+    if "ix_stocks_ticker" in existing:
+        op.drop_index("ix_stocks_ticker", table_name="stocks")
+    if "ix_stocks_time" not in existing:
+        op.create_index("ix_stocks_time", "stocks", ["time"])
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    sync_indexes(bind)
+    if bind.dialect.name != "postgresql":
+        return
+
+    if bind.execute(sa.text("SELECT relkind FROM pg_class WHERE relname = 'stocks'")).scalar() == "p":
+        return
+
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('stocks', 'id')")).scalar()
+    op.execute("ALTER TABLE stocks RENAME TO stocks_unpartitioned")
+    op.execute("DROP INDEX IF EXISTS uq_stocks_ticker_time")
+    op.execute("DROP INDEX IF EXISTS ix_stocks_time")
+    op.execute("ALTER TABLE stocks_unpartitioned DROP CONSTRAINT IF EXISTS stocks_pkey")
+
+    # Same columns and id default (the existing sequence); the partition key must be in the primary key
+    op.execute("CREATE TABLE stocks (LIKE stocks_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (time)")
+    op.execute("ALTER TABLE stocks ADD CONSTRAINT stocks_pkey PRIMARY KEY (id, time)")
+    op.execute("CREATE TABLE stocks_default PARTITION OF stocks DEFAULT")
+
+    # A partition for every month that has rows, then the current month and MONTHS_AHEAD more
+    months = set(bind.execute(sa.text(
+        "SELECT DISTINCT EXTRACT(EPOCH FROM date_trunc('month', to_timestamp(time) AT TIME ZONE 'UTC'))::bigint "
+        "FROM stocks_unpartitioned"
+    )).scalars())
+    now = datetime.now(timezone.utc)
+    lower = int(datetime(now.year, now.month, 1, tzinfo=timezone.utc).timestamp())
+    for _ in range(MONTHS_AHEAD + 1):
+        months.add(lower)
+        lower = month_partition(lower)[2]
+    for name, lower, upper in map(month_partition, sorted(months)):
+        op.execute(f"CREATE TABLE {name} PARTITION OF stocks FOR VALUES FROM ({lower}) TO ({upper})")
+
+    # Load before building the secondary indexes; one sorted build beats per-row maintenance
+    op.execute("INSERT INTO stocks SELECT * FROM stocks_unpartitioned")
+    op.execute(f"CREATE UNIQUE INDEX uq_stocks_ticker_time ON stocks (ticker, time) INCLUDE ({COVERING_COLUMNS})")
+    op.execute("CREATE INDEX ix_stocks_time ON stocks (time)")
+
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY stocks.id")
+    op.execute("DROP TABLE stocks_unpartitioned")
+    op.execute("ANALYZE stocks")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql" and bind.execute(
+        sa.text("SELECT relkind FROM pg_class WHERE relname = 'stocks'")
+    ).scalar() == "p":
+        sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('stocks', 'id')")).scalar()
+        op.execute("ALTER TABLE stocks RENAME TO stocks_partitioned")
+        op.execute("ALTER INDEX uq_stocks_ticker_time RENAME TO uq_stocks_partitioned_ticker_time")
+        op.execute("ALTER INDEX ix_stocks_time RENAME TO ix_stocks_partitioned_time")
+        op.execute("ALTER TABLE stocks_partitioned RENAME CONSTRAINT stocks_pkey TO stocks_partitioned_pkey")
+
+        op.execute("CREATE TABLE stocks (LIKE stocks_partitioned INCLUDING DEFAULTS)")
+        op.execute("INSERT INTO stocks SELECT * FROM stocks_partitioned")
+        op.execute("ALTER TABLE stocks ADD CONSTRAINT stocks_pkey PRIMARY KEY (id)")
+        op.execute("CREATE UNIQUE INDEX uq_stocks_ticker_time ON stocks (ticker, time)")
+        op.execute("CREATE INDEX ix_stocks_time ON stocks (time)")
+
+        if sequence:
+            op.execute(f"ALTER SEQUENCE {sequence} OWNED BY stocks.id")
+        op.execute("DROP TABLE stocks_partitioned")
+
+    op.create_index("ix_stocks_ticker", "stocks", ["ticker"])
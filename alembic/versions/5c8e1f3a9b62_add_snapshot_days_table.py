@@ -0,0 +1,48 @@
+"""Add snapshot days table
+
+Revision ID: 5c8e1f3a9b62
+Revises: 8d2e4b6a1c37
+Create Date: 2026-10-17 11:24:09.318274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c8e1f3a9b62'
+down_revision: Union[str, Sequence[str], None] = '8d2e4b6a1c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    The table starts empty; move closed yfinance days into it with ``python compaction.py``.
+    """
+    if sa.inspect(op.get_bind()).has_table("snapshot_days"):
+        # Fresh databases get the table from Base.metadata.create_all
+        return
+
+    op.create_table(
+        "snapshot_days",
+        sa.Column("ticker", sa.String(length=10), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("first_time", sa.Integer(), nullable=False),
+        sa.Column("last_time", sa.Integer(), nullable=False),
+        sa.Column("rows", sa.Integer(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint("ticker", "day"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema.
+
+    Compacted days are dropped with the table; restore them first with
+    ``python compaction.py --expand``.
+    """
+    op.drop_table("snapshot_days")
@@ -0,0 +1,42 @@
+"""Add backfill checkpoints table
+
+Revision ID: 7baffcd74ded
+Revises: 120feaba15ba
+Create Date: 2026-10-17 04:31:45.970005
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7baffcd74ded'
+down_revision: Union[str, Sequence[str], None] = '120feaba15ba'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if sa.inspect(op.get_bind()).has_table("backfill_checkpoints"):
+        # Fresh databases get the table from Base.metadata.create_all
+        return
+
+    op.create_table(
+        "backfill_checkpoints",
+        sa.Column("ticker", sa.String(length=10), nullable=False),
+        sa.Column("timespan", sa.String(length=10), nullable=False),
+        sa.Column("multiplier", sa.Integer(), nullable=False),
+        sa.Column("shard_start", sa.Date(), nullable=False),
+        sa.Column("shard_end", sa.Date(), nullable=False),
+        sa.Column("rows", sa.Integer(), nullable=False),
+        sa.Column("completed_at", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("ticker", "timespan", "multiplier", "shard_start", "shard_end"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("backfill_checkpoints")
@@ -0,0 +1,49 @@
+"""Add stock rollups table
+
+Revision ID: 8d2e4b6a1c37
+Revises: 3f1c9a7d2e54
+Create Date: 2026-10-17 10:02:41.551093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e4b6a1c37'
+down_revision: Union[str, Sequence[str], None] = '3f1c9a7d2e54'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    The table starts empty; fill it for existing data with ``python rollups.py``.
+    """
+    if sa.inspect(op.get_bind()).has_table("stock_rollups"):
+        # Fresh databases get the table from Base.metadata.create_all
+        return
+
+    op.create_table(
+        "stock_rollups",
+        sa.Column("ticker", sa.String(length=10), nullable=False),
+        sa.Column("resolution", sa.String(length=4), nullable=False),
+        sa.Column("source", sa.String(length=16), nullable=False),
+        sa.Column("bucket", sa.Integer(), nullable=False),
+        sa.Column("open", sa.Float(), nullable=True),
+        sa.Column("high", sa.Float(), nullable=False),
+        sa.Column("low", sa.Float(), nullable=False),
+        sa.Column("close", sa.Float(), nullable=True),
+        sa.Column("volume", sa.Float(), nullable=False),
+        sa.Column("vwap", sa.Float(), nullable=True),
+        sa.Column("bars", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("ticker", "resolution", "source", "bucket"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("stock_rollups")
@@ -0,0 +1,53 @@
+"""Add indicator tables
+
+Revision ID: 9e4d2b7c1f08
+Revises: 5c8e1f3a9b62
+Create Date: 2026-10-17 13:41:52.604187
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4d2b7c1f08'
+down_revision: Union[str, Sequence[str], None] = '5c8e1f3a9b62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    Both tables start empty; compute indicators for existing bars with ``python indicators.py``.
+    """
+    inspector = sa.inspect(op.get_bind())
+    # Fresh databases get the tables from Base.metadata.create_all
+    if not inspector.has_table("stock_indicators"):
+        op.create_table(
+            "stock_indicators",
+            sa.Column("ticker", sa.String(length=10), nullable=False),
+            sa.Column("source", sa.String(length=16), nullable=False),
+            sa.Column("name", sa.String(length=32), nullable=False),
+            sa.Column("time", sa.Integer(), nullable=False),
+            sa.Column("value", sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint("ticker", "source", "name", "time"),
+        )
+    if not inspector.has_table("indicator_state"):
+        op.create_table(
+            "indicator_state",
+            sa.Column("ticker", sa.String(length=10), nullable=False),
+            sa.Column("source", sa.String(length=16), nullable=False),
+            sa.Column("last_time", sa.Integer(), nullable=False),
+            sa.Column("bars", sa.Integer(), nullable=False),
+            sa.Column("state", sa.JSON(), nullable=False),
+            sa.PrimaryKeyConstraint("ticker", "source"),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("indicator_state")
+    op.drop_table("stock_indicators")
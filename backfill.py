@@ -1,106 +1,569 @@
 import os
+import queue
 import sys
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 
 import click
 from loguru import logger
 from polygon import RESTClient
+from sqlalchemy import func, select
 
-from database import Stock, get_session
+from aggs_cache import AggsCache, window_closed, window_day
+from database import BackfillCheckpoint, Stock, engine, ensure_partitions
+from gaps import scan_gaps
+from market_check import MARKET_TZ
+from metrics import instrumented, registry, stage, with_stage_records
+from ratelimit import TokenBucket, call_with_backoff
+from settings import (
+    BACKFILL_MAX_RETRIES,
+    BACKFILL_QUEUE_BATCHES,
+    BACKFILL_SHARD_DAYS,
+    BACKFILL_WORKERS,
+    BATCH_COMMIT_SIZE,
+    METRICS_FILE,
+    METRICS_PORT,
+    POLYGON_REQUESTS_PER_MINUTE,
+)
+from writers import WRITERS, get_writer, insert_ignore_statement
+
+# One ticker over an inclusive date range; from_ is what list_aggs is asked for
+# (a date string, or a millisecond timestamp when resuming mid-range), and to
+# an optional millisecond timestamp to stop at before the end of the last day
+Shard = namedtuple("Shard", ["ticker", "start", "end", "from_", "to"], defaults=(None,))
+
+# Shard boundaries fall on multiples of --shard-days from this date (a Monday,
+# so weekly shards run Monday to Sunday); runs on different days then plan
+# the same shards and find each other's checkpoints
+SHARD_EPOCH = date(2000, 1, 3)
+
+# Base aggregates per list_aggs page (the limit requested), and at most per calendar day of
+# each intraday timespan; --shard-days is capped so a shard's response is a single page
+PAGE_LIMIT = 50000
+BASE_AGGS_PER_DAY = {"minute": 24 * 60, "hour": 24}
+
+
+class Cancelled(Exception):
+    """Raised in fetch workers when the writer side has stopped."""
 
 
 @click.command()
-@click.argument("ticker")
+@click.argument("tickers", nargs=-1)
+@click.option("--tickers-file", type=click.Path(exists=True, dir_okay=False),
+              help="File with one ticker per line (blank lines and # comments ignored)")
 @click.option("--days", default=90, help="Number of days to fetch (default: 90)")
 @click.option("--interval", default="minute", help="Time interval: minute, hour, day (default: minute)")
 @click.option("--multiplier", default=1, help="Multiplier for interval (default: 1)")
+@click.option("--incremental", is_flag=True,
+              help="Only fetch bars newer than the latest one already stored for each ticker")
+@click.option("--gaps", is_flag=True,
+              help="Only fetch regular-session minutes missing from the database (minute bars only)")
+@click.option("--min-gap-minutes", default=1,
+              help="With --gaps, ignore gaps shorter than this many minutes (default: 1)")
+@click.option("--shard-days", default=BACKFILL_SHARD_DAYS,
+              help=f"Days per fetch shard (default: {BACKFILL_SHARD_DAYS})")
+@click.option("--resume/--no-resume", default=True,
+              help="Skip shards already recorded as complete (default: resume)")
+@click.option("--workers", default=BACKFILL_WORKERS,
+              help=f"Number of shards fetched concurrently (default: {BACKFILL_WORKERS})")
+@click.option("--rate-limit", default=POLYGON_REQUESTS_PER_MINUTE,
+              help=f"Polygon requests per minute shared by all workers (default: {POLYGON_REQUESTS_PER_MINUTE})")
+@click.option("--max-retries", default=BACKFILL_MAX_RETRIES,
+              help=f"Retries with exponential backoff on 429/5xx responses (default: {BACKFILL_MAX_RETRIES})")
+@click.option("--writer", "writer_name", default="auto", type=click.Choice(["auto", *WRITERS]),
+              help="Bulk writer: auto picks COPY on PostgreSQL, executemany elsewhere (default: auto)")
+@click.option("--batch-size", default=BATCH_COMMIT_SIZE,
+              help=f"Rows per committed batch (default: {BATCH_COMMIT_SIZE})")
+@click.option("--cache/--no-cache", default=True,
+              help="Serve closed windows from the on-disk aggregates cache and store new ones (default: on)")
+@click.option("--replay", is_flag=True,
+              help="Rebuild from the aggregates cache alone, without calling Polygon")
+@click.option("--rollups/--no-rollups", default=True,
+              help="Update 5m/1h/1d rollups as batches are written; skip for a bulk load and "
+                   "rebuild afterwards with rollups.py (default: on)")
+@click.option("--metrics-file", default=METRICS_FILE,
+              help="Write Prometheus metrics to this textfile when the run ends (default: $METRICS_FILE)")
+@click.option("--metrics-port", default=METRICS_PORT,
+              help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running (default: off)")
+@click.option("--profile", type=click.Path(dir_okay=False),
+              help="Profile the run with the sampling profiler and write the stats to this file")
+@click.option("--log-json", is_flag=True, help="Emit log records as JSON lines")
 @click.option("--debug", is_flag=True, help="Enable debug logging")
-def main(ticker, days, interval, multiplier, debug):
-    """Fetch stock data for TICKER and save to database."""
+def main(tickers, tickers_file, days, interval, multiplier, incremental, gaps, min_gap_minutes, shard_days,
+         resume, workers, rate_limit, max_retries, writer_name, batch_size, cache, replay, rollups, metrics_file,
+         metrics_port, profile, log_json, debug):
+    """Fetch stock data for one or more TICKERS and save to database.
+
+    Examples:
+        python backfill.py AAPL
+        python backfill.py AAPL MSFT GOOGL --days 30
+        python backfill.py --tickers-file universe.txt --workers 8 --rate-limit 100
+
+    The date range is split into --shard-days shards fetched concurrently.
+    Each fully closed shard is checkpointed once its bars are committed, so a
+    killed run picks up at the first unfinished shard. Shards sit on a fixed
+    calendar grid, so a rerun on a later day skips them too.
+
+    With --gaps, the stored bars are compared against the NYSE session minutes
+    of the last --days days and only the missing ranges are requested.
+
+    Complete responses for windows that ended before today are kept in a
+    compressed on-disk cache (AGGS_CACHE_DIR), so a rerun after a failed
+    write doesn't spend API quota on them again. With --replay, every cached
+    response for TICKERS (all cached tickers if none are given) at
+    --interval/--multiplier is written to the database without an API key;
+    the date range options don't apply.
+    """
     # Configure logging
     logger.remove()  # Remove default handler
-    if debug:
+    if log_json:
+        # Per-stage timings are DEBUG records; JSON logs carry them without --debug too
+        logger.add(sys.stderr, level="DEBUG", serialize=True, filter=None if debug else with_stage_records)
+    elif debug:
         logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
     else:
         logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
-    
-    logger.info(f"Starting data fetch for {ticker}")
-    logger.debug(f"Parameters: days={days}, interval={interval}, multiplier={multiplier}")
-    
+
+    with instrumented(metrics_file, metrics_port, profile):
+        backfill(tickers, tickers_file, days, interval, multiplier, incremental, shard_days, resume, workers,
+                 rate_limit, max_retries, writer_name, batch_size, rollups, gaps, min_gap_minutes, cache, replay)
+
+
+def backfill(tickers, tickers_file, days, interval, multiplier, incremental, shard_days, resume, workers,
+             rate_limit, max_retries, writer_name, batch_size, rollups, gaps=False, min_gap_minutes=1,
+             cache=True, replay=False):
+    """Run one backfill with already-parsed ``main`` options."""
+    tickers = load_tickers(tickers, tickers_file)
+    if not tickers and not replay:
+        raise click.UsageError("Provide at least one TICKER or --tickers-file")
+    if gaps and (interval != "minute" or multiplier != 1 or incremental):
+        raise click.UsageError("--gaps works on 1-minute bars only and can't be combined with --incremental")
+    if replay and (gaps or incremental):
+        raise click.UsageError("--replay can't be combined with --gaps or --incremental")
+    if not replay and shard_days * BASE_AGGS_PER_DAY.get(interval, 1) > PAGE_LIMIT:
+        raise click.UsageError(f"--shard-days {shard_days} may not fit one {PAGE_LIMIT}-bar page of {interval} bars; "
+                               f"use at most {PAGE_LIMIT // BASE_AGGS_PER_DAY[interval]}")
+    cache = AggsCache() if cache or replay else None
+
+    if replay:
+        shards = plan_replay_shards(cache, tickers, interval, multiplier)
+        tickers = list(dict.fromkeys(shard.ticker for shard in shards))
+        if not tickers:
+            logger.warning(f"No cached {multiplier} {interval} responses in {cache.directory}")
+            return
+
+        logger.info(f"Replaying {len(shards)} cached response(s) for {len(tickers)} ticker(s)")
+        run_shards(None, None, shards, tickers, interval, multiplier, workers, max_retries, writer_name,
+                   batch_size, rollups, cache, checkpoint=False)
+        return
+
+    logger.info(f"Starting data fetch for {len(tickers)} ticker(s): {', '.join(tickers)}")
+    logger.debug(f"Parameters: days={days}, interval={interval}, multiplier={multiplier}, "
+                 f"shard_days={shard_days}, workers={workers}, rate_limit={rate_limit}/min")
+
     api_key = os.getenv("POLYGON_API_KEY")
     if not api_key:
         logger.error("POLYGON_API_KEY environment variable not set")
         return
 
-    logger.debug("Initializing Polygon client and database session")
-    client = RESTClient(api_key=api_key)
-    session = get_session()
+    logger.debug("Initializing Polygon client")
+    # Retries are handled by call_with_backoff so 429s back off instead of burning quota
+    client = RESTClient(api_key=api_key, retries=0)
+    limiter = TokenBucket(rate_limit, period=60.0)
 
-    # Calculate date range
-    to_date = datetime.now()
-    from_date = to_date - timedelta(days=days)
+    if gaps:
+        # Gap ranges aren't the planned shards, so they are never skipped
+        shards = plan_gap_shards(tickers, days, shard_days, min_gap_minutes)
+    else:
+        shards = plan_shards(tickers, days, shard_days, incremental)
+    if resume and not gaps:
+        done = completed_shards(tickers, interval, multiplier)
+        skipped = [shard for shard in shards if is_completed(shard, done)]
+        shards = [shard for shard in shards if not is_completed(shard, done)]
+        if skipped:
+            logger.info(f"Skipping {len(skipped)} shard(s) already completed by a previous run")
+    logger.info(f"Fetching {len(shards)} shard(s) of up to {shard_days} day(s)")
+    # Gap ranges aren't the planned shards, so they are never checkpointed
+    run_shards(client, limiter, shards, tickers, interval, multiplier, workers, max_retries, writer_name,
+               batch_size, rollups, cache, checkpoint=not gaps)
 
-    logger.info(f"Fetching {multiplier} {interval} data from {from_date.date()} to {to_date.date()}")
+
+def run_shards(client, limiter, shards, tickers, interval, multiplier, workers, max_retries, writer_name,
+               batch_size, rollups, cache, checkpoint=True):
+    """Fetch ``shards`` concurrently and write their bars; exits with status 1 if any ticker failed.
+
+    With no ``client``, every shard must be served from ``cache``.
+    """
+    writer = get_writer(name=writer_name, batch_size=batch_size, rollups=rollups)
+    logger.debug(f"Using {writer.name} writer with batches of {batch_size}")
+    if shards:
+        ensure_partitions(start_time=int(datetime.combine(min(shard.start for shard in shards),
+                                                          datetime.min.time()).timestamp()))
+
+    # Fetch workers push ("rows" | "done" | "failed", shard, payload) items;
+    # the bound keeps memory flat when the database is slower than the API
+    results = queue.Queue(maxsize=BACKFILL_QUEUE_BATCHES)
+    stop = threading.Event()
+
+    def put(item):
+        while True:
+            try:
+                results.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if stop.is_set():
+                    raise Cancelled()
+
+    def fetch(shard):
+        try:
+            count = fetch_shard(client, limiter, shard, interval, multiplier, batch_size, max_retries, put, cache)
+        except Cancelled:
+            return
+        except Exception as e:
+            put(("failed", shard, e))
+        else:
+            put(("done", shard, count))
+
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(shards))),
+                                  thread_name_prefix="backfill")
+    shards_left = Counter(shard.ticker for shard in shards)
+    fetched = Counter()
+    failed = set()
+    # Shards whose rows have all been handed to the writer, awaiting its next commit
+    pending_checkpoints = []
 
     try:
+        for shard in shards:
+            executor.submit(fetch, shard)
+
         count = 0
-        logger.debug(f"Starting API request to Polygon for {ticker}")
-        
-        for agg in client.list_aggs(
-            ticker=ticker,
-            multiplier=multiplier,
-            timespan=interval,
-            from_=from_date.strftime("%Y-%m-%d"),
-            to=to_date.strftime("%Y-%m-%d"),
-            limit=50000,
-        ):
-            # Create Stock record
-            timestamp = int(agg.timestamp / 1000)
-            avg_price = agg.vwap if hasattr(agg, 'vwap') and agg.vwap else (agg.high + agg.low) / 2
-            
-            logger.debug(f"Processing bar: time={datetime.fromtimestamp(timestamp)}, "
-                        f"OHLC={agg.open}/{agg.high}/{agg.low}/{agg.close}, "
-                        f"volume={agg.volume}")
-            
-            stock = Stock(
-                ticker=ticker,
-                time=timestamp,
-                high=agg.high,
-                low=agg.low,
-                avg=avg_price,
-                sale=agg.close,
-                meta={
-                    "open": agg.open,
-                    "volume": agg.volume,
-                    "transactions": agg.transactions if hasattr(agg, 'transactions') else None,
-                    "vwap": agg.vwap if hasattr(agg, 'vwap') else None,
-                }
-            )
-            session.add(stock)
-            count += 1
-
-            # Commit in batches
-            if count % 1000 == 0:
-                session.commit()
-                logger.info(f"Saved {count} records...")
-                logger.debug("Batch committed to database")
-
-        # Final commit
-        session.commit()
-        logger.success(f"Successfully saved {count} records for {ticker}")
-        
-        if count == 0:
-            logger.warning("No data was returned from the API")
+        remaining = len(shards)
+        with writer:
+            while remaining:
+                kind, shard, payload = results.get()
+                if kind == "rows":
+                    for row in payload:
+                        count += 1
+                        # Commit in batches
+                        if writer.add(row):
+                            logger.info(f"Saved {count} records...")
+                            record_checkpoints(pending_checkpoints, interval, multiplier)
+                            pending_checkpoints = []
+                    continue
+
+                remaining -= 1
+                shards_left[shard.ticker] -= 1
+                if kind == "done":
+                    fetched[shard.ticker] += payload
+                    logger.debug(f"Fetched {payload} bars for {shard.ticker} {shard.start}..{shard.end}")
+                    if checkpoint:
+                        pending_checkpoints.append((shard, payload))
+                else:
+                    failed.add(shard.ticker)
+                    registry.count("errors", stage="fetch", source="polygon")
+                    logger.error(f"Error fetching {shard.ticker} {shard.start}..{shard.end}: "
+                                 f"{type(payload).__name__}: {payload}")
+
+                if shards_left[shard.ticker] == 0 and shard.ticker not in failed:
+                    logger.info(f"Fetched {fetched[shard.ticker]} bars for {shard.ticker}")
+                    if fetched[shard.ticker] == 0:
+                        logger.warning(f"No data was returned from the API for {shard.ticker}")
+
+        # Final batch is committed when the writer block exits
+        record_checkpoints(pending_checkpoints, interval, multiplier)
+
+        elapsed = time.monotonic() - started
+        rate = count / elapsed if elapsed else 0.0
+        if cache is not None:
+            logger.info(f"Served {cache.hits} shard(s) from the aggregates cache, stored {cache.stored} new response(s)")
+        logger.success(f"Successfully saved {count} records for {len(tickers) - len(failed)} ticker(s) "
+                       f"in {elapsed:.1f}s ({rate:,.0f} rows/sec overall, "
+                       f"{writer.rows_per_second():,.0f} rows/sec writing with {writer.name} writer)")
 
     except Exception as e:
-        session.rollback()
         logger.error(f"Error occurred: {type(e).__name__}: {e}")
-        logger.debug("Database transaction rolled back")
+        logger.debug("Unwritten batch discarded")
         raise
     finally:
-        session.close()
-        logger.debug("Database session closed")
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if failed:
+        logger.error(f"Failed ticker(s): {', '.join(sorted(failed))}")
+        sys.exit(1)
+
+
+def load_tickers(tickers, tickers_file=None):
+    """Combine command-line tickers with those in ``tickers_file``, dropping duplicates."""
+    symbols = list(tickers)
+    if tickers_file:
+        with open(tickers_file) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    symbols.append(line)
+    return list(dict.fromkeys(symbol.upper() for symbol in symbols))
+
+
+def plan_shards(tickers, days, shard_days, incremental=False, today=None):
+    """Split the last ``days`` days into ``shard_days``-day shards for every ticker.
+
+    Shards are cells of a fixed ``shard_days`` grid starting at SHARD_EPOCH;
+    only the first and last are clipped to the range. With ``incremental``,
+    each ticker's range starts just after its newest stored bar.
+    """
+    today = today or datetime.now().date()
+    shards = []
+
+    for ticker in tickers:
+        start = today - timedelta(days=days)
+        from_ = None
+
+        if incremental:
+            latest = latest_bar_time(ticker)
+            if latest is not None:
+                # Polygon accepts millisecond timestamps; start just after the stored bar
+                start = datetime.fromtimestamp(latest).date()
+                from_ = (latest + 1) * 1000
+                logger.info(f"Resuming {ticker} after latest stored bar at {datetime.fromtimestamp(latest)}")
+            else:
+                logger.info(f"No stored bars for {ticker}, fetching the full {days} day(s)")
+
+        logger.info(f"Fetching data for {ticker} from {start} to {today}")
+
+        while start <= today:
+            cell_end = start + timedelta(days=shard_days - 1 - (start - SHARD_EPOCH).days % shard_days)
+            end = min(cell_end, today)
+            shards.append(Shard(ticker, start, end, from_ or start.strftime("%Y-%m-%d")))
+            start = end + timedelta(days=1)
+            from_ = None
+
+    return shards
+
+
+def plan_gap_shards(tickers, days, shard_days, min_minutes=1):
+    """Return one shard per missing range in the last ``days`` days, split every ``shard_days`` days.
+
+    Each shard requests exactly its range's first through last missing bar.
+    Days are ET trading dates, as in gaps.py.
+    """
+    today = datetime.now(MARKET_TZ).date()
+    found = scan_gaps(tickers, today - timedelta(days=days), today, min_minutes)
+    step = shard_days * 86400
+    shards = []
+
+    for ticker, gaps in found.items():
+        minutes = sum(gap.minutes for gap in gaps)
+        logger.info(f"Found {minutes} missing minute(s) in {len(gaps)} gap(s) for {ticker}")
+        for gap in gaps:
+            for first in range(gap.first, gap.last + 1, step):
+                last = min(first + step - 60, gap.last)
+                shards.append(Shard(ticker, datetime.fromtimestamp(first, MARKET_TZ).date(),
+                                    datetime.fromtimestamp(last, MARKET_TZ).date(), first * 1000, last * 1000))
+
+    return shards
+
+
+def plan_replay_shards(cache, tickers, interval, multiplier):
+    """Return one shard per response in ``cache`` for ``tickers`` (all if empty) at this interval."""
+    return [
+        Shard(key["ticker"], window_day(key["from_"]), window_day(key["to"]), key["from_"], key["to"])
+        for key, _ in cache.entries(tickers)
+        if key["timespan"] == interval and key["multiplier"] == multiplier
+    ]
+
+
+def completed_shards(tickers, interval, multiplier):
+    """Return {ticker: [(shard_start, shard_end), ...]} for shards checkpointed by earlier runs."""
+    query = select(BackfillCheckpoint.ticker, BackfillCheckpoint.shard_start, BackfillCheckpoint.shard_end).where(
+        BackfillCheckpoint.ticker.in_(tickers),
+        BackfillCheckpoint.timespan == interval,
+        BackfillCheckpoint.multiplier == multiplier,
+    )
+    done = {}
+    with engine.connect() as conn:
+        for ticker, start, end in conn.execute(query):
+            done.setdefault(ticker, []).append((start, end))
+    return done
+
+
+def is_completed(shard, done):
+    """True if a checkpoint in ``done`` (from ``completed_shards``) covers all of ``shard``.
+
+    Covering rather than equal ranges, so a first shard clipped to a later
+    start is still found in the checkpoint of an earlier run's first shard.
+    """
+    return any(start <= shard.start and shard.end <= end for start, end in done.get(shard.ticker, ()))
+
+
+def record_checkpoints(shards, interval, multiplier):
+    """Checkpoint finished ``(shard, rows)`` pairs whose date range is fully in the past.
+
+    Call only after the writer has committed every row of these shards. Today's
+    shard is never checkpointed because more bars can still arrive for it.
+    """
+    today = datetime.now().date()
+    records = [
+        {
+            "ticker": shard.ticker,
+            "timespan": interval,
+            "multiplier": multiplier,
+            "shard_start": shard.start,
+            "shard_end": shard.end,
+            "rows": rows,
+            "completed_at": int(time.time()),
+        }
+        for shard, rows in shards
+        if shard.end < today
+    ]
+    if not records:
+        return
+    with stage("checkpoint"), engine.begin() as conn:
+        conn.execute(insert_ignore_statement(conn, BackfillCheckpoint.__table__, None), records)
+    logger.debug(f"Checkpointed {len(records)} completed shard(s)")
+
+
+def fetch_shard(client, limiter, shard, interval, multiplier, batch_size, max_retries, put, cache=None):
+    """Fetch all bars in ``shard`` and ``put`` them as ("rows", shard, [row, ...]) batches.
+
+    Each request waits for a token from ``limiter``, and so does each further
+    page the client follows should a response outgrow PAGE_LIMIT. When a
+    request fails with a transient error it is retried with backoff, resuming
+    after the last bar already handed to the writer. Returns the number of
+    bars fetched.
+
+    A shard whose window ended before today is served from ``cache`` when it
+    holds the response, without a request or a rate-limit token; otherwise
+    the complete response is stored there once fetched.
+
+    Time spent converting bars and waiting for room in the writer queue is
+    recorded as the ``transform`` and ``queue_wait`` stages; the rest of each
+    request is the ``fetch`` stage.
+    """
+    count = 0
+    batch = []
+    resume_from = shard.from_
+    to = shard.to or shard.end.strftime("%Y-%m-%d")
+    key = (shard.ticker, interval, multiplier, shard.from_, to)
+    cacheable = cache is not None and window_closed(to)
+
+    if cacheable:
+        with stage("cache_read", source="polygon"):
+            cached = cache.get(*key)
+        if cached is not None:
+            logger.debug(f"Serving {shard.ticker} from {shard.from_} to {to} from the aggregates cache")
+            for first in range(0, len(cached), batch_size):
+                batch = [agg_to_row(shard.ticker, agg) for agg in cached[first:first + batch_size]]
+                put(("rows", shard, batch))
+                registry.count("rows", len(batch), stage="cache", source="polygon")
+            return len(cached)
+    if client is None:
+        raise LookupError(f"No cached response for {shard.ticker} from {shard.from_} to {to}")
+    # Every agg of the response so far, kept for the cache
+    received = []
+
+    def request():
+        nonlocal count, batch, resume_from
+        # A retry re-requests everything after the last batch handed to the writer
+        count -= len(batch)
+        del received[len(received) - len(batch):]
+        batch = []
+        with stage("rate_limit_wait", source="polygon"):
+            limiter.acquire()
+        logger.debug(f"Starting API request to Polygon for {shard.ticker} from {resume_from} to {to}")
+        registry.count("requests", source="polygon")
+        started = time.perf_counter()
+        transform = queue_wait = limited = 0.0
+        paged = 0
+        try:
+            for agg in client.list_aggs(
+                ticker=shard.ticker,
+                multiplier=multiplier,
+                timespan=interval,
+                from_=resume_from,
+                to=to,
+                limit=50000,
+            ):
+                converted = time.perf_counter()
+                row = agg_to_row(shard.ticker, agg)
+                transform += time.perf_counter() - converted
+                batch.append(row)
+                if cacheable:
+                    received.append(agg)
+                count += 1
+                paged += 1
+                if paged % PAGE_LIMIT == 0:
+                    # The client follows next_url for the rest; that request needs a token too
+                    waited = time.perf_counter()
+                    with stage("rate_limit_wait", source="polygon"):
+                        limiter.acquire()
+                    limited += time.perf_counter() - waited
+                    registry.count("requests", source="polygon")
+                if len(batch) >= batch_size:
+                    waited = time.perf_counter()
+                    put(("rows", shard, batch))
+                    queue_wait += time.perf_counter() - waited
+                    registry.count("rows", len(batch), stage="fetch", source="polygon")
+                    batch = []
+                    resume_from = (row["time"] + 1) * 1000
+        finally:
+            registry.observe("fetch", time.perf_counter() - started - transform - queue_wait - limited,
+                             source="polygon")
+            registry.observe("transform", transform, source="polygon")
+            registry.observe("queue_wait", queue_wait, source="polygon")
+
+    call_with_backoff(request, max_retries=max_retries,
+                      description=f"{shard.ticker} {shard.start}..{shard.end} aggregates")
+    if cacheable:
+        # Stored before the last batch is queued, so a failing writer can't lose a complete response
+        try:
+            with stage("cache_write", source="polygon"):
+                cache.put(*key, received)
+        except OSError as e:
+            logger.warning(f"Couldn't cache {shard.ticker} from {shard.from_} to {to}: {type(e).__name__}: {e}")
+    if batch:
+        put(("rows", shard, batch))
+        registry.count("rows", len(batch), stage="fetch", source="polygon")
+    return count
+
+
+def agg_to_row(ticker, agg):
+    """Convert a Polygon aggregate into a ``stocks`` row dict."""
+    timestamp = int(agg.timestamp / 1000)
+    avg_price = agg.vwap if hasattr(agg, 'vwap') and agg.vwap else (agg.high + agg.low) / 2
+
+    logger.debug(f"Processing bar: time={datetime.fromtimestamp(timestamp)}, "
+                f"OHLC={agg.open}/{agg.high}/{agg.low}/{agg.close}, "
+                f"volume={agg.volume}")
+
+    return {
+        "ticker": ticker,
+        "time": timestamp,
+        "high": agg.high,
+        "low": agg.low,
+        "avg": avg_price,
+        "sale": agg.close,
+        "open": agg.open,
+        "close": agg.close,
+        "volume": agg.volume,
+        "vwap": agg.vwap if hasattr(agg, 'vwap') else None,
+        "transactions": agg.transactions if hasattr(agg, 'transactions') else None,
+        "source": "polygon",
+        # Sparse extras only
+        "meta": {"otc": True} if getattr(agg, 'otc', None) else None,
+    }
+
+
+def latest_bar_time(ticker):
+    """Return the Unix time of the newest non-yfinance bar stored for ``ticker``, or None."""
+    query = select(func.max(Stock.time)).where(Stock.ticker == ticker, Stock.source != "yfinance")
+    with engine.connect() as conn:
+        return conn.execute(query).scalar()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
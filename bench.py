@@ -0,0 +1,302 @@
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import click
+from loguru import logger
+
+RESULTS_DIR = "bench_results"
+
+# Regular-session minute bars per ticker per weekday served by FakePolygonClient
+BARS_PER_DAY = 390
+
+# Metrics printed by `run` and compared by `compare`; True when larger is better
+METRICS = {
+    "rows_per_second": True,
+    "mb_per_second": True,
+    "cycle_p50_seconds": False,
+    "cycle_p95_seconds": False,
+    "peak_rss_mb": False,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def reset_database():
+    """Empty the tables a case writes to, so every case starts from the same state."""
+    from sqlalchemy import text
+
+    from database import engine
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("TRUNCATE stocks, stock_rollups, backfill_checkpoints RESTART IDENTITY"))
+        else:
+            for table in ("stocks", "stock_rollups", "backfill_checkpoints"):
+                conn.execute(text(f"DELETE FROM {table}"))
+
+
+def count_rows():
+    from sqlalchemy import func, select
+
+    from database import Stock, engine
+
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(Stock)).scalar()
+
+
+def run_ingest(spec):
+    """Backfill ``spec["tickers"]`` from FakePolygonClient through the real ``backfill.py`` command."""
+    import backfill
+    from fake_sources import FakePolygonClient
+
+    reset_database()
+    client = FakePolygonClient(spec["latency"])
+    backfill.RESTClient = lambda api_key, retries: client
+    os.environ.setdefault("POLYGON_API_KEY", "bench")
+
+    # --no-cache so every run measures fetching rather than reads of an earlier run's responses
+    args = [*spec["tickers"], "--days", str(spec["days"]), "--no-resume", "--no-cache", "--rate-limit", "1000000",
+            "--workers", str(spec["workers"]), "--batch-size", str(spec["batch_size"]),
+            "--rollups" if spec["rollups"] else "--no-rollups"]
+    started = time.perf_counter()
+    backfill.main.main(args, standalone_mode=False)
+    seconds = time.perf_counter() - started
+    rows = count_rows()
+    return {"rows": rows, "seconds": round(seconds, 3), "rows_per_second": round(rows / seconds, 1),
+            "requests": client.requests}
+
+
+def run_export(spec):
+    """Dump the rows left by the matching ingest case with ``export_data.export_file``."""
+    from export_data import export_file
+    from settings import EXPORT_PAGE_SIZE
+
+    path = os.path.join(spec["workdir"], f"export.{spec['format']}.sql")
+    started = time.perf_counter()
+    rows = export_file(path, spec["format"], "none", "stocks", None, 1000, EXPORT_PAGE_SIZE)
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(path)
+    os.remove(path)
+    return {"rows": rows, "seconds": round(seconds, 3), "bytes": size,
+            "rows_per_second": round(rows / seconds, 1), "mb_per_second": round(size / 1e6 / seconds, 2)}
+
+
+def run_cycle(spec):
+    """Run yfinance_fetcher monitor cycles against FakeYFTicker objects and time each one."""
+    from fundamentals import FundamentalsCache
+    from fake_sources import FakeYFTicker
+    from writers import get_writer
+    from yfinance_fetcher import fetch_cycle
+
+    reset_database()
+    tickers = [f"T{number:04d}" for number in range(spec["tickers"])]
+    yf_tickers = {ticker: FakeYFTicker(ticker, spec["latency"]) for ticker in tickers}
+    states = {}
+    fundamentals = FundamentalsCache(path=None)
+    writer = get_writer()
+
+    durations = []
+    for _ in range(spec["cycles"]):
+        started = time.perf_counter()
+        fetch_cycle(writer, tickers, yf_tickers=yf_tickers, workers=spec["workers"], states=states,
+                    fundamentals=fundamentals)
+        durations.append(time.perf_counter() - started)
+        # Cycles share a (ticker, time) key within the same second; keep them apart
+        time.sleep(max(0.0, 1.0 - durations[-1]))
+    return {"rows": writer.rows_written, "cycles": len(durations),
+            "cycle_p50_seconds": round(percentile(durations, 0.5), 4),
+            "cycle_p95_seconds": round(percentile(durations, 0.95), 4),
+            "cycle_max_seconds": round(max(durations), 4)}
+
+
+CASES = {"ingest": run_ingest, "export": run_export, "cycle": run_cycle}
+
+
+@click.group()
+def main():
+    """Offline benchmarks for backfill.py, yfinance_fetcher.py and export_data.py."""
+
+
+@main.command(hidden=True)
+@click.argument("spec")
+def case(spec):
+    """Run one benchmark case (JSON SPEC) in this process and print its result as JSON."""
+    logger.remove()
+    logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+    spec = json.loads(spec)
+    result = CASES[spec["case"]](spec)
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def run_case(spec, database_url, debug):
+    """Run ``spec`` in a fresh interpreter so the engine and peak RSS belong to that case alone."""
+    env = {**os.environ, "DATABASE_URL": database_url, "STORAGE_BACKEND": "sql"}
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), "case", json.dumps(spec)],
+                             env=env, capture_output=True, text=True)
+    if debug or process.returncode:
+        for line in process.stderr.splitlines():
+            logger.debug(f"  {line}")
+    if process.returncode:
+        raise click.ClickException(f"{spec['case']} case failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(",") if size.strip()]
+
+
+def summarize(result):
+    metrics = ", ".join(f"{name}={result[name]:,}" for name in METRICS if name in result)
+    label = " ".join(str(result[key]) for key in ("size", "format") if key in result)
+    return f"{result['target']:<8} {result['case']:<7} {label:<13} {metrics}"
+
+
+@main.command()
+@click.option("--targets", default="sqlite", help="Comma-separated targets: sqlite, postgres (default: sqlite)")
+@click.option("--postgres-url", envvar="BENCH_POSTGRES_URL",
+              help="Scratch PostgreSQL database for the postgres target; its tables are emptied "
+                   "(default: $BENCH_POSTGRES_URL)")
+@click.option("--sizes", default="10000,100000", help="Comma-separated ingest sizes in rows (default: 10000,100000)")
+@click.option("--tickers", default=4, help="Tickers per ingest case (default: 4)")
+@click.option("--polygon-latency", default=0.05, help="Seconds per fake Polygon page (default: 0.05)")
+@click.option("--workers", default=4, help="Backfill and fetch workers (default: 4)")
+@click.option("--batch-size", default=5000, help="Backfill rows per committed batch (default: 5000)")
+@click.option("--rollups/--no-rollups", default=True, help="Maintain rollups while ingesting (default: on)")
+@click.option("--export-formats", default="copy,insert", help="Comma-separated export formats (default: copy,insert)")
+@click.option("--cycle-tickers", default="13,100",
+              help="Comma-separated ticker counts for monitor cycles (default: 13,100)")
+@click.option("--cycles", default=5, help="Monitor cycles per case (default: 5)")
+@click.option("--yf-latency", default=0.2, help="Seconds per fake yfinance history call (default: 0.2)")
+@click.option("--output", "-o", default=None, help=f"Results file (default: {RESULTS_DIR}/<timestamp>.json)")
+@click.option("--debug", is_flag=True, help="Enable debug logging (includes each case's log output)")
+def run(targets, postgres_url, sizes, tickers, polygon_latency, workers, batch_size, rollups, export_formats,
+        cycle_tickers, cycles, yf_latency, output, debug):
+    """Benchmark ingest rows/sec, export MB/s and monitor cycle latency against fake data sources.
+
+    Every case runs in its own process against an empty database and reports
+    its peak RSS. Results are saved as JSON; compare two runs with
+    ``python bench.py compare OLD.json NEW.json``.
+    """
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    targets = [target.strip() for target in targets.split(",") if target.strip()]
+    unknown = set(targets) - {"sqlite", "postgres"}
+    if unknown:
+        raise click.UsageError(f"Unknown target(s): {', '.join(sorted(unknown))}")
+    if "postgres" in targets and not postgres_url:
+        raise click.UsageError("The postgres target needs --postgres-url or BENCH_POSTGRES_URL")
+
+    symbols = [f"B{number:03d}" for number in range(tickers)]
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    results = []
+    started = time.perf_counter()
+    try:
+        for target in targets:
+            database_url = postgres_url if target == "postgres" else f"sqlite:///{workdir}/bench.db"
+            for size in parse_sizes(sizes):
+                # Weekdays needed for ``size`` rows, stretched to calendar days
+                days = math.ceil(size / (tickers * BARS_PER_DAY) * 7 / 5)
+                ingest = {"case": "ingest", "tickers": symbols, "days": days, "latency": polygon_latency,
+                          "workers": workers, "batch_size": batch_size, "rollups": rollups}
+                results.append({"target": target, "case": "ingest", "size": size,
+                                **run_case(ingest, database_url, debug)})
+                logger.info(summarize(results[-1]))
+
+                for fmt in export_formats.split(","):
+                    export = {"case": "export", "format": fmt.strip(), "workdir": workdir}
+                    results.append({"target": target, "case": "export", "size": size, "format": fmt.strip(),
+                                    **run_case(export, database_url, debug)})
+                    logger.info(summarize(results[-1]))
+
+            for count in parse_sizes(cycle_tickers):
+                cycle = {"case": "cycle", "tickers": count, "cycles": cycles, "latency": yf_latency,
+                         "workers": workers}
+                results.append({"target": target, "case": "cycle", "size": count,
+                                **run_case(cycle, database_url, debug)})
+                logger.info(summarize(results[-1]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"targets": targets, "sizes": parse_sizes(sizes), "tickers": tickers,
+                       "polygon_latency": polygon_latency, "workers": workers, "batch_size": batch_size,
+                       "rollups": rollups, "cycle_tickers": parse_sizes(cycle_tickers), "cycles": cycles,
+                       "yf_latency": yf_latency},
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.success(f"Ran {len(results)} case(s) in {time.perf_counter() - started:.1f}s; results saved to {output}")
+
+
+def result_key(result):
+    return result["target"], result["case"], result.get("size"), result.get("format")
+
+
+@main.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("candidate", type=click.Path(exists=True, dir_okay=False))
+def compare(baseline, candidate):
+    """Print how each metric in CANDIDATE changed relative to BASELINE."""
+    with open(baseline) as f:
+        old = {result_key(result): result for result in json.load(f)["results"]}
+    with open(candidate) as f:
+        new = json.load(f)["results"]
+
+    for result in new:
+        previous = old.get(result_key(result))
+        if previous is None:
+            continue
+        changes = []
+        for name, higher_is_better in METRICS.items():
+            if name in result and previous.get(name):
+                change = (result[name] - previous[name]) / previous[name] * 100
+                better = (change > 0) == higher_is_better
+                changes.append(f"{name} {previous[name]:,} -> {result[name]:,} "
+                               f"({change:+.1f}%{'' if abs(change) < 1 else ' better' if better else ' worse'})")
+        label = result.get("format") or ""
+        click.echo(f"{result['target']} {result['case']} {result.get('size')} {label}".rstrip() + ":")
+        for change in changes:
+            click.echo(f"    {change}")
+
+
+if __name__ == "__main__":
+    main()
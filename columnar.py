@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+from sqlalchemy import func, select, text
+
+from database import Stock, engine
+from metrics import stage
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+MANIFEST_FILE = "_manifest.json"
+FILE_NAMES = {"parquet": "part.parquet", "arrow": "part.arrow"}
+
+BAR_COLUMNS = ("high", "low", "avg", "sale", "open", "close", "volume", "vwap")
+
+# Known meta keys get typed columns; anything else is kept as JSON in meta_other
+META_FIELDS = {
+    "day_high": "float64",
+    "day_low": "float64",
+    "previous_close": "float64",
+    "market_cap": "int64",
+    "pe_ratio": "float64",
+    "timestamp": "string",
+    "otc": "bool",
+}
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Columnar export needs the pyarrow package (pip install pyarrow)")
+    return pyarrow
+
+
+def arrow_schema(pa):
+    """Schema shared by every partition file; ``ticker`` and ``date`` live in the path."""
+    return pa.schema(
+        [pa.field("time", pa.timestamp("s", tz="UTC"), nullable=False)]
+        + [pa.field(column, pa.float64()) for column in BAR_COLUMNS]
+        + [pa.field("transactions", pa.int64()), pa.field("source", pa.dictionary(pa.int8(), pa.string()))]
+        + [pa.field(f"meta_{key}", pa.type_for_alias(alias)) for key, alias in META_FIELDS.items()]
+        + [pa.field("meta_other", pa.string())]
+    )
+
+
+def market_date(timestamp):
+    """ET trading date of a Unix timestamp, so a session's pre- and post-market land in one partition."""
+    return datetime.fromtimestamp(timestamp, MARKET_TZ).date()
+
+
+def day_bounds(day):
+    """Unix timestamps [start, end) of ET date ``day``."""
+    start = datetime.combine(day, datetime.min.time(), MARKET_TZ)
+    end = datetime.combine(day + timedelta(days=1), datetime.min.time(), MARKET_TZ)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def partition_fingerprints(where=None):
+    """Return {"TICKER/YYYY-MM-DD": [rows, max_id]} for every (ticker, ET date) partition.
+
+    Grouping is done per UTC hour in the database and folded into ET dates
+    here; ET offsets are whole hours, so an hour never spans two dates.
+    """
+    hour = (Stock.time // 3600).label("hour")
+    query = select(Stock.ticker, hour, func.count(), func.max(Stock.id)).group_by(Stock.ticker, hour)
+    if where:
+        query = query.where(text(where))
+
+    fingerprints = {}
+    with engine.connect() as conn:
+        for ticker, hour_value, rows, max_id in conn.execute(query):
+            key = f"{ticker}/{market_date(hour_value * 3600).isoformat()}"
+            previous = fingerprints.get(key, [0, 0])
+            fingerprints[key] = [previous[0] + rows, max(previous[1], max_id)]
+    return fingerprints
+
+
+def meta_value(value, alias):
+    """Coerce a meta value to its column type, or None if it doesn't parse as that type."""
+    if value is None:
+        return None
+    try:
+        if alias == "float64":
+            return float(value)
+        if alias == "int64":
+            return int(value)
+        if alias == "bool":
+            return bool(value)
+        return str(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def partition_table(pa, ticker, day, where=None):
+    """Read one (ticker, ET date) partition into an Arrow table sorted by time."""
+    start, end = day_bounds(day)
+    columns = [Stock.__table__.c[column] for column in ("time", *BAR_COLUMNS, "transactions", "source", "meta")]
+    query = (select(*columns)
+             .where(Stock.ticker == ticker, Stock.time >= start, Stock.time < end)
+             .order_by(Stock.time))
+    if where:
+        query = query.where(text(where))
+    with engine.connect() as conn:
+        rows = conn.execute(query).all()
+
+    data = {column: [getattr(row, column) for row in rows]
+            for column in ("time", *BAR_COLUMNS, "transactions", "source")}
+    metas = [row.meta or {} for row in rows]
+    for key, alias in META_FIELDS.items():
+        data[f"meta_{key}"] = [meta_value(meta.get(key), alias) for meta in metas]
+    data["meta_other"] = [
+        json.dumps(other) if (other := {k: v for k, v in meta.items() if k not in META_FIELDS}) else None
+        for meta in metas
+    ]
+    return pa.table(data, schema=arrow_schema(pa))
+
+
+def write_partition(pa, table, path, fmt):
+    """Write ``table`` to ``path`` atomically so readers never see a half-written file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if fmt == "parquet":
+        pa.parquet.write_table(table, tmp_path, compression="zstd")
+    else:
+        # Uncompressed IPC so readers can memory-map the columns without copying
+        pa.feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def load_manifest(output):
+    path = os.path.join(output, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(output, manifest):
+    path = os.path.join(output, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def export_columnar(output, fmt="parquet", where=None, full=False):
+    """Export ``stocks`` to ``output/ticker=T/date=YYYY-MM-DD/part.{parquet,arrow}``.
+
+    A manifest records each partition's row count and max ``id``; on re-runs
+    only partitions whose fingerprint changed are rewritten and partitions
+    that no longer have rows are removed. Returns (partitions written, rows written).
+    """
+    pa = import_pyarrow()
+    os.makedirs(output, exist_ok=True)
+
+    manifest = load_manifest(output)
+    if full or manifest.get("format") != fmt or manifest.get("where") != where:
+        previous = {}
+    else:
+        previous = manifest.get("partitions", {})
+
+    current = partition_fingerprints(where)
+    changed = sorted(key for key, fingerprint in current.items() if previous.get(key) != fingerprint)
+    removed = sorted(set(previous) - set(current))
+    logger.info(f"{len(current)} partition(s): {len(changed)} changed, {len(removed)} removed, "
+                f"{len(current) - len(changed)} unchanged")
+
+    partitions = {key: fingerprint for key, fingerprint in previous.items() if key in current}
+    rows_written = 0
+    for done, key in enumerate(changed, start=1):
+        ticker, day = key.split("/")
+        with stage("export_read", format=fmt):
+            table = partition_table(pa, ticker, datetime.strptime(day, "%Y-%m-%d").date(), where)
+        with stage("export_batch", format=fmt):
+            write_partition(pa, table, os.path.join(output, f"ticker={ticker}", f"date={day}", FILE_NAMES[fmt]),
+                            fmt)
+        rows_written += table.num_rows
+        partitions[key] = current[key]
+        logger.debug(f"Wrote {key} ({table.num_rows:,} rows)")
+
+        # Checkpoint the manifest now and then so an interrupted run resumes where it stopped
+        if done % 100 == 0:
+            save_manifest(output, {"format": fmt, "where": where, "partitions": partitions})
+
+    for key in removed:
+        ticker, day = key.split("/")
+        ticker_dir = os.path.join(output, f"ticker={ticker}")
+        shutil.rmtree(os.path.join(ticker_dir, f"date={day}"), ignore_errors=True)
+        if os.path.isdir(ticker_dir) and not os.listdir(ticker_dir):
+            os.rmdir(ticker_dir)
+
+    save_manifest(output, {"format": fmt, "where": where, "partitions": partitions})
+    return len(changed), rows_written
@@ -0,0 +1,386 @@
+import json
+import math
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import click
+from loguru import logger
+from sqlalchemy import delete, func, select, text
+
+from database import SnapshotDay, Stock, engine, month_start
+from market_check import MARKET_TZ
+from metrics import count, stage
+from settings import COMPACT_KEEP_DAYS, COMPACT_PRICE_DECIMALS
+
+FORMAT_VERSION = 1
+SOURCE = "yfinance"
+VALUE_COLUMNS = ("high", "low", "avg", "sale", "open", "close", "volume", "vwap", "transactions")
+
+
+def delta_encode(values, decimals=COMPACT_PRICE_DECIMALS):
+    """Encode numbers as integer deltas at the smallest 10**n scale (n <= ``decimals``) that is exact.
+
+    Returns None when some value isn't a finite number with at most
+    ``decimals`` decimals, so the caller can store it as-is instead.
+    """
+    if any(isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value)
+           for value in values):
+        return None
+    for places in range(decimals + 1):
+        scale = 10 ** places
+        scaled = [round(value * scale) for value in values]
+        if all(number / scale == value for number, value in zip(scaled, values)):
+            break
+    else:
+        return None
+    deltas = [scaled[0]] + [current - previous for previous, current in zip(scaled, scaled[1:])]
+    return {"delta": deltas, "scale": scale, "int": all(isinstance(value, int) for value in values)}
+
+
+def encode_column(values, encoded, delta):
+    """Encode one column as a constant, a reference to an identical column in ``encoded``, deltas or plain values."""
+    if all(type(value) is type(values[0]) and value == values[0] for value in values):
+        return {"const": values[0]}
+    for name, (other, _) in encoded.items():
+        if other == values:
+            return {"same_as": name}
+    if delta:
+        deltas = delta_encode(values)
+        if deltas is not None:
+            return deltas
+    return {"values": values}
+
+
+def decode_column(column, decoded, length):
+    if "const" in column:
+        return [column["const"]] * length
+    if "same_as" in column:
+        return list(decoded[column["same_as"]])
+    if "delta" in column:
+        total, values = 0, []
+        for step in column["delta"]:
+            total += step
+            values.append(total if column["int"] else total / column["scale"])
+        return values
+    return list(column["values"])
+
+
+def timestamp_offset(value, timestamp):
+    """Microseconds between the row time and its naive local ISO ``meta.timestamp``, or None."""
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        return None
+    return (int(moment.replace(microsecond=0).timestamp()) - timestamp) * 1_000_000 + moment.microsecond
+
+
+def offset_timestamp(offset, timestamp):
+    seconds, microseconds = divmod(offset, 1_000_000)
+    return datetime.fromtimestamp(timestamp + seconds).replace(microsecond=microseconds).isoformat()
+
+
+def encode_day(rows, delta=True):
+    """Encode one ticker-day of time-ordered ``stocks`` row dicts as compressed column data.
+
+    Every column (and every ``meta`` key) is stored once per day: as a single
+    value when it never changes, as a reference when it repeats another
+    column (``meta.day_high`` is ``high``), and otherwise as a list, delta
+    encoded with ``delta``. ``meta.timestamp`` is kept as an offset from
+    ``time``. Decoding with ``decode_day`` returns the rows unchanged.
+    """
+    times = [row["time"] for row in rows]
+    encoded = {}  # name -> (values, encoding)
+    for name in VALUE_COLUMNS:
+        values = [row.get(name) for row in rows]
+        encoded[name] = (values, encode_column(values, encoded, delta))
+
+    metas = [row.get("meta") for row in rows]
+    meta = {}
+    for key in dict.fromkeys(key for item in metas if item for key in item):
+        values = [item.get(key) if item else None for item in metas]
+        column = {}
+        missing = [index for index, item in enumerate(metas) if item and key not in item]
+        if missing:
+            column["missing"] = missing
+        offsets = [timestamp_offset(value, timestamp) for value, timestamp in zip(values, times)]
+        if key == "timestamp" and None not in offsets:
+            column["offset_us"] = encode_column(offsets, {}, delta)
+        else:
+            column.update(encode_column(values, encoded, delta))
+            encoded[f"meta.{key}"] = (values, column)
+        meta[key] = column
+
+    document = {
+        "version": FORMAT_VERSION,
+        "time": encode_column(times, {}, True),
+        "columns": {name: encoding for name, (_, encoding) in encoded.items() if name in VALUE_COLUMNS},
+        "meta": meta,
+        "meta_null": [index for index, item in enumerate(metas) if item is None],
+    }
+    return zlib.compress(json.dumps(document, separators=(",", ":")).encode(), 9)
+
+
+def decode_day(ticker, data):
+    """Return the ``stocks`` row dicts encoded by ``encode_day``, in time order."""
+    document = json.loads(zlib.decompress(data))
+    if document["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot day format {document['version']}")
+    times = decode_column(document["time"], {}, None)
+    length = len(times)
+
+    decoded = {}
+    for name, column in document["columns"].items():
+        decoded[name] = decode_column(column, decoded, length)
+    null = set(document["meta_null"])
+    metas = [None if index in null else {} for index in range(length)]
+    for key, column in document["meta"].items():
+        if "offset_us" in column:
+            values = [offset_timestamp(offset, timestamp)
+                      for offset, timestamp in zip(decode_column(column["offset_us"], {}, length), times)]
+        else:
+            values = decode_column(column, decoded, length)
+            decoded[f"meta.{key}"] = values
+        missing = set(column.get("missing", ()))
+        for index, (item, value) in enumerate(zip(metas, values)):
+            if item is not None and index not in missing:
+                item[key] = value
+
+    return [
+        {"ticker": ticker, "time": timestamp, **{name: decoded[name][index] for name in VALUE_COLUMNS},
+         "source": SOURCE, "meta": metas[index]}
+        for index, timestamp in enumerate(times)
+    ]
+
+
+def compacted_rows(conn, tickers, start, end):
+    """Return the compacted yfinance rows of ``tickers`` with ``start <= time < end``, ordered by ticker and time."""
+    query = (select(SnapshotDay.ticker, SnapshotDay.data)
+             .where(SnapshotDay.ticker.in_(tickers), SnapshotDay.last_time >= start, SnapshotDay.first_time < end)
+             .order_by(SnapshotDay.ticker, SnapshotDay.day))
+    return [row for ticker, data in conn.execute(query)
+            for row in decode_day(ticker, data) if start <= row["time"] < end]
+
+
+class CompactedDays(click.ClickException):
+    """Raised by readers of ``stocks`` alone when the days they need are in ``snapshot_days``."""
+
+
+def require_expanded(conn, reader, tickers=None):
+    """Raise CompactedDays if ``snapshot_days`` holds any day of ``tickers`` (default: any ticker).
+
+    ``query.fetch_bars`` and the rollups merge compacted days back in; readers
+    that page through ``stocks`` directly call this instead of silently
+    missing that history.
+    """
+    query = select(SnapshotDay.ticker).distinct().order_by(SnapshotDay.ticker)
+    if tickers:
+        query = query.where(SnapshotDay.ticker.in_(tickers))
+    compacted = conn.execute(query).scalars().all()
+    if compacted:
+        raise CompactedDays(
+            f"{reader} reads the stocks table only, but yfinance days of {len(compacted)} ticker(s) "
+            f"({', '.join(compacted[:5])}{', ...' if len(compacted) > 5 else ''}) are compacted into "
+            f"snapshot_days; run `python compaction.py --expand` first"
+        )
+
+
+def day_bounds(day):
+    """Unix timestamps of ET midnight at the start and end of ``day``."""
+    start = datetime.combine(day, datetime.min.time(), MARKET_TZ)
+    end = datetime.combine(day + timedelta(days=1), datetime.min.time(), MARKET_TZ)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def stock_rows(conn, ticker, start, end):
+    """yfinance ``stocks`` rows of ``ticker`` in [start, end) as (id, row dict) pairs."""
+    columns = [Stock.__table__.c[name] for name in VALUE_COLUMNS]
+    query = (select(Stock.id, Stock.time, *columns, Stock.meta)
+             .where(Stock.ticker == ticker, Stock.source == SOURCE, Stock.time >= start, Stock.time < end)
+             .order_by(Stock.time))
+    return [(row.id, {"ticker": ticker, "time": row.time, **{name: getattr(row, name) for name in VALUE_COLUMNS},
+                      "source": SOURCE, "meta": row.meta})
+            for row in conn.execute(query)]
+
+
+def compact_day(ticker, day, delta=True):
+    """Move ``ticker``'s yfinance rows of ``day`` into ``snapshot_days``; returns (rows moved, record bytes).
+
+    Rows are merged into an existing record for the day, so late rows (from a
+    spool drain, say) are folded in by the next run. Everything happens in
+    one short transaction that touches only this ticker-day, which live
+    ingestion of the current day never writes to.
+    """
+    start, end = day_bounds(day)
+    with engine.begin() as conn:
+        rows = stock_rows(conn, ticker, start, end)
+        if not rows:
+            return 0, 0
+        ids = [row_id for row_id, _ in rows]
+        merged = {row["time"]: row for _, row in rows}
+
+        record = conn.execute(select(SnapshotDay.data).where(SnapshotDay.ticker == ticker,
+                                                             SnapshotDay.day == day)).scalar()
+        if record is not None:
+            # Already compacted rows win over a duplicate that arrived later
+            merged.update((row["time"], row) for row in decode_day(ticker, record))
+        merged = [merged[timestamp] for timestamp in sorted(merged)]
+
+        data = encode_day(merged, delta)
+        if decode_day(ticker, data) != merged:
+            raise ValueError(f"{ticker} {day}: compacted rows don't decode to the originals")
+
+        conn.execute(delete(SnapshotDay).where(SnapshotDay.ticker == ticker, SnapshotDay.day == day))
+        conn.execute(SnapshotDay.__table__.insert().values(
+            ticker=ticker, day=day, first_time=merged[0]["time"], last_time=merged[-1]["time"],
+            rows=len(merged), data=data,
+        ))
+        conn.execute(delete(Stock).where(Stock.id.in_(ids)))
+
+    return len(rows), len(data)
+
+
+def expand_day(ticker, day):
+    """Move a compacted day back into ``stocks`` rows; returns the number of rows restored."""
+    from writers import insert_ignore_statement
+
+    with engine.begin() as conn:
+        data = conn.execute(select(SnapshotDay.data).where(SnapshotDay.ticker == ticker,
+                                                           SnapshotDay.day == day)).scalar()
+        if data is None:
+            return 0
+        rows = decode_day(ticker, data)
+        conn.execute(insert_ignore_statement(conn), rows)
+        conn.execute(delete(SnapshotDay).where(SnapshotDay.ticker == ticker, SnapshotDay.day == day))
+    return len(rows)
+
+
+def closed_days(ticker, cutoff):
+    """Yield each ET day before ``cutoff`` (a Unix timestamp) with yfinance rows for ``ticker``."""
+    cursor = 0
+    while True:
+        with engine.connect() as conn:
+            next_row = conn.execute(select(func.min(Stock.time)).where(
+                Stock.ticker == ticker, Stock.source == SOURCE, Stock.time >= cursor, Stock.time < cutoff,
+            )).scalar()
+        if next_row is None:
+            return
+        day = datetime.fromtimestamp(next_row, MARKET_TZ).date()
+        yield day
+        cursor = day_bounds(day)[1]
+
+
+def reclaim_space(months, full=False):
+    """Make the space freed by deleted rows reusable without blocking writers.
+
+    PostgreSQL gets a plain ``VACUUM (ANALYZE)`` of each touched monthly
+    partition (or of ``stocks``), which runs alongside inserts. With ``full``,
+    partitions of months that have ended are rewritten with ``VACUUM FULL``
+    to return the space to the OS; it locks only those partitions, which live
+    ingestion no longer writes to. SQLite reuses freed pages on its own, and
+    ``full`` runs ``VACUUM``, which briefly blocks writers to the file.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "sqlite":
+            if full:
+                with stage("vacuum"):
+                    conn.execute(text("VACUUM"))
+            return
+        if engine.dialect.name != "postgresql":
+            return
+
+        partitioned = conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'stocks'")).scalar() == "p"
+        current = month_start(int(time.time()))
+        if not partitioned:
+            with stage("vacuum"):
+                conn.execute(text("VACUUM (ANALYZE) stocks"))
+            if full:
+                logger.warning("stocks isn't partitioned; skipping VACUUM FULL, which would block ingestion")
+            return
+        for month in sorted(months):
+            name = f"stocks_p{datetime.fromtimestamp(month, timezone.utc):%Y%m}"
+            exists = conn.execute(text("SELECT 1 FROM pg_class WHERE relname = :name"), {"name": name}).scalar()
+            name = name if exists else "stocks_default"
+            command = "VACUUM (FULL, ANALYZE)" if full and month < current else "VACUUM (ANALYZE)"
+            with stage("vacuum"):
+                conn.execute(text(f"{command} {name}"))
+            logger.debug(f"{command} {name}")
+
+
+@click.command()
+@click.argument("tickers", nargs=-1)
+@click.option("--keep-days", default=COMPACT_KEEP_DAYS,
+              help=f"Leave the most recent ET days as plain rows; 1 compacts every day before today "
+                   f"(default: {COMPACT_KEEP_DAYS})")
+@click.option("--delta/--no-delta", default=True, help="Delta-encode changing prices and volumes (default: on)")
+@click.option("--full", is_flag=True,
+              help="Return freed space to the OS: VACUUM FULL of ended months' partitions on PostgreSQL, "
+                   "VACUUM on SQLite (briefly blocks writers)")
+@click.option("--expand", is_flag=True, help="Move compacted days back into stocks rows instead")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+def main(tickers, keep_days, delta, full, expand, debug):
+    """Compact yfinance snapshot rows of closed days for TICKERS (default: all) into snapshot_days.
+
+    Each ticker-day becomes one record holding every column once, so the
+    day-level fields repeated by every snapshot cost almost nothing. Reads
+    through query.load_bars and rollup rebuilds include compacted days.
+    """
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    if expand:
+        query = select(SnapshotDay.ticker, SnapshotDay.day).order_by(SnapshotDay.ticker, SnapshotDay.day)
+        if tickers:
+            query = query.where(SnapshotDay.ticker.in_([ticker.upper() for ticker in tickers]))
+        with engine.connect() as conn:
+            days = conn.execute(query).all()
+        restored = sum(expand_day(ticker, day) for ticker, day in days)
+        logger.success(f"Restored {restored:,} row(s) from {len(days)} compacted day(s)")
+        return
+
+    with engine.connect() as conn:
+        if tickers:
+            tickers = [ticker.upper() for ticker in tickers]
+        else:
+            tickers = conn.execute(select(Stock.ticker).where(Stock.source == SOURCE)
+                                   .distinct().order_by(Stock.ticker)).scalars().all()
+    today = datetime.now(MARKET_TZ).date()
+    cutoff = day_bounds(today - timedelta(days=keep_days - 1))[0]
+    logger.info(f"Compacting yfinance rows before {datetime.fromtimestamp(cutoff, MARKET_TZ):%Y-%m-%d} "
+                f"for {len(tickers)} ticker(s)")
+
+    started = time.perf_counter()
+    total_rows = total_days = total_bytes = 0
+    months = set()
+    for ticker in tickers:
+        days = 0
+        for day in closed_days(ticker, cutoff):
+            with stage("compact"):
+                rows, size = compact_day(ticker, day, delta)
+            days += 1
+            total_rows += rows
+            total_bytes += size
+            # Partitions are UTC months, and an ET day's after-hours rows can fall into the next one
+            months.update(month_start(bound) for bound in (day_bounds(day)[0], day_bounds(day)[1] - 1))
+            count("rows", rows, stage="compact")
+            logger.debug(f"{ticker} {day}: {rows} row(s) compacted, record is {size:,} bytes")
+        if days:
+            logger.info(f"Compacted {days} day(s) for {ticker}")
+        total_days += days
+
+    if total_rows:
+        reclaim_space(months, full)
+    logger.success(f"Compacted {total_rows:,} row(s) from {total_days} ticker-day(s) into "
+                   f"{total_bytes / 1e6:.2f} MB of records in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
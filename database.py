@@ -1,30 +1,156 @@
-from sqlalchemy import JSON, Column, Float, Integer, String, create_engine
+from datetime import datetime, timezone
+
+from loguru import logger
+from sqlalchemy import JSON, Column, Date, Float, Index, Integer, LargeBinary, String, create_engine, event, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-from settings import DATABASE_URL
+from settings import (
+    DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    PARTITION_MONTHS_AHEAD,
+    SQLITE_PRAGMAS,
+)
 
 Base = declarative_base()
 
+# Bar columns carried in the (ticker, time) index on PostgreSQL so range reads are index-only
+COVERING_COLUMNS = ["high", "low", "avg", "sale", "open", "close", "volume", "vwap", "transactions", "source"]
+
 
 class Stock(Base):
     __tablename__ = "stocks"
+    __table_args__ = (
+        # One bar per ticker per timestamp; writers ignore rows that conflict with it.
+        # Also serves per-ticker range scans, so there is no separate ticker index.
+        Index("uq_stocks_ticker_time", "ticker", "time", unique=True,
+              postgresql_include=COVERING_COLUMNS),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    ticker = Column(String(10), nullable=False, index=True)
+    ticker = Column(String(10), nullable=False)
     time = Column(Integer, nullable=False, index=True)  # Unix timestamp
     high = Column(Float, nullable=False)
     low = Column(Float, nullable=False)
     avg = Column(Float, nullable=False)
     sale = Column(Float, nullable=False)
-    meta = Column(JSON, nullable=True)
+    open = Column(Float, nullable=True)
+    close = Column(Float, nullable=True)
+    volume = Column(Float, nullable=True)
+    vwap = Column(Float, nullable=True)
+    transactions = Column(Integer, nullable=True)
+    source = Column(String(16), nullable=True)  # polygon or yfinance
+    meta = Column(JSON(none_as_null=True), nullable=True)  # Sparse extras only
 
     def __repr__(self):
         return f"<Stock(ticker='{self.ticker}', time={self.time}, high={self.high}, low={self.low})>"
 
 
-engine = create_engine(DATABASE_URL, echo=False)
-Base.metadata.create_all(engine)
+class StockRollup(Base):
+    """OHLCV+VWAP bar aggregated from ``stocks`` rows of one source over a 5m, 1h or 1d bucket."""
+
+    __tablename__ = "stock_rollups"
+
+    ticker = Column(String(10), primary_key=True)
+    resolution = Column(String(4), primary_key=True)  # 5m, 1h or 1d
+    source = Column(String(16), primary_key=True)  # polygon or yfinance; sources are never mixed
+    bucket = Column(Integer, primary_key=True)  # Unix timestamp of the bucket start (ET midnight for 1d)
+    open = Column(Float, nullable=True)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=True)
+    volume = Column(Float, nullable=False)
+    vwap = Column(Float, nullable=True)
+    bars = Column(Integer, nullable=False)  # stocks rows aggregated into the bucket
+
+
+class BackfillCheckpoint(Base):
+    """A backfill shard (one ticker over a closed date range) whose bars are all stored."""
+
+    __tablename__ = "backfill_checkpoints"
+
+    ticker = Column(String(10), primary_key=True)
+    timespan = Column(String(10), primary_key=True)
+    multiplier = Column(Integer, primary_key=True)
+    shard_start = Column(Date, primary_key=True)
+    shard_end = Column(Date, primary_key=True)
+    rows = Column(Integer, nullable=False)
+    completed_at = Column(Integer, nullable=False)  # Unix timestamp
+
+    def __repr__(self):
+        return (f"<BackfillCheckpoint(ticker='{self.ticker}', shard={self.shard_start}..{self.shard_end}, "
+                f"rows={self.rows})>")
+
+
+class StockIndicator(Base):
+    """One indicator value (``sma_20``, ``ema_12``, ...) for a bar, maintained by ``indicators.py``."""
+
+    __tablename__ = "stock_indicators"
+
+    ticker = Column(String(10), primary_key=True)
+    source = Column(String(16), primary_key=True)
+    name = Column(String(32), primary_key=True)
+    time = Column(Integer, primary_key=True)  # Unix timestamp of the bar
+    value = Column(Float, nullable=False)
+
+
+class IndicatorState(Base):
+    """Where ``indicators.py`` left off for a ticker/source, and what it needs to continue from there."""
+
+    __tablename__ = "indicator_state"
+
+    ticker = Column(String(10), primary_key=True)
+    source = Column(String(16), primary_key=True)
+    last_time = Column(Integer, nullable=False)  # Newest bar processed
+    bars = Column(Integer, nullable=False)  # Bars processed up to last_time, to notice rows inserted before it
+    state = Column(JSON, nullable=False)  # Indicator names, recent closes, EMA values, session VWAP sums
+
+
+class SnapshotDay(Base):
+    """One ticker's yfinance snapshot rows for a closed ET day, compacted by ``compaction.py``."""
+
+    __tablename__ = "snapshot_days"
+
+    ticker = Column(String(10), primary_key=True)
+    day = Column(Date, primary_key=True)  # ET trading day
+    first_time = Column(Integer, nullable=False)  # Unix timestamps of the first and last row
+    last_time = Column(Integer, nullable=False)
+    rows = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)  # zlib-compressed column encoding, see compaction.encode_day
+
+    def __repr__(self):
+        return f"<SnapshotDay(ticker='{self.ticker}', day={self.day}, rows={self.rows})>"
+
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=DB_POOL_PRE_PING)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+
+try:
+    Base.metadata.create_all(engine)
+except OperationalError as e:
+    # Don't fail every import while the database is down; the spooling daemon runs without it,
+    # and the tables are created by the next process that starts with the database up
+    logger.warning(f"Could not create tables, database unavailable: {type(e).__name__}: {str(e).splitlines()[0]}")
 
 Session = sessionmaker(bind=engine)
 
@@ -32,3 +158,71 @@ Session = sessionmaker(bind=engine)
 def get_session():
     return Session()
 
+
+def month_start(timestamp):
+    """Return the Unix timestamp of the start of the UTC month containing ``timestamp``."""
+    moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    return int(datetime(moment.year, moment.month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def next_month_start(timestamp):
+    moment = datetime.fromtimestamp(month_start(timestamp), timezone.utc)
+    year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def ensure_partitions(start_time=None, end_time=None, months_ahead=PARTITION_MONTHS_AHEAD, bind=None):
+    """Create monthly ``stocks`` partitions covering ``start_time`` to ``months_ahead`` past ``end_time``.
+
+    Only applies to PostgreSQL databases where ``stocks`` has been converted to a
+    table partitioned by ``time``; otherwise it does nothing. Rows that already
+    landed in the default partition for a new month are moved into it. ``bind``
+    is the engine to use (default: this module's).
+    """
+    bind = bind if bind is not None else engine
+    if bind.dialect.name != "postgresql":
+        return
+
+    now = int(datetime.now(timezone.utc).timestamp())
+    start = month_start(start_time if start_time is not None else now)
+    end = end_time if end_time is not None else now
+    for _ in range(months_ahead):
+        end = next_month_start(end)
+
+    with bind.begin() as conn:
+        if conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'stocks'")).scalar() != "p":
+            return
+        existing = set(conn.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = 'stocks'"
+        )).scalars())
+
+        lower = start
+        while lower < end:
+            upper = next_month_start(lower)
+            name = f"stocks_p{datetime.fromtimestamp(lower, timezone.utc):%Y%m}"
+            if name not in existing:
+                create_partition(conn, name, lower, upper)
+            lower = upper
+
+
+def create_partition(conn, name, lower, upper):
+    """Create partition ``name`` for ``lower <= time < upper``, moving matching default-partition rows."""
+    bounds = {"lower": lower, "upper": upper}
+    moved = conn.execute(text(
+        "SELECT COUNT(*) FROM stocks_default WHERE time >= :lower AND time < :upper"
+    ), bounds).scalar()
+
+    if not moved:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF stocks FOR VALUES FROM ({lower}) TO ({upper})"))
+    else:
+        # A default partition holding rows for the new range blocks CREATE ... PARTITION OF
+        conn.execute(text(f"CREATE TABLE {name} (LIKE stocks INCLUDING DEFAULTS)"))
+        conn.execute(text(
+            f"WITH moved AS (DELETE FROM stocks_default WHERE time >= :lower AND time < :upper RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), bounds)
+        conn.execute(text(f"ALTER TABLE stocks ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"))
+    logger.debug(f"Created partition {name}" + (f" ({moved} rows moved from default)" if moved else ""))
@@ -1,21 +1,25 @@
 #!/bin/bash
 
-# Debug script to monitor AAPL every minute
+# Debug script to monitor the watchlist every minute
 # Press Ctrl+C to stop
 
 echo "Starting AAPL monitor - fetching every 60 seconds"
 echo "Press Ctrl+C to stop"
 echo "----------------------------------------"
 
+# Ensure we're in the correct directory (the venv lives next to this script)
+cd "$(dirname "${BASH_SOURCE[0]}")" || exit 1
+
+# Run the fetcher as a resident daemon. It schedules itself on minute boundaries
+# + 5 second buffer and keeps the database engine and yfinance state warm between
+# cycles. It exits 0 when stopped with Ctrl+C or SIGTERM; any other exit (a crash)
+# restarts it after a short pause.
 while true; do
-    # Wait until next minute mark + 5 second buffer
-    current_second=$(date +%S)
-    sleep_time=$((60 - current_second + 5))
-    sleep $sleep_time
-    
-    # Get current time
-    echo -n "$(date '+%Y-%m-%d %H:%M:%S') - "
-    
-    # Run the fetcher (ensure we're in the correct directory and use venv)
-    cd "$(dirname "${BASH_SOURCE[0]}")" && ./venv/bin/python3 yfinance_fetcher.py AAPL AIQ AMD AMZN AVGO GOOGL INTC META MSFT NVDA ORCL PLTR TSM
-done
\ No newline at end of file
+    ./venv/bin/python3 yfinance_fetcher.py --daemon AAPL AIQ AMD AMZN AVGO GOOGL INTC META MSFT NVDA ORCL PLTR TSM
+    status=$?
+    if [ "$status" -eq 0 ]; then
+        break
+    fi
+    echo "$(date '+%Y-%m-%d %H:%M:%S') - monitor exited with status $status, restarting in 10 seconds"
+    sleep 10
+done
@@ -1,166 +1,480 @@
+import gzip
+import io
 import json
+import multiprocessing
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
 import click
 from loguru import logger
-from sqlalchemy import create_engine, text
+from sqlalchemy import func, select, text
 
-from database import Stock
-from settings import DATABASE_URL
+from columnar import FILE_NAMES, export_columnar
+from compaction import require_expanded
+from database import Stock, engine
+from metrics import count, instrumented, registry, stage, with_stage_records
+from settings import EXPORT_PAGE_SIZE, EXPORT_SHARDS, EXPORT_WORKERS, METRICS_FILE, METRICS_PORT
+from writers import STOCK_COLUMNS, copy_value
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
 
 
 @click.command()
-@click.option("--output", "-o", default="stocks_dump.sql", help="Output SQL file (default: stocks_dump.sql)")
+@click.option("--output", "-o", default=None,
+              help="Output SQL file, or directory for parquet/arrow (default: stocks_dump.sql / stocks_columnar)")
 @click.option("--table", default="stocks", help="Target table name (default: stocks)")
+@click.option("--format", "fmt", default="insert", type=click.Choice(["insert", "copy", "binary", *FILE_NAMES]),
+              help="insert: multi-row INSERTs; copy: psql script with COPY FROM stdin; "
+                   "binary: PostgreSQL binary COPY file, PostgreSQL source only; "
+                   "parquet/arrow: columnar files partitioned by ticker and ET date (default: insert)")
+@click.option("--compress", default=None, type=click.Choice(COMPRESSIONS),
+              help="Compress the output on the fly (default: from the .gz/.zst extension, else none)")
 @click.option("--batch-size", default=1000, help="Number of records per INSERT statement (default: 1000)")
+@click.option("--page-size", default=EXPORT_PAGE_SIZE,
+              help=f"Rows read per keyset page (default: {EXPORT_PAGE_SIZE})")
 @click.option("--where", help="WHERE clause to filter records (e.g., \"ticker='AAPL'\")")
+@click.option("--shard-by", default="none", type=click.Choice(["none", "id", "ticker"]),
+              help="Split a SQL/binary export into per-shard files written in parallel (default: none)")
+@click.option("--shards", default=EXPORT_SHARDS, help=f"Number of id-range shards (default: {EXPORT_SHARDS})")
+@click.option("--workers", default=EXPORT_WORKERS, help=f"Worker processes for shards (default: {EXPORT_WORKERS})")
+@click.option("--restart", is_flag=True, help="Ignore the shard manifest and export every shard again")
+@click.option("--full", is_flag=True, help="parquet/arrow: rewrite every partition, not just changed ones")
+@click.option("--metrics-file", default=METRICS_FILE,
+              help="Write Prometheus metrics to this textfile when the export ends (default: $METRICS_FILE)")
+@click.option("--metrics-port", default=METRICS_PORT,
+              help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running (default: off)")
+@click.option("--profile", type=click.Path(dir_okay=False),
+              help="Profile the export with the sampling profiler and write the stats to this file")
+@click.option("--log-json", is_flag=True, help="Emit log records as JSON lines")
 @click.option("--debug", is_flag=True, help="Enable debug logging")
-def main(output, table, batch_size, where, debug):
-    """Export SQLite stock data to PostgreSQL INSERT statements."""
-    
+def main(output, table, fmt, compress, batch_size, page_size, where, shard_by, shards, workers, restart,
+         full, metrics_file, metrics_port, profile, log_json, debug):
+    """Export stock data to a PostgreSQL INSERT or COPY dump, or to Parquet/Arrow files.
+
+    Rows are streamed in ``id`` order a page at a time, so memory stays flat
+    however large the table is.
+    """
+
     # Configure logging
     logger.remove()
-    if debug:
+    if log_json:
+        # Per-stage timings are DEBUG records; JSON logs carry them without --debug too
+        logger.add(sys.stderr, level="DEBUG", serialize=True, filter=None if debug else with_stage_records)
+    elif debug:
         logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
     else:
         logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
-    
-    logger.info(f"Starting export from SQLite to PostgreSQL format")
-    logger.info(f"Output file: {output}")
-    
-    # Create engine
-    engine = create_engine(DATABASE_URL)
-    
-    try:
-        # Build query
-        query = f"SELECT * FROM stocks"
+
+    with instrumented(metrics_file, metrics_port, profile):
+        export(output, table, fmt, compress, batch_size, page_size, where, shard_by, shards, workers, restart,
+               full, debug)
+
+
+def export(output, table, fmt, compress, batch_size, page_size, where, shard_by, shards, workers, restart,
+           full, debug):
+    """Run one export with already-parsed ``main`` options."""
+    with engine.connect() as conn:
+        require_expanded(conn, "export_data.py")
+
+    if fmt in FILE_NAMES:
+        output = output or "stocks_columnar"
+        logger.info(f"Starting incremental {fmt} export to {output}/ticker=*/date=*")
         if where:
-            query += f" WHERE {where}"
             logger.info(f"Applying filter: WHERE {where}")
-        query += " ORDER BY id"
-        
-        # Count total records
-        count_query = f"SELECT COUNT(*) FROM stocks"
-        if where:
-            count_query += f" WHERE {where}"
-        
-        with engine.connect() as conn:
-            total_count = conn.execute(text(count_query)).scalar()
-            logger.info(f"Total records to export: {total_count:,}")
-            
-            if total_count == 0:
-                logger.warning("No records found to export")
-                return
-            
-            # Open output file
-            with open(output, 'w') as f:
-                # Write header
-                f.write("-- PostgreSQL dump from SQLite stocks database\n")
-                f.write(f"-- Generated at: {datetime.now().isoformat()}\n")
-                f.write(f"-- Total records: {total_count:,}\n")
-                f.write("-- \n")
-                f.write("-- Usage: psql -U username -d database -f stocks_dump.sql\n")
-                f.write("\n")
-                
-                # Write table creation (optional)
-                f.write("-- Create table if not exists\n")
-                f.write(f"CREATE TABLE IF NOT EXISTS {table} (\n")
-                f.write("    id SERIAL PRIMARY KEY,\n")
-                f.write("    ticker VARCHAR(10) NOT NULL,\n")
-                f.write("    time INTEGER NOT NULL,\n")
-                f.write("    high FLOAT NOT NULL,\n")
-                f.write("    low FLOAT NOT NULL,\n")
-                f.write("    avg FLOAT NOT NULL,\n")
-                f.write("    sale FLOAT NOT NULL,\n")
-                f.write("    meta JSONB\n")
-                f.write(");\n\n")
-                
-                # Write indexes
-                f.write("-- Create indexes\n")
-                f.write(f"CREATE INDEX IF NOT EXISTS idx_{table}_ticker ON {table}(ticker);\n")
-                f.write(f"CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table}(time);\n")
-                f.write("\n")
-                
-                # Begin transaction
-                f.write("-- Begin transaction\n")
-                f.write("BEGIN;\n\n")
-                
-                # Fetch and write data in batches
-                result = conn.execute(text(query))
-                batch = []
-                records_written = 0
-                
-                for row in result:
-                    # Convert row to dict
-                    record = {
-                        'ticker': row.ticker,
-                        'time': row.time,
-                        'high': row.high,
-                        'low': row.low,
-                        'avg': row.avg,
-                        'sale': row.sale,
-                        'meta': row.meta
-                    }
-                    batch.append(record)
-                    
-                    # Write batch when full
-                    if len(batch) >= batch_size:
-                        write_batch(f, table, batch)
-                        records_written += len(batch)
-                        logger.debug(f"Written {records_written:,} records...")
-                        batch = []
-                
-                # Write remaining records
-                if batch:
-                    write_batch(f, table, batch)
-                    records_written += len(batch)
-                
-                # Commit transaction
-                f.write("\n-- Commit transaction\n")
-                f.write("COMMIT;\n\n")
-                
-                # Write summary
-                f.write(f"-- Export completed: {records_written:,} records\n")
-                
-                logger.success(f"Export completed: {records_written:,} records written to {output}")
-                
+        started = time.perf_counter()
+        try:
+            partitions, records_written = export_columnar(output, fmt, where, full)
+            count("rows", records_written, stage="export", format=fmt)
+        except Exception as e:
+            logger.error(f"Export failed: {type(e).__name__}: {e}")
+            raise
+        logger.success(f"Export completed: {records_written:,} records in {partitions} partition(s) "
+                       f"written to {output} in {time.perf_counter() - started:.1f}s")
+        return
+
+    output = output or "stocks_dump.sql"
+    if compress is None:
+        compress = next((name for ext, name in EXTENSIONS.items() if output.endswith(ext)), "none")
+    if fmt == "binary" and engine.dialect.name != "postgresql":
+        raise click.UsageError("--format binary needs a PostgreSQL source database")
+
+    logger.info(f"Starting {fmt} export from {engine.dialect.name} to PostgreSQL format")
+    if where:
+        logger.info(f"Applying filter: WHERE {where}")
+
+    if shard_by != "none":
+        try:
+            export_sharded(output, fmt, compress, table, where, batch_size, page_size,
+                           shard_by, shards, workers, restart, debug)
+        except Exception as e:
+            logger.error(f"Export failed: {type(e).__name__}: {e}")
+            raise
+        return
+
+    logger.info(f"Output file: {output} (compression: {compress})")
+    started = time.perf_counter()
+    try:
+        records_written = export_file(output, fmt, compress, table, where, batch_size, page_size)
+        count("rows", records_written, stage="export", format=fmt)
+        count("bytes", os.path.getsize(output), stage="export", format=fmt)
+
+        elapsed = time.perf_counter() - started
+        if records_written == 0:
+            logger.warning("No records found to export")
+        logger.success(f"Export completed: {records_written:,} records written to {output} "
+                       f"in {elapsed:.1f}s ({records_written / elapsed if elapsed else 0:,.0f} rows/sec)")
+        if fmt == "binary":
+            logger.info(f"Load with: {binary_load_command(output, table, compress)}")
+
     except Exception as e:
         logger.error(f"Export failed: {type(e).__name__}: {e}")
         raise
 
 
+def export_file(path, fmt, compress, table, where, batch_size, page_size, standalone=True):
+    """Export the rows matching ``where`` to one file; returns the number of rows written.
+
+    A ``standalone`` SQL dump carries its own table definition and indexes;
+    shard files only hold a transaction of data.
+    """
+    with open_output(path, compress, binary=fmt == "binary") as f:
+        if fmt == "binary":
+            return copy_out(f, where, binary=True)
+
+        if standalone:
+            write_schema(f, table)
+        f.write("-- Begin transaction\n")
+        f.write("BEGIN;\n\n")
+        if fmt == "copy":
+            records_written = write_copy(f, table, where, page_size)
+        else:
+            records_written = write_inserts(f, table, where, batch_size, page_size)
+        f.write("\n-- Commit transaction\n")
+        f.write("COMMIT;\n\n")
+        if standalone:
+            write_indexes(f, table)
+
+        # Write summary
+        f.write(f"-- Export completed: {records_written:,} records\n")
+        return records_written
+
+
+def binary_load_command(path, table, compress):
+    source = f"PROGRAM 'zcat {path}'" if compress == "gzip" else (
+        f"PROGRAM 'zstdcat {path}'" if compress == "zstd" else f"'{path}'")
+    return f"\\copy {table} ({', '.join(STOCK_COLUMNS)}) FROM {source} WITH (FORMAT binary)"
+
+
+def shard_path(output, name):
+    """``stocks_dump.sql.gz`` -> ``stocks_dump.<name>.sql.gz``."""
+    directory, base = os.path.split(output)
+    stem, dot, extensions = base.partition(".")
+    return os.path.join(directory, f"{stem}.{name}{dot}{extensions}")
+
+
+def sidecar_path(output, name, extension):
+    """``stocks_dump.sql.gz`` -> ``stocks_dump.<name>.<extension>``, uncompressed."""
+    directory, base = os.path.split(output)
+    return os.path.join(directory, f"{base.partition('.')[0]}.{name}.{extension}")
+
+
+def plan_shards(where, shard_by, shards):
+    """Return [(name, where clause)] covering every row matching ``where``.
+
+    ``id`` shards split the id range evenly; ``ticker`` shards take one ticker each.
+    """
+    with engine.connect() as conn:
+        if shard_by == "ticker":
+            query = select(Stock.ticker).distinct().order_by(Stock.ticker)
+            if where:
+                query = query.where(text(where))
+            tickers = conn.execute(query).scalars().all()
+            conditions = [(ticker, "ticker = " + sql_literal(ticker)) for ticker in tickers]
+        else:
+            query = select(func.min(Stock.id), func.max(Stock.id))
+            if where:
+                query = query.where(text(where))
+            low, high = conn.execute(query).first()
+            if low is None:
+                return []
+            step = -(-(high - low + 1) // shards)
+            conditions = [(f"shard{i:04d}", f"id >= {bound} AND id < {bound + step}")
+                          for i, bound in enumerate(range(low, high + 1, step))]
+
+    return [(name, f"({where}) AND {condition}" if where else condition) for name, condition in conditions]
+
+
+def export_sharded(output, fmt, compress, table, where, batch_size, page_size,
+                   shard_by, shards, workers, restart, debug):
+    """Export shards in parallel worker processes, one file per shard.
+
+    ``<output stem>.manifest.json`` records the shard plan and every finished
+    shard, so a rerun with the same options only exports the missing ones.
+    """
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    manifest_path = sidecar_path(output, "manifest", "json")
+    options = {"format": fmt, "compress": compress, "table": table, "where": where,
+               "shard_by": shard_by, "shards": shards}
+
+    manifest = None
+    if not restart and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("options") != options:
+            logger.warning(f"{manifest_path} was written with different options, starting over")
+            manifest = None
+    if manifest is None:
+        manifest = {"options": options, "plan": plan_shards(where, shard_by, shards), "completed": {}}
+        save_manifest(manifest_path, manifest)
+
+    completed = manifest["completed"]
+    pending = [(name, condition) for name, condition in manifest["plan"]
+               if name not in completed or not os.path.exists(shard_path(output, name))]
+    logger.info(f"{len(manifest['plan'])} {shard_by} shard(s): {len(pending)} to export, "
+                f"{len(manifest['plan']) - len(pending)} already complete ({manifest_path})")
+
+    if fmt != "binary":
+        with open(sidecar_path(output, "schema", "sql"), "w") as f:
+            write_schema(f, table)
+        with open(sidecar_path(output, "indexes", "sql"), "w") as f:
+            write_indexes(f, table)
+
+    started = time.perf_counter()
+    failed = []
+    # Spawned workers build their own engine instead of sharing the parent's pooled connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=configure_worker, initargs=(debug,)) as executor:
+        futures = {
+            executor.submit(export_shard, shard_path(output, name), fmt, compress, table,
+                            condition, batch_size, page_size): name
+            for name, condition in pending
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                rows, size, seconds = future.result()
+            except Exception as e:
+                logger.error(f"Shard {name} failed: {type(e).__name__}: {e}")
+                count("errors", stage="export_shard", format=fmt)
+                failed.append(name)
+                continue
+            completed[name] = {"rows": rows, "bytes": size, "seconds": round(seconds, 3)}
+            # Workers are separate processes; their stage timings are folded in per shard
+            registry.observe("export_shard", seconds, format=fmt)
+            count("rows", rows, stage="export", format=fmt)
+            count("bytes", size, stage="export", format=fmt)
+            save_manifest(manifest_path, manifest)
+            logger.info(f"Shard {name}: {rows:,} rows, {size / 1e6:.1f} MB in {seconds:.1f}s "
+                        f"({size / 1e6 / seconds if seconds else 0:.1f} MB/s, "
+                        f"{rows / seconds if seconds else 0:,.0f} rows/sec)")
+
+    elapsed = time.perf_counter() - started
+    if failed:
+        raise RuntimeError(f"{len(failed)} shard(s) failed; rerun to export them: {', '.join(sorted(failed))}")
+
+    records_written = sum(shard["rows"] for shard in completed.values())
+    total_bytes = sum(shard["bytes"] for shard in completed.values())
+    logger.success(f"Export completed: {records_written:,} records in {len(completed)} shard(s), "
+                   f"{total_bytes / 1e6:.1f} MB ({len(pending)} exported in {elapsed:.1f}s)")
+    if fmt == "binary":
+        logger.info(f"Load each shard with: {binary_load_command(shard_path(output, '<shard>'), table, compress)}")
+    else:
+        logger.info(f"Load {sidecar_path(output, 'schema', 'sql')}, then the shard files in parallel, "
+                    f"then {sidecar_path(output, 'indexes', 'sql')}")
+
+
+def configure_worker(debug):
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+
+def export_shard(path, fmt, compress, table, where, batch_size, page_size):
+    """Worker process entry point; returns (rows, bytes written, seconds)."""
+    started = time.perf_counter()
+    tmp_path = f"{path}.tmp"
+    rows = export_file(tmp_path, fmt, compress, table, where, batch_size, page_size, standalone=False)
+    # Only a complete shard file ever carries the final name
+    os.replace(tmp_path, path)
+    return rows, os.path.getsize(path), time.perf_counter() - started
+
+
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def open_output(path, compression="none", binary=False):
+    """Open ``path`` for writing, compressing on the fly with gzip or zstd."""
+    if compression == "gzip":
+        return gzip.open(path, "wb" if binary else "wt", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise click.UsageError("zstd compression needs the zstandard package (pip install zstandard)")
+        stream = zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"))
+        return stream if binary else io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, "wb" if binary else "w")
+
+
+def iter_pages(where, page_size):
+    """Yield lists of stocks rows in ``id`` order using keyset pagination.
+
+    Each page is a short indexed range read (``id > last_id``), so no cursor
+    or transaction stays open for the whole export and the driver never
+    buffers more than one page.
+    """
+    columns = [Stock.__table__.c[column] for column in STOCK_COLUMNS]
+    last_id = None
+    while True:
+        query = select(Stock.id, *columns).order_by(Stock.id).limit(page_size)
+        if where:
+            query = query.where(text(where))
+        if last_id is not None:
+            query = query.where(Stock.id > last_id)
+        with stage("export_read"), engine.connect() as conn:
+            page = conn.execute(query).all()
+        if not page:
+            return
+        last_id = page[-1].id
+        yield page
+
+
+def write_schema(file, table):
+    """Write the dump preamble and table definition."""
+    file.write("-- PostgreSQL dump of the stocks table\n")
+    file.write(f"-- Generated at: {datetime.now().isoformat()}\n")
+    file.write("-- \n")
+    file.write("-- Usage: psql -U username -d database -f stocks_dump.sql\n")
+    file.write("\n")
+
+    # Write table creation (optional)
+    file.write("-- Create table if not exists\n")
+    file.write(f"CREATE TABLE IF NOT EXISTS {table} (\n")
+    file.write("    id SERIAL PRIMARY KEY,\n")
+    file.write("    ticker VARCHAR(10) NOT NULL,\n")
+    file.write("    time INTEGER NOT NULL,\n")
+    file.write("    high FLOAT NOT NULL,\n")
+    file.write("    low FLOAT NOT NULL,\n")
+    file.write("    avg FLOAT NOT NULL,\n")
+    file.write("    sale FLOAT NOT NULL,\n")
+    file.write("    open FLOAT,\n")
+    file.write("    close FLOAT,\n")
+    file.write("    volume FLOAT,\n")
+    file.write("    vwap FLOAT,\n")
+    file.write("    transactions INTEGER,\n")
+    file.write("    source VARCHAR(16),\n")
+    file.write("    meta JSONB\n")
+    file.write(");\n\n")
+
+
+def write_indexes(file, table):
+    # Building indexes once after the load is much faster than maintaining them per row
+    file.write("-- Create indexes\n")
+    file.write(f"CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table}(time);\n")
+    file.write(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_ticker_time ON {table}(ticker, time);\n")
+    file.write(f"ANALYZE {table};\n\n")
+
+
+def write_inserts(file, table, where, batch_size, page_size):
+    """Write rows as multi-row INSERT statements; returns the number of rows written."""
+    records_written = 0
+    batch = []
+    for page in iter_pages(where, page_size):
+        with stage("export_batch", format="insert"):
+            for row in page:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    write_batch(file, table, batch)
+                    records_written += len(batch)
+                    batch = []
+        logger.debug(f"Written {records_written + len(batch):,} records...")
+
+    # Write remaining records
+    if batch:
+        write_batch(file, table, batch)
+        records_written += len(batch)
+    return records_written
+
+
+def write_copy(file, table, where, page_size):
+    """Write rows as a ``COPY ... FROM stdin`` block; returns the number of rows written."""
+    file.write(f"COPY {table} ({', '.join(STOCK_COLUMNS)}) FROM stdin;\n")
+    if engine.dialect.name == "postgresql":
+        file.flush()
+        records_written = copy_out(file, where)
+    else:
+        records_written = 0
+        for page in iter_pages(where, page_size):
+            with stage("export_batch", format="copy"):
+                file.writelines(
+                    "\t".join(copy_value(getattr(row, column), column == "meta") for column in STOCK_COLUMNS)
+                    + "\n"
+                    for row in page
+                )
+            records_written += len(page)
+            logger.debug(f"Written {records_written:,} records...")
+    file.write("\\.\n")
+    return records_written
+
+
+def copy_out(file, where, binary=False):
+    """Stream rows straight from PostgreSQL's ``COPY ... TO STDOUT`` into ``file``."""
+    query = f"SELECT {', '.join(STOCK_COLUMNS)} FROM {Stock.__tablename__}"
+    if where:
+        query += f" WHERE {where}"
+    options = " WITH (FORMAT binary)" if binary else ""
+
+    with stage("export_copy", format="binary" if binary else "copy"), engine.connect() as conn:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT{options}", file)
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+
 def write_batch(file, table, batch):
     """Write a batch of records as an INSERT statement."""
     if not batch:
         return
-    
+
     # Start INSERT statement
-    file.write(f"INSERT INTO {table} (ticker, time, high, low, avg, sale, meta) VALUES\n")
-    
-    # Write values
-    for i, record in enumerate(batch):
-        # Escape single quotes in ticker
-        ticker = record['ticker'].replace("'", "''")
-        
+    file.write(f"INSERT INTO {table} ({', '.join(STOCK_COLUMNS)}) VALUES\n")
+
+    values = []
+    for row in batch:
         # Convert meta dict to JSON string
-        meta_json = json.dumps(record['meta']) if record['meta'] else 'NULL'
-        if meta_json != 'NULL':
-            # Escape single quotes in JSON
-            meta_json = "'" + meta_json.replace("'", "''") + "'::jsonb"
-        
-        # Write value tuple
-        file.write(f"    ('{ticker}', {record['time']}, {record['high']}, "
-                  f"{record['low']}, {record['avg']}, {record['sale']}, {meta_json})")
-        
-        # Add comma except for last record
-        if i < len(batch) - 1:
-            file.write(",\n")
-        else:
-            file.write(";\n")
-    
-    file.write("\n")
+        meta_json = 'NULL'
+        if row.meta:
+            meta_json = sql_literal(json.dumps(row.meta)) + "::jsonb"
+
+        columns = ", ".join(sql_literal(getattr(row, column)) for column in STOCK_COLUMNS[:-1])
+        values.append(f"    ({columns}, {meta_json})")
+
+    file.write(",\n".join(values))
+    file.write(";\n\n")
+
+
+def sql_literal(value):
+    """Format a nullable number or string as a SQL literal."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
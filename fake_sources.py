@@ -0,0 +1,112 @@
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+from polygon.rest.models import Agg
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+# Regular session minutes served by FakePolygonClient, as minutes after ET midnight
+SESSION_OPEN = 9 * 60 + 30
+SESSION_CLOSE = 16 * 60
+
+
+def seeded_rng(*parts):
+    """Deterministic generator for a ticker/day, so every run serves the same bars."""
+    return np.random.default_rng(zlib.crc32("/".join(str(part) for part in parts).encode()))
+
+
+def synthetic_bars(ticker, day, minutes):
+    """Random-walk OHLCV bars for ``ticker`` at ``minutes`` (minutes after ET midnight on ``day``).
+
+    Returns (unix_times, open, high, low, close, volume, vwap) arrays.
+    """
+    rng = seeded_rng(ticker, day)
+    midnight = int(datetime.combine(day, datetime.min.time(), MARKET_TZ).timestamp())
+    times = midnight + np.asarray(minutes, dtype=np.int64) * 60
+    base = 50 + zlib.crc32(ticker.encode()) % 400
+    close = base * np.exp(np.cumsum(rng.normal(0, 0.0008, len(times))))
+    open_ = np.concatenate(([base], close[:-1]))
+    spread = np.abs(rng.normal(0, 0.0005, len(times))) * close
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = rng.integers(100, 50000, len(times)).astype(np.float64)
+    vwap = (high + low + close) / 3
+    return times, open_, high, low, close, volume, vwap
+
+
+class FakePolygonClient:
+    """Offline stand-in for ``polygon.RESTClient`` serving synthetic minute aggregates.
+
+    ``list_aggs`` yields regular-session bars (09:30-16:00 ET, weekdays) for
+    the requested range and sleeps ``latency`` seconds per page of ``limit``
+    bars, like one HTTP round trip per page.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    def list_aggs(self, ticker, multiplier, timespan, from_, to, limit=50000, **kwargs):
+        if timespan != "minute":
+            raise ValueError(f"FakePolygonClient only serves minute bars, not {timespan}")
+        if isinstance(from_, str):
+            start = int(datetime.combine(date.fromisoformat(from_), datetime.min.time(), MARKET_TZ).timestamp())
+        else:
+            start = int(from_) // 1000
+        if isinstance(to, str):
+            last_day, end = date.fromisoformat(to), None
+        else:
+            end = int(to) // 1000
+            last_day = datetime.fromtimestamp(end, MARKET_TZ).date()
+
+        served = 0
+        self.requests += 1
+        time.sleep(self.latency)
+        day = datetime.fromtimestamp(start, MARKET_TZ).date()
+        while day <= last_day:
+            if day.weekday() < 5:
+                minutes = np.arange(SESSION_OPEN, SESSION_CLOSE, multiplier)
+                times, *columns = synthetic_bars(ticker, day, minutes)
+                keep = times >= start if end is None else (times >= start) & (times <= end)
+                for bar_time, open_, high, low, close, volume, vwap in zip(
+                    times[keep].tolist(), *(column[keep].tolist() for column in columns)
+                ):
+                    if served and served % limit == 0:
+                        # Next page
+                        self.requests += 1
+                        time.sleep(self.latency)
+                    served += 1
+                    yield Agg(open=open_, high=high, low=low, close=close, volume=volume, vwap=vwap,
+                              timestamp=bar_time * 1000, transactions=int(volume // 100), otc=None)
+            day += timedelta(days=1)
+
+
+class FakeYFTicker:
+    """Offline stand-in for ``yf.Ticker`` serving today's synthetic 1-minute bars.
+
+    ``history`` sleeps ``latency`` seconds and returns the bars from ``start``
+    (or ET midnight) up to the current minute; ``info`` holds the fields
+    ``FundamentalsCache`` reads.
+    """
+
+    def __init__(self, symbol, latency=0.0):
+        self.symbol = symbol
+        self.latency = latency
+        self.info = {"previousClose": 100.0, "marketCap": 10 ** 12, "trailingPE": 25.0}
+
+    def history(self, period=None, start=None, interval="1m", prepost=True, timeout=None, **kwargs):
+        time.sleep(self.latency)
+        now = datetime.now(MARKET_TZ)
+        midnight = datetime.combine(now.date(), datetime.min.time(), MARKET_TZ)
+        first = 0 if start is None else max(0, int((start - midnight).total_seconds()) // 60)
+        minutes = np.arange(0, int((now - midnight).total_seconds()) // 60 + 1)
+        times, open_, high, low, close, volume, _ = synthetic_bars(self.symbol, now.date(), minutes)
+        frame = pd.DataFrame(
+            {"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume.astype(np.int64)},
+            index=pd.to_datetime(times, unit="s", utc=True).tz_convert(MARKET_TZ),
+        )
+        return frame.iloc[first:]
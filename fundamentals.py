@@ -0,0 +1,125 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+
+from settings import FUNDAMENTALS_CACHE_FILE, FUNDAMENTALS_TTL_SECONDS
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+# Expiry is spread by up to this fraction of the TTL so entries fetched together
+# don't all expire on the same cycle
+TTL_JITTER = 0.1
+
+
+class FundamentalsCache:
+    """TTL cache for slow-changing ``Ticker.info`` fields.
+
+    Each field in ``ttls`` expires independently; when any field has expired,
+    ``ticker.info`` is fetched once and only the expired fields are updated and
+    re-stamped, so the others keep their own schedule. Entries also expire
+    when the ET trading date changes, so day-level values such as
+    ``previousClose`` never carry over. The cache is persisted to a JSON file
+    so a restart doesn't refetch everything at once.
+
+    yfinance gives ``ticker.info`` no timeout parameter, so the fetch runs in a
+    daemon thread that ``get`` waits on for at most its ``timeout``; a late
+    fetch still updates the cache when it finishes, and no second fetch for
+    the same ticker starts meanwhile.
+    """
+
+    def __init__(self, path=FUNDAMENTALS_CACHE_FILE, ttls=FUNDAMENTALS_TTL_SECONDS):
+        self.path = path
+        self.ttls = ttls
+        self.entries = {}  # ticker -> {field: {"value", "expires", "day"}}
+        self.hits = 0
+        self.misses = 0
+        self.fetches = {}  # ticker -> Future of the ticker.info fetch in progress
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+            logger.debug(f"Loaded fundamentals cache for {len(self.entries)} ticker(s) from {self.path}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable fundamentals cache {self.path}: {type(e).__name__}: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Write the cache atomically so a crash never leaves a truncated file."""
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps(self.entries)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def get(self, symbol, ticker, timeout=None):
+        """Return a dict of the cached fields for ``symbol``, refreshing from ``ticker.info`` if needed.
+
+        If the refresh takes longer than ``timeout`` seconds, the values cached
+        so far (None for fields never fetched) are returned instead.
+        """
+        now = time.time()
+        today = datetime.now(MARKET_TZ).date().isoformat()
+
+        with self.lock:
+            cached = self.entries.get(symbol, {})
+            expired = [
+                field for field in self.ttls
+                if field not in cached or cached[field]["expires"] <= now or cached[field]["day"] != today
+            ]
+            if not expired:
+                self.hits += 1
+                return {field: cached[field]["value"] for field in self.ttls}
+            self.misses += 1
+            fetch = self.fetches.get(symbol)
+            if fetch is None:
+                # Fetched outside the lock so other tickers aren't serialized behind this round trip
+                fetch = self.fetches[symbol] = Future()
+                threading.Thread(target=self.refresh, args=(symbol, ticker, expired, now, today, fetch),
+                                 name=f"info-{symbol}", daemon=True).start()
+
+        try:
+            fetch.result(timeout)
+        except TimeoutError:
+            logger.warning(f"{symbol}: Ticker.info took longer than {timeout}s, using cached fundamentals")
+        with self.lock:
+            entry = self.entries.get(symbol, {})
+            return {field: entry[field]["value"] if field in entry else None for field in self.ttls}
+
+    def refresh(self, symbol, ticker, expired, now, today, fetch):
+        """Fetch ``ticker.info`` and re-stamp the ``expired`` fields, then resolve ``fetch``."""
+        try:
+            info = ticker.info
+        except BaseException as e:
+            with self.lock:
+                del self.fetches[symbol]
+            fetch.set_exception(e)
+            return
+        with self.lock:
+            entry = self.entries.setdefault(symbol, {})
+            for field in expired:
+                entry[field] = {
+                    "value": info.get(field),
+                    "expires": now + self.ttls[field] * (1 - random.uniform(0, TTL_JITTER)),
+                    "day": today,
+                }
+            del self.fetches[symbol]
+        fetch.set_result(None)
+
+    def stats(self):
+        """Return (hits, misses) since the cache was created."""
+        return self.hits, self.misses
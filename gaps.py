@@ -0,0 +1,108 @@
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from loguru import logger
+
+from database import engine
+from market_check import MARKET_TZ, sessions_between
+from metrics import stage
+from query import fetch_bars
+
+BAR_SECONDS = 60
+
+# A run of consecutive expected minute bars missing for one ticker; first and
+# last are bar start times, so the range to fetch is [first, last] inclusive
+Gap = namedtuple("Gap", ["ticker", "first", "last", "minutes"])
+
+
+def expected_minutes(sessions):
+    """Return the start time of every regular-session minute bar in ``sessions`` as one int64 array."""
+    if not sessions:
+        return np.array([], dtype=np.int64)
+    bounds = np.array(sessions, dtype=np.int64)
+    lengths = (bounds[:, 1] - bounds[:, 0]) // BAR_SECONDS
+    # Minute index within its session, for all sessions at once
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(bounds[:, 0], lengths) + offsets * BAR_SECONDS
+
+
+def find_gaps(ticker, expected, stored, min_minutes=1):
+    """Coalesce the ``expected`` bar times missing from ``stored`` into Gaps.
+
+    Runs are consecutive in session-minute order, so bars missing from the
+    close of one session through the open of the next are a single Gap.
+    Runs shorter than ``min_minutes`` are dropped.
+    """
+    missing = np.flatnonzero(~np.isin(expected, stored))
+    if not missing.size:
+        return []
+    breaks = np.flatnonzero(np.diff(missing) != 1)
+    firsts = missing[np.concatenate(([0], breaks + 1))]
+    lasts = missing[np.append(breaks, missing.size - 1)]
+    return [Gap(ticker, int(expected[first]), int(expected[last]), int(last - first + 1))
+            for first, last in zip(firsts, lasts) if last - first + 1 >= min_minutes]
+
+
+def scan_gaps(tickers, start, end, min_minutes=1, source="polygon"):
+    """Return {ticker: [Gap, ...]} for regular-session minutes between two dates with no stored bar.
+
+    ``start`` and ``end`` are inclusive ET dates; holidays and early closes
+    come from the NYSE calendar, and minutes whose bar isn't complete yet are
+    ignored. Only bars from ``source`` count as present.
+    """
+    expected = expected_minutes(sessions_between(start, end))
+    expected = expected[expected + BAR_SECONDS <= int(datetime.now().timestamp())]
+    if not expected.size:
+        return {ticker: [] for ticker in tickers}
+
+    found = {}
+    with engine.connect() as conn:
+        for ticker in tickers:
+            with stage("gap_scan"):
+                stored = fetch_bars(conn, [ticker], int(expected[0]), int(expected[-1]) + BAR_SECONDS,
+                                    (), source)[ticker]["time"]
+                found[ticker] = find_gaps(ticker, expected, stored, min_minutes)
+            minutes = sum(gap.minutes for gap in found[ticker])
+            logger.debug(f"{ticker}: {len(stored)} of {len(expected)} session minutes stored, "
+                         f"{minutes} missing in {len(found[ticker])} gap(s)")
+    return found
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, MARKET_TZ).strftime("%Y-%m-%d %H:%M")
+
+
+@click.command()
+@click.argument("tickers", nargs=-1, required=True)
+@click.option("--days", default=90, help="Number of days to scan (default: 90)")
+@click.option("--min-minutes", default=1, help="Ignore gaps shorter than this many minutes (default: 1)")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+def main(tickers, days, min_minutes, debug):
+    """List regular-session minute bars missing from stocks for TICKERS.
+
+    Fill them with `python backfill.py TICKERS --days N --gaps`, which fetches
+    only the missing ranges. Thinly traded tickers have minutes without any
+    trades, for which Polygon returns no bar; raise --min-minutes to skip them.
+    """
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    today = datetime.now(MARKET_TZ).date()
+    found = scan_gaps([ticker.upper() for ticker in tickers], today - timedelta(days=days), today, min_minutes)
+    for ticker, gaps in found.items():
+        minutes = sum(gap.minutes for gap in gaps)
+        logger.info(f"{ticker}: {minutes} missing minute(s) in {len(gaps)} gap(s)")
+        for gap in gaps:
+            logger.info(f"  {format_time(gap.first)} .. {format_time(gap.last)} ET ({gap.minutes} min)")
+
+
+if __name__ == "__main__":
+    main()
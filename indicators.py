@@ -0,0 +1,318 @@
+import math
+import sys
+import time
+from datetime import datetime
+
+import click
+import numpy as np
+from loguru import logger
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import delete, func, or_, select
+
+from compaction import require_expanded
+from database import IndicatorState, Stock, StockIndicator, engine
+from market_check import MARKET_TZ
+from metrics import count, stage
+from query import split_columns, to_timestamp
+from settings import INDICATOR_CHUNK_DAYS, INDICATORS
+from writers import insert_ignore_statement
+
+KINDS = ("sma", "ema", "volatility", "return", "vwap")
+BAR_FIELDS = ("high", "low", "close", "volume", "vwap")
+
+
+def parse_indicator(name):
+    """Split ``sma_20`` into ("sma", 20); ``vwap`` has no window."""
+    kind, _, window = name.partition("_")
+    if kind not in KINDS or (kind == "vwap") != (window == ""):
+        raise ValueError(f"Unknown indicator {name!r}; use sma_N, ema_N, volatility_N, return_N or vwap")
+    if kind == "vwap":
+        return kind, None
+    if not window.isdigit() or int(window) < 1 or (kind == "volatility" and int(window) < 2):
+        raise ValueError(f"Bad window in indicator {name!r}")
+    return kind, int(window)
+
+
+def history_needed(names):
+    """Closes to carry between updates so every windowed indicator can continue."""
+    needed = 0
+    for name in names:
+        kind, window = parse_indicator(name)
+        if kind == "sma":
+            needed = max(needed, window - 1)
+        elif kind in ("return", "volatility"):
+            needed = max(needed, window)
+    return needed
+
+
+def ema(values, alpha, previous=None):
+    """Exponential moving average ``y[t] = alpha * x[t] + (1 - alpha) * y[t-1]``, continuing from ``previous``.
+
+    The recurrence is unrolled in blocks, where each block is a cumulative sum
+    scaled by powers of the decay; blocks are short enough that the powers
+    stay within twelve orders of magnitude.
+    """
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    if decay == 0:
+        # ema_1: each value is its own average (and the powers below would all be zero)
+        out[:] = values
+        return out
+    previous = values[0] if previous is None else previous
+    block = max(1, min(4096, int(12 * math.log(10) / -math.log(decay)))) if decay > 0 else 1
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        out[start:start + len(chunk)] = powers * (previous + alpha * np.cumsum(chunk / powers))
+        previous = out[start + len(chunk) - 1]
+    return out
+
+
+def et_days(times):
+    """ET calendar day number of each Unix timestamp, converting each distinct hour only once."""
+    hours, inverse = np.unique(times // 3600, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(hour) * 3600, MARKET_TZ).utcoffset().total_seconds()
+                        for hour in hours], dtype=np.int64)
+    return (times + offsets[inverse]) // 86400
+
+
+def session_vwap(bars, carried):
+    """Volume-weighted average price since each bar's ET session start; returns (values, state to carry)."""
+    times = bars["time"]
+    price = np.where(np.isnan(bars["vwap"]), (bars["high"] + bars["low"] + bars["close"]) / 3, bars["vwap"])
+    volume = np.nan_to_num(bars["volume"])
+    days = et_days(times)
+
+    new_day = np.empty(len(times), dtype=bool)
+    new_day[0] = carried is None or carried["day"] != days[0]
+    new_day[1:] = days[1:] != days[:-1]
+    carry_pv, carry_volume = (0.0, 0.0) if new_day[0] else (carried["pv"], carried["volume"])
+
+    pv = price * volume
+    total_pv = np.cumsum(pv) + carry_pv
+    total_volume = np.cumsum(volume) + carry_volume
+    # Subtract everything before the start of each bar's session
+    starts = np.maximum.accumulate(np.where(new_day, np.arange(len(times)), 0))
+    base_pv = np.where(new_day[starts], (total_pv - pv)[starts], 0.0)
+    base_volume = np.where(new_day[starts], (total_volume - volume)[starts], 0.0)
+    session_pv, session_volume = total_pv - base_pv, total_volume - base_volume
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = np.where(session_volume > 0, session_pv / session_volume, np.nan)
+    return values, {"day": int(days[-1]), "pv": float(session_pv[-1]), "volume": float(session_volume[-1])}
+
+
+def compute(bars, names, state):
+    """Compute ``names`` for new ``bars`` (time-ordered column arrays), continuing from ``state``.
+
+    Returns ({name: float array aligned with bars, NaN during warm-up}, new state).
+    """
+    closes = np.concatenate((np.array(state.get("closes", []), dtype=np.float64), bars["close"]))
+    offset = len(closes) - len(bars["close"])
+    log_returns = np.diff(np.log(closes))
+    values = {}
+    next_state = {"names": list(names), "ema": dict(state.get("ema", {}))}
+
+    for name in names:
+        kind, window = parse_indicator(name)
+        full = np.full(len(closes), np.nan)
+        if kind == "sma":
+            if len(closes) >= window:
+                full[window - 1:] = sliding_window_view(closes, window).mean(axis=1)
+        elif kind == "return":
+            if len(closes) > window:
+                full[window:] = closes[window:] / closes[:-window] - 1.0
+        elif kind == "volatility":
+            if len(log_returns) >= window:
+                full[window:] = sliding_window_view(log_returns, window).std(axis=1, ddof=1)
+        elif kind == "ema":
+            values[name] = ema(bars["close"], 2.0 / (window + 1), state.get("ema", {}).get(name))
+            next_state["ema"][name] = float(values[name][-1])
+            continue
+        else:
+            values[name], next_state["vwap"] = session_vwap(bars, state.get("vwap"))
+            continue
+        values[name] = full[offset:]
+
+    keep = history_needed(names)
+    next_state["closes"] = closes[len(closes) - keep:].tolist() if keep else []
+    return values, next_state
+
+
+def source_filter(source):
+    if source == "polygon":
+        # Rows written before the source column existed are Polygon bars
+        return or_(Stock.source == source, Stock.source.is_(None))
+    return Stock.source == source
+
+
+def read_bars(conn, ticker, source, start, end):
+    """Bars of ``ticker`` with ``start < time < end`` as column arrays, skipping rows without a close."""
+    columns = [Stock.__table__.c[field] for field in BAR_FIELDS]
+    rows = conn.execute(
+        select(Stock.ticker, Stock.time, *columns)
+        .where(Stock.ticker == ticker, source_filter(source), Stock.time > start, Stock.time < end,
+               Stock.close.is_not(None))
+        .order_by(Stock.time)
+    ).all()
+    return split_columns(rows, [ticker], BAR_FIELDS)[ticker]
+
+
+def update_ticker(ticker, names, source="polygon", rebuild=False, chunk_days=INDICATOR_CHUNK_DAYS):
+    """Bring ``ticker``'s indicators up to date; returns the number of new bars processed.
+
+    Only bars newer than the saved state are read, in ``chunk_days`` chunks
+    that each commit their indicator rows and state together. The indicators
+    are recomputed from the first bar when ``rebuild`` is set, when ``names``
+    differ from the saved ones, or when bars were inserted before the newest
+    processed bar (a backfill into the past).
+    """
+    table = StockIndicator.__table__
+    with engine.connect() as conn:
+        saved = conn.execute(
+            select(IndicatorState.last_time, IndicatorState.bars, IndicatorState.state)
+            .where(IndicatorState.ticker == ticker, IndicatorState.source == source)
+        ).first()
+        if saved is not None and not rebuild:
+            if saved.state.get("names") != list(names):
+                logger.info(f"{ticker}: indicator set changed, recomputing")
+                rebuild = True
+            else:
+                stored = conn.execute(select(func.count()).select_from(Stock).where(
+                    Stock.ticker == ticker, source_filter(source), Stock.time <= saved.last_time,
+                    Stock.close.is_not(None),
+                )).scalar()
+                if stored != saved.bars:
+                    logger.info(f"{ticker}: {stored - saved.bars} bar(s) appeared before "
+                                f"{datetime.fromtimestamp(saved.last_time)}, recomputing")
+                    rebuild = True
+        newest = conn.execute(select(func.max(Stock.time)).where(Stock.ticker == ticker,
+                                                                 source_filter(source))).scalar()
+
+    if rebuild or saved is None:
+        with engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.ticker == ticker, table.c.source == source))
+            conn.execute(delete(IndicatorState).where(IndicatorState.ticker == ticker,
+                                                      IndicatorState.source == source))
+        last_time, processed, state = -1, 0, {}
+    else:
+        last_time, processed, state = saved.last_time, saved.bars, saved.state
+    if newest is None or newest <= last_time:
+        return 0
+
+    new_bars = 0
+    cursor = last_time
+    step = chunk_days * 86400
+    while cursor < newest:
+        with engine.begin() as conn:
+            with stage("indicator_read"):
+                # The first chunk starts at the oldest bar rather than at the epoch
+                if cursor < 0:
+                    cursor = conn.execute(select(func.min(Stock.time)).where(
+                        Stock.ticker == ticker, source_filter(source))).scalar() - 1
+                bars = read_bars(conn, ticker, source, cursor, cursor + step + 1)
+            cursor += step
+            if not len(bars["time"]):
+                continue
+            with stage("indicator_compute"):
+                values, state = compute(bars, names, state)
+            rows = [
+                {"ticker": ticker, "source": source, "name": name, "time": timestamp, "value": value}
+                for name, column in values.items()
+                for timestamp, value in zip(bars["time"].tolist(), column.tolist())
+                if not math.isnan(value)
+            ]
+            with stage("indicator_write"):
+                if rows:
+                    conn.execute(insert_ignore_statement(conn, table, ("ticker", "source", "name", "time")), rows)
+                processed += len(bars["time"])
+                record = {"ticker": ticker, "source": source, "last_time": int(bars["time"][-1]),
+                          "bars": processed, "state": state}
+                conn.execute(delete(IndicatorState).where(IndicatorState.ticker == ticker,
+                                                          IndicatorState.source == source))
+                conn.execute(IndicatorState.__table__.insert().values(**record))
+            new_bars += len(bars["time"])
+            count("rows", len(rows), stage="indicators")
+    return new_bars
+
+
+def update_indicators(tickers=None, names=INDICATORS, source="polygon", rebuild=False):
+    """Update indicators for ``tickers`` (default: every ticker with ``source`` bars); returns bars processed."""
+    names = list(names)
+    for name in names:
+        parse_indicator(name)
+    with engine.connect() as conn:
+        if not tickers:
+            tickers = conn.execute(select(Stock.ticker).where(source_filter(source))
+                                   .distinct().order_by(Stock.ticker)).scalars().all()
+        if source == "yfinance":
+            require_expanded(conn, "indicators.py", tickers)
+    total = 0
+    for ticker in tickers:
+        bars = update_ticker(ticker, names, source, rebuild)
+        logger.debug(f"{ticker}: indicators updated over {bars} new bar(s)")
+        total += bars
+    return total
+
+
+def load_indicators(tickers, start, end, names=INDICATORS, source="polygon"):
+    """Load stored indicators with ``start <= time < end`` as ``{ticker: {name: (times, values)}}`` arrays."""
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    query = (select(StockIndicator.ticker, StockIndicator.name, StockIndicator.time, StockIndicator.value)
+             .where(StockIndicator.ticker.in_(tickers), StockIndicator.source == source,
+                    StockIndicator.name.in_(names),
+                    StockIndicator.time >= to_timestamp(start), StockIndicator.time < to_timestamp(end))
+             .order_by(StockIndicator.ticker, StockIndicator.name, StockIndicator.time))
+    result = {ticker: {name: (np.array([], dtype=np.int64), np.array([])) for name in names} for ticker in tickers}
+    with engine.connect() as conn:
+        rows = conn.execute(query).all()
+    if rows:
+        ticker_column, name_column, times, values = (np.array(column) for column in zip(*rows))
+        keys = np.char.add(np.char.add(ticker_column.astype(str), "/"), name_column.astype(str))
+        starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+        stops = np.append(starts[1:], len(rows))
+        for lo, hi in zip(starts, stops):
+            result[ticker_column[lo]][name_column[lo]] = (times[lo:hi].astype(np.int64),
+                                                          values[lo:hi].astype(np.float64))
+    return result
+
+
+@click.command()
+@click.argument("tickers", nargs=-1)
+@click.option("--indicator", "names", multiple=True,
+              help=f"Indicator to maintain, repeatable (default: {', '.join(INDICATORS)})")
+@click.option("--source", default="polygon", help="Bar source to compute from (default: polygon)")
+@click.option("--rebuild", is_flag=True, help="Recompute from the first bar instead of updating the tail")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+def main(tickers, names, source, rebuild, debug):
+    """Compute technical indicators for TICKERS (default: all) into stock_indicators.
+
+    Each run only processes bars newer than the previous one, continuing
+    EMAs, rolling windows and the session VWAP from the saved state, so it
+    is cheap to run after every backfill or from cron.
+    """
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    names = names or INDICATORS
+    try:
+        for name in names:
+            parse_indicator(name)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--indicator")
+
+    started = time.perf_counter()
+    bars = update_indicators([ticker.upper() for ticker in tickers], names, source, rebuild)
+    logger.success(f"Updated {len(names)} indicator(s) over {bars:,} bar(s) "
+                   f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
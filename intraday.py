@@ -0,0 +1,108 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+from sqlalchemy import select
+
+from database import Stock
+from settings import INTRADAY_VOLUME_WINDOW
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+
+class IntradayState:
+    """Running intraday aggregates for one ticker.
+
+    Tracks the day high/low, the latest 1-minute bar and the volumes of the last
+    few bars, so each cycle only needs the bars newer than the last one seen
+    instead of the whole day's history.
+    """
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.day = None  # ET trading date the aggregates belong to
+        self.high = None
+        self.low = None
+        self.last_bar = None  # (open, high, low, close, volume) of the newest bar
+        self.last_bar_time = None  # Unix timestamp of the newest bar
+        self.volumes = {}  # bar Unix timestamp -> volume, newest INTRADAY_VOLUME_WINDOW bars
+
+    @classmethod
+    def restore(cls, conn, ticker):
+        """Rebuild today's state from the latest yfinance row stored for ``ticker``."""
+        state = cls(ticker)
+        today = datetime.now(MARKET_TZ).date()
+        day_start = int(datetime.combine(today, datetime.min.time(), MARKET_TZ).timestamp())
+
+        row = conn.execute(
+            select(Stock.time, Stock.high, Stock.low)
+            .where(Stock.ticker == ticker, Stock.time >= day_start, Stock.source == "yfinance")
+            .order_by(Stock.time.desc())
+            .limit(1)
+        ).first()
+        if row is None:
+            return state
+
+        state.day = today
+        state.high = row.high
+        state.low = row.low
+        # Re-read a few bars before the stored snapshot to refill the volume window
+        # and pick up the bar that was still forming when the row was written
+        state.last_bar_time = (row.time // 60 - INTRADAY_VOLUME_WINDOW) * 60
+        logger.debug(f"{ticker}: Restored intraday state from row at "
+                     f"{datetime.fromtimestamp(row.time, MARKET_TZ).strftime('%H:%M')}")
+        return state
+
+    def fetch_start(self):
+        """Return the datetime to request bars from, or None to request the full day."""
+        if self.last_bar_time is None or self.day != datetime.now(MARKET_TZ).date():
+            return None
+        # Inclusive: the newest bar may still have been forming on the last fetch
+        return datetime.fromtimestamp(self.last_bar_time, MARKET_TZ)
+
+    def update(self, minute_data):
+        """Merge newly fetched 1-minute bars (a yfinance history frame) into the state."""
+        if minute_data.empty:
+            return
+
+        # Only keep bars from the newest session in the frame; a new session resets the day
+        day = minute_data.index[-1].tz_convert(MARKET_TZ).date()
+        bars = minute_data[minute_data.index.tz_convert(MARKET_TZ).date == day]
+        if day != self.day:
+            self.reset(day)
+
+        high = float(bars['High'].max())
+        low = float(bars['Low'].min())
+        self.high = high if self.high is None else max(self.high, high)
+        self.low = low if self.low is None else min(self.low, low)
+
+        tail = bars.tail(INTRADAY_VOLUME_WINDOW)
+        for bar_time, volume in zip(tail.index, tail['Volume']):
+            self.volumes[int(bar_time.timestamp())] = int(volume)
+        for bar_time in sorted(self.volumes)[:-INTRADAY_VOLUME_WINDOW]:
+            del self.volumes[bar_time]
+
+        latest = bars.iloc[-1]
+        self.last_bar_time = int(bars.index[-1].timestamp())
+        self.last_bar = (float(latest['Open']), float(latest['High']), float(latest['Low']),
+                         float(latest['Close']), int(latest['Volume']))
+
+    def reset(self, day):
+        self.day = day
+        self.high = None
+        self.low = None
+        self.last_bar = None
+        self.last_bar_time = None
+        self.volumes = {}
+
+    def recent_volume(self):
+        """Return (volume, bars_ago) for the newest bar with non-zero volume, or (0, None)."""
+        for bars_ago, bar_time in enumerate(sorted(self.volumes, reverse=True), start=1):
+            if self.volumes[bar_time] > 0:
+                return self.volumes[bar_time], bars_ago
+        return 0, None
+
+    def recent_volumes(self):
+        """Return [(HH:MM, volume), ...] for the bars in the volume window, oldest first."""
+        return [(datetime.fromtimestamp(bar_time, MARKET_TZ).strftime('%H:%M'), volume)
+                for bar_time, volume in sorted(self.volumes.items())]
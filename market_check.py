@@ -1,53 +1,131 @@
 #!/usr/bin/env python3
 """
-Simple market status checker using pandas_market_calendars.
-Handles NYSE calendar, holidays, early closes, and timezone conversion automatically.
+Simple market status checker using a precomputed NYSE calendar.
+Handles holidays, early closes, and timezone conversion automatically.
+
+Sessions come from market_calendar.json, generated with pandas_market_calendars
+for CALENDAR_YEARS years ahead. Checks only need the standard library; pandas is
+imported only when the file is missing, stale, or rebuilt with `refresh`.
 """
 
+import json
+import os
 import sys
-from datetime import datetime, timedelta
-import pandas as pd
-import pandas_market_calendars as mcal
+from datetime import date, datetime, timedelta
 from zoneinfo import ZoneInfo
 
+MARKET_TZ = ZoneInfo("America/New_York")
+CALENDAR_FILE = os.getenv("MARKET_CALENDAR_FILE",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_calendar.json"))
+CALENDAR_YEARS = 5
+REGULAR_CLOSE = "16:00"
+
+def build_calendar(start, years=CALENDAR_YEARS):
+    """
+    Build {"YYYY-MM-DD": ["HH:MM", "HH:MM"]} ET open/close times for every
+    NYSE session from start through `years` years ahead.
+    """
+    import pandas_market_calendars as mcal
+
+    end = date(start.year + years, 12, 31)
+    schedule = mcal.get_calendar('NYSE').schedule(start_date=start, end_date=end)
+    sessions = {}
+    for day, row in schedule.iterrows():
+        market_open = row['market_open'].tz_convert('America/New_York')
+        market_close = row['market_close'].tz_convert('America/New_York')
+        sessions[day.date().isoformat()] = [market_open.strftime('%H:%M'), market_close.strftime('%H:%M')]
+    return {"start": start.isoformat(), "end": end.isoformat(), "sessions": sessions}
+
+def save_calendar(calendar, path=CALENDAR_FILE):
+    # Write then rename so a concurrent cron check never reads a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(calendar, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def refresh_calendar(years=CALENDAR_YEARS, path=CALENDAR_FILE):
+    """Regenerate the calendar file starting from January 1st of the current year."""
+    today = datetime.now(MARKET_TZ).date()
+    calendar = build_calendar(date(today.year, 1, 1), years)
+    save_calendar(calendar, path)
+    return calendar
+
+def load_calendar(today, path=CALENDAR_FILE):
+    """Load the calendar file, regenerating it if it is missing, unreadable or doesn't cover today."""
+    try:
+        with open(path) as f:
+            calendar = json.load(f)
+        if calendar["start"] <= today.isoformat() <= calendar["end"]:
+            return calendar
+    except (OSError, ValueError, KeyError):
+        pass
+    return refresh_calendar(path=path)
+
+def get_session(now_et):
+    """
+    Return today's (market_open, market_close) as aware ET datetimes,
+    or None if the market is closed all day.
+    """
+    today = now_et.date()
+    session = load_calendar(today)["sessions"].get(today.isoformat())
+    if session is None:
+        return None
+    market_open, market_close = (
+        datetime.combine(today, datetime.strptime(value, '%H:%M').time(), MARKET_TZ) for value in session
+    )
+    return market_open, market_close
+
+def sessions_between(start, end, path=CALENDAR_FILE):
+    """
+    Return [(market_open, market_close)] Unix timestamps for every NYSE
+    session from start through end (dates), early closes included.
+    Ranges the calendar file doesn't cover (usually the past) are built
+    with pandas_market_calendars without touching the file.
+    """
+    calendar = load_calendar(datetime.now(MARKET_TZ).date(), path)
+    if not calendar["start"] <= start.isoformat() <= end.isoformat() <= calendar["end"]:
+        calendar = build_calendar(start, end.year - start.year)
+    bounds = []
+    for day, session in sorted(calendar["sessions"].items()):
+        if start.isoformat() <= day <= end.isoformat():
+            session_day = date.fromisoformat(day)
+            bounds.append(tuple(
+                int(datetime.combine(session_day, datetime.strptime(value, '%H:%M').time(), MARKET_TZ).timestamp())
+                for value in session
+            ))
+    return bounds
+
+def closed_reason(now_et):
+    if now_et.weekday() >= 5:  # Weekend
+        return f"Weekend ({now_et.strftime('%A')})"
+    return "Market holiday"
+
 def get_market_status():
     """
     Check if NYSE is currently open.
     Returns (is_open, reason, current_et_time)
     """
-    # Get NYSE calendar
-    nyse = mcal.get_calendar('NYSE')
-    
     # Get current time in ET
-    now_et = datetime.now(ZoneInfo("America/New_York"))
-    today = now_et.date()
-    
-    # Get today's market schedule
-    schedule = nyse.schedule(start_date=today, end_date=today)
-    
-    if schedule.empty:
+    now_et = datetime.now(MARKET_TZ)
+
+    session = get_session(now_et)
+    if session is None:
         # Market is closed today (weekend or holiday)
-        if now_et.weekday() >= 5:  # Weekend
-            return False, f"Weekend ({now_et.strftime('%A')})", now_et
-        else:
-            return False, f"Market holiday", now_et
-    
-    # Get market open and close times for today
-    market_open = schedule.iloc[0]['market_open'].tz_convert('America/New_York')
-    market_close = schedule.iloc[0]['market_close'].tz_convert('America/New_York')
-    
+        return False, closed_reason(now_et), now_et
+    market_open, market_close = session
+    early_close = market_close.strftime('%H:%M') < REGULAR_CLOSE
+
     # Check if we're in trading hours
     if now_et < market_open:
         return False, f"Before market open (opens at {market_open.strftime('%H:%M')} ET)", now_et
     elif now_et >= market_close:
-        # Check if it was an early close
-        if market_close.hour == 13:  # 1:00 PM close
+        if early_close:
             return False, f"After early close (closed at {market_close.strftime('%H:%M')} ET)", now_et
         else:
             return False, f"After market close (closed at {market_close.strftime('%H:%M')} ET)", now_et
     else:
         # Market is open
-        if market_close.hour == 13:  # Early close day
+        if early_close:
             return True, f"Market open (early close at {market_close.strftime('%H:%M')} ET)", now_et
         else:
             return True, f"Market open (closes at {market_close.strftime('%H:%M')} ET)", now_et
@@ -58,30 +136,18 @@ def should_start_monitoring():
     More permissive - allows starting 5 minutes before market open.
     Returns (should_start, reason, current_et_time)
     """
-    # Get NYSE calendar
-    nyse = mcal.get_calendar('NYSE')
-    
     # Get current time in ET
-    now_et = datetime.now(ZoneInfo("America/New_York"))
-    today = now_et.date()
-    
-    # Get today's market schedule
-    schedule = nyse.schedule(start_date=today, end_date=today)
-    
-    if schedule.empty:
+    now_et = datetime.now(MARKET_TZ)
+
+    session = get_session(now_et)
+    if session is None:
         # Market is closed today
-        if now_et.weekday() >= 5:  # Weekend
-            return False, f"Weekend ({now_et.strftime('%A')})", now_et
-        else:
-            return False, f"Market holiday", now_et
-    
-    # Get market open and close times for today
-    market_open = schedule.iloc[0]['market_open'].tz_convert('America/New_York')
-    market_close = schedule.iloc[0]['market_close'].tz_convert('America/New_York')
-    
+        return False, closed_reason(now_et), now_et
+    market_open, market_close = session
+
     # Allow starting 5 minutes before market open
     start_time = market_open - timedelta(minutes=5)
-    
+
     if now_et < start_time:
         return False, f"Too early (can start at {start_time.strftime('%H:%M')} ET)", now_et
     elif now_et >= market_close:
@@ -90,12 +156,12 @@ def should_start_monitoring():
         return True, f"Good time to start monitoring", now_et
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python market_check.py [status|should_start]")
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[1] != "refresh"):
+        print("Usage: python market_check.py [status|should_start|refresh [years]]")
         sys.exit(1)
-    
+
     command = sys.argv[1]
-    
+
     try:
         if command == "status":
             is_open, reason, current_time = get_market_status()
@@ -103,19 +169,26 @@ if __name__ == "__main__":
             print(f"Market open: {is_open}")
             print(f"Reason: {reason}")
             sys.exit(0 if is_open else 1)
-            
+
         elif command == "should_start":
             should_start, reason, current_time = should_start_monitoring()
             print(f"Current ET: {current_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
             print(f"Should start: {should_start}")
             print(f"Reason: {reason}")
             sys.exit(0 if should_start else 1)
-            
+
+        elif command == "refresh":
+            years = int(sys.argv[2]) if len(sys.argv) == 3 else CALENDAR_YEARS
+            calendar = refresh_calendar(years)
+            print(f"Wrote {len(calendar['sessions'])} sessions "
+                  f"({calendar['start']} to {calendar['end']}) to {CALENDAR_FILE}")
+            sys.exit(0)
+
         else:
-            print("Invalid command. Use 'status' or 'should_start'")
+            print("Invalid command. Use 'status', 'should_start' or 'refresh'")
             sys.exit(1)
-            
+
     except Exception as e:
         print(f"Error checking market status: {e}")
         # On error, assume we should NOT start (fail safe)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
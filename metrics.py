@@ -0,0 +1,244 @@
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+PREFIX = "pipeline"
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key):
+    if not key:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+class Metrics:
+    """Thread-safe stage timers and counters for one process.
+
+    ``stage`` timings are exposed as a Prometheus summary
+    (``pipeline_stage_seconds_count``/``_sum``) plus a ``_max`` gauge, and
+    counters as ``pipeline_<name>_total``. Labels are plain keyword arguments.
+    """
+
+    def __init__(self):
+        self.timers = {}  # label key -> [count, sum, max]
+        self.counters = {}  # (name, label key) -> value
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds, **labels):
+        key = label_key({"stage": stage, **labels})
+        with self.lock:
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def count(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        """Return a JSON-friendly copy: {"stages": [...], "counters": [...]}."""
+        with self.lock:
+            stages = [{**dict(key), "count": count, "seconds": round(total, 6), "max_seconds": round(peak, 6)}
+                      for key, (count, total, peak) in sorted(self.timers.items())]
+            counters = [{"name": name, **dict(key), "value": value}
+                        for (name, key), value in sorted(self.counters.items())]
+        return {"stages": stages, "counters": counters}
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            timers = sorted(self.timers.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        if timers:
+            name = f"{PREFIX}_stage_seconds"
+            lines.append(f"# HELP {name} Wall-clock seconds spent per pipeline stage")
+            lines.append(f"# TYPE {name} summary")
+            for key, (count, total, _) in timers:
+                lines.append(f"{name}_count{format_labels(key)} {count}")
+                lines.append(f"{name}_sum{format_labels(key)} {total:.6f}")
+            lines.append(f"# TYPE {name}_max gauge")
+            for key, (_, _, peak) in timers:
+                lines.append(f"{name}_max{format_labels(key)} {peak:.6f}")
+        declared = set()
+        for (counter, key), value in counters:
+            name = f"{PREFIX}_{counter}_total"
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Metrics()
+
+
+@contextmanager
+def stage(name, **labels):
+    """Time the enclosed block as pipeline stage ``name``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        registry.observe(name, seconds, **labels)
+        logger.bind(stage=name, seconds=round(seconds, 6), **labels).debug(f"Stage {name} took {seconds:.3f}s")
+
+
+def with_stage_records(record):
+    """Loguru filter for an INFO sink that also lets through ``stage``'s DEBUG timing records."""
+    return record["level"].no >= logger.level("INFO").no or "stage" in record["extra"]
+
+
+def count(name, value=1, **labels):
+    """Add ``value`` to counter ``name`` (exported as ``pipeline_<name>_total``)."""
+    registry.count(name, value, **labels)
+
+
+def log_summary(message="Run metrics"):
+    """Log one INFO line of stage totals; the full snapshot is bound as ``metrics`` for JSON logs."""
+    snapshot = registry.snapshot()
+    totals = {}
+    for entry in snapshot["stages"]:
+        seconds, calls = totals.get(entry["stage"], (0.0, 0))
+        totals[entry["stage"]] = (seconds + entry["seconds"], calls + entry["count"])
+    summary = ", ".join(f"{name} {seconds:.2f}s/{calls}" for name, (seconds, calls) in totals.items())
+    logger.bind(metrics=snapshot).info(f"{message}: {summary or 'no stages recorded'}")
+
+
+def write_textfile(path):
+    """Write the metrics for a Prometheus node_exporter textfile collector, atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.trace(f"metrics request: {format % args}")
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve ``/metrics`` on ``host:port`` from a daemon thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class SamplingProfiler:
+    """Statistical profiler for every thread of the process.
+
+    A background thread samples all thread stacks every ``interval`` seconds,
+    so fetch and writer threads are covered without per-thread hooks (which
+    clash with cProfile's single sys.monitoring slot on Python 3.12+). Results
+    load with ``pstats``: a function's tottime and cumtime are the samples it
+    was on top of, or anywhere in, a stack times ``interval``, and its call
+    counts are sample counts.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.threads = set()
+        self.tottime = Counter()  # (file, line, function) -> samples on top of a stack
+        self.cumtime = Counter()  # ... -> samples anywhere in a stack
+        self.callers = defaultdict(Counter)  # callee -> {caller: samples}
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self):
+        self.sampler.start()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.threads.add(ident)
+                    self.sample(frame)
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        self.tottime[stack[0]] += 1
+        # Sets, so recursive functions count once per sample
+        for key in set(stack):
+            self.cumtime[key] += 1
+        for callee, caller in set(zip(stack, stack[1:])):
+            self.callers[callee][caller] += 1
+
+    def stop(self):
+        self.stopped.set()
+        if self.sampler.is_alive():
+            self.sampler.join()
+
+    def create_stats(self):
+        """Build ``self.stats`` in the layout ``pstats.Stats`` loads from a profiler."""
+        seconds = self.interval
+        self.stats = {
+            key: (samples, samples, self.tottime[key] * seconds, samples * seconds,
+                  {caller: (n, n, 0.0, n * seconds) for caller, n in self.callers[key].items()})
+            for key, samples in self.cumtime.items()
+        }
+
+    def save(self, path):
+        """Write the samples as a pstats file; returns the number of samples taken."""
+        pstats.Stats(self).dump_stats(path)
+        return sum(self.tottime.values())
+
+
+@contextmanager
+def instrumented(metrics_file=None, metrics_port=None, profile=None):
+    """Run the enclosed block with the optional metrics endpoint, textfile and sampling profile.
+
+    The textfile is written and the profile saved on the way out, also when
+    the block fails or is interrupted.
+    """
+    server = serve(metrics_port) if metrics_port else None
+    profiler = SamplingProfiler() if profile else None
+    if profiler:
+        profiler.start()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.stop()
+            samples = profiler.save(profile)
+            logger.info(f"Profile of {len(profiler.threads)} thread(s) ({samples:,} samples) written to {profile} "
+                        f"(inspect with: python -m pstats {profile})")
+        log_summary()
+        if metrics_file:
+            write_textfile(metrics_file)
+            logger.debug(f"Wrote metrics to {metrics_file}")
+        if server:
+            server.shutdown()
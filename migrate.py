@@ -0,0 +1,315 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+from loguru import logger
+from sqlalchemy import create_engine, func, inspect, select, text
+from sqlalchemy.schema import CreateTable
+
+from compaction import require_expanded
+from database import Base, Stock, engine, ensure_partitions
+from metrics import stage
+from settings import EXPORT_PAGE_SIZE, EXPORT_WORKERS
+from writers import STOCK_COLUMNS, copy_value
+
+FLOAT_COLUMNS = ("high", "low", "avg", "sale", "open", "close", "volume", "vwap")
+
+# Per worker process, so each ticker stream reuses one connection pool to the target
+target_engines = {}
+
+
+def get_target_engine(url):
+    if url not in target_engines:
+        target_engines[url] = create_engine(url, pool_pre_ping=True)
+    return target_engines[url]
+
+
+def iter_ticker_pages(source, ticker, page_size):
+    """Yield pages of ``ticker``'s stocks rows (STOCK_COLUMNS) from ``source`` in time order.
+
+    Keyset pagination on the (ticker, time) index, so every page is a short
+    indexed range read and memory stays flat.
+    """
+    columns = [Stock.__table__.c[column] for column in STOCK_COLUMNS]
+    last_time = None
+    while True:
+        query = select(*columns).where(Stock.ticker == ticker).order_by(Stock.time).limit(page_size)
+        if last_time is not None:
+            query = query.where(Stock.time > last_time)
+        with source.connect() as conn:
+            page = conn.execute(query).all()
+        if not page:
+            return
+        last_time = page[-1].time
+        yield page
+
+
+def row_digest(row):
+    """64-bit hash of a row's values, normalized so SQLite and PostgreSQL reads hash the same."""
+    values = []
+    for column, value in zip(STOCK_COLUMNS, row):
+        if value is not None and column in FLOAT_COLUMNS:
+            value = float(value)
+        elif value is not None and column == "meta":
+            value = json.dumps(value, sort_keys=True)
+        values.append(value)
+    return int.from_bytes(hashlib.blake2b(repr(values).encode(), digest_size=8).digest(), "little")
+
+
+class Checksum:
+    """Order-independent row count and checksum (sum of row digests mod 2**64)."""
+
+    def __init__(self):
+        self.rows = 0
+        self.value = 0
+
+    def add(self, rows):
+        self.rows += len(rows)
+        self.value = (self.value + sum(row_digest(row) for row in rows)) % 2 ** 64
+
+
+class PageStream(io.RawIOBase):
+    """Read-only file over an iterator of ``bytes`` chunks, for ``copy_expert``."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.pending) < len(buffer):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.pending += chunk
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def copy_lines(pages, checksum):
+    """Encode pages of rows as COPY text, adding them to ``checksum`` on the way."""
+    for page in pages:
+        checksum.add(page)
+        yield "".join(
+            "\t".join(copy_value(value, column == "meta") for column, value in zip(STOCK_COLUMNS, row)) + "\n"
+            for row in page
+        ).encode()
+
+
+def configure_worker(debug):
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+
+def migrate_ticker(target_url, ticker, page_size):
+    """Worker process entry point: stream one ticker into the target with COPY; returns (rows, checksum, seconds).
+
+    The ticker is copied in a single target transaction, so a failed stream
+    leaves none of its rows behind.
+    """
+    started = time.perf_counter()
+    checksum = Checksum()
+    stream = PageStream(copy_lines(iter_ticker_pages(engine, ticker, page_size), checksum))
+    with get_target_engine(target_url).begin() as conn:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {Stock.__tablename__} ({', '.join(STOCK_COLUMNS)}) FROM STDIN",
+                               stream, size=1 << 20)
+        finally:
+            cursor.close()
+    return checksum.rows, checksum.value, time.perf_counter() - started
+
+
+def verify_ticker(target_url, ticker, page_size):
+    """Worker process entry point: (rows, checksum) of ``ticker`` as stored in the target."""
+    checksum = Checksum()
+    for page in iter_ticker_pages(get_target_engine(target_url), ticker, page_size):
+        checksum.add(page)
+    return checksum.rows, checksum.value
+
+
+def create_partitioned_stocks(conn):
+    """Create ``stocks`` partitioned by ``time`` with its default partition, as alembic revision 3f1c9a7d2e54 leaves it.
+
+    Monthly partitions are added afterwards by ``ensure_partitions``.
+    """
+    conn.execute(CreateTable(Stock.__table__))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('stocks', 'id')")).scalar()
+    conn.execute(text("ALTER TABLE stocks RENAME TO stocks_template"))
+    conn.execute(text("ALTER TABLE stocks_template DROP CONSTRAINT stocks_pkey"))
+    # Same columns and id default; the partition key must be in the primary key
+    conn.execute(text("CREATE TABLE stocks (LIKE stocks_template INCLUDING DEFAULTS) PARTITION BY RANGE (time)"))
+    conn.execute(text("ALTER TABLE stocks ADD CONSTRAINT stocks_pkey PRIMARY KEY (id, time)"))
+    conn.execute(text("CREATE TABLE stocks_default PARTITION OF stocks DEFAULT"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY stocks.id"))
+    conn.execute(text("DROP TABLE stocks_template"))
+
+
+def prepare_target(target, oldest, newest):
+    """Create the target schema without ``stocks``' secondary indexes; returns True if ``stocks`` was empty.
+
+    A new ``stocks`` is partitioned by month like a migrated database, with
+    partitions for ``oldest`` to ``newest`` (source bar times) and the months
+    ahead. Indexes that already exist on an empty ``stocks`` are dropped so the
+    load doesn't maintain them row by row; ``create_indexes`` builds any
+    missing ones afterwards, including on a rerun.
+    """
+    table = Stock.__table__
+    with target.begin() as conn:
+        if not inspect(conn).has_table(table.name):
+            create_partitioned_stocks(conn)
+        Base.metadata.create_all(conn, tables=[other for other in Base.metadata.sorted_tables if other is not table])
+        empty = conn.execute(select(Stock.id).limit(1)).first() is None
+        if empty:
+            for index in table.indexes:
+                index.drop(conn, checkfirst=True)
+    # Rows outside the partitions would all land in stocks_default
+    ensure_partitions(oldest, newest, bind=target)
+    return empty
+
+
+def create_indexes(target):
+    """Create whichever of ``stocks``' indexes the target lacks, then ANALYZE it."""
+    with target.begin() as conn:
+        present = {index["name"] for index in inspect(conn).get_indexes(Stock.__tablename__)}
+        for index in Stock.__table__.indexes:
+            if index.name in present:
+                continue
+            with stage("migrate_index"):
+                index.create(conn)
+            logger.info(f"Created index {index.name}")
+        conn.execute(text(f"ANALYZE {Stock.__tablename__}"))
+
+
+def run_parallel(function, target_url, tickers, page_size, workers, debug):
+    """Run ``function(target_url, ticker, page_size)`` for every ticker in worker processes; yields (ticker, result or exception)."""
+    # Spawned workers build their own engines instead of sharing the parent's pooled connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=configure_worker, initargs=(debug,)) as executor:
+        futures = {executor.submit(function, target_url, ticker, page_size): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+@click.command()
+@click.argument("tickers", nargs=-1)
+@click.option("--target", required=True, envvar="TARGET_DATABASE_URL",
+              help="PostgreSQL URL to migrate into (default: $TARGET_DATABASE_URL)")
+@click.option("--workers", default=EXPORT_WORKERS,
+              help=f"Tickers streamed in parallel (default: {EXPORT_WORKERS})")
+@click.option("--page-size", default=EXPORT_PAGE_SIZE, help=f"Rows read per page (default: {EXPORT_PAGE_SIZE})")
+@click.option("--verify/--no-verify", default=True,
+              help="Compare per-ticker row counts and checksums after the load (default: on)")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+def main(tickers, target, workers, page_size, verify, debug):
+    """Stream stocks rows for TICKERS (default: all) from DATABASE_URL into a PostgreSQL --target.
+
+    Each ticker is read in pages and piped straight into COPY, several
+    tickers at a time, with no intermediate dump file. Secondary indexes are
+    built once after the load. A ticker is copied in one transaction, and
+    tickers already in the target are skipped (but still verified), so an
+    interrupted run can simply be repeated.
+    """
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    target_engine = get_target_engine(target)
+    if target_engine.dialect.name != "postgresql":
+        raise click.UsageError("--target must be a PostgreSQL database URL")
+
+    with engine.connect() as conn:
+        if tickers:
+            tickers = [ticker.upper() for ticker in tickers]
+        else:
+            tickers = conn.execute(select(Stock.ticker).distinct().order_by(Stock.ticker)).scalars().all()
+        require_expanded(conn, "migrate.py", tickers)
+        oldest, newest = conn.execute(select(func.min(Stock.time), func.max(Stock.time))).first()
+
+    empty = prepare_target(target_engine, oldest, newest)
+    existing = {}
+    if not empty:
+        # A rerun: one scan for what earlier runs (or other loads) already put in the target
+        with target_engine.connect() as conn:
+            existing = dict(conn.execute(select(Stock.ticker, func.count()).group_by(Stock.ticker)).all())
+        logger.info(f"Target already holds {sum(existing.values()):,} rows for {len(existing)} ticker(s)")
+
+    pending = [ticker for ticker in tickers if ticker not in existing]
+    logger.info(f"Migrating {len(pending)} ticker(s) from {engine.dialect.name} to "
+                f"{target_engine.url.database} with {workers} stream(s)"
+                + (f" ({len(tickers) - len(pending)} already in the target)" if len(pending) < len(tickers) else ""))
+
+    started = time.perf_counter()
+    source_sums = {}
+    failed = []
+    for ticker, result in run_parallel(migrate_ticker, target, pending, page_size, workers, debug):
+        if isinstance(result, Exception):
+            logger.error(f"{ticker}: {type(result).__name__}: {result}")
+            failed.append(ticker)
+            continue
+        rows, checksum, seconds = result
+        source_sums[ticker] = (rows, checksum)
+        logger.info(f"{ticker}: {rows:,} rows in {seconds:.1f}s ({rows / seconds if seconds else 0:,.0f} rows/sec)")
+    loaded = sum(rows for rows, _ in source_sums.values())
+    load_seconds = time.perf_counter() - started
+    logger.info(f"Loaded {loaded:,} rows in {load_seconds:.1f}s "
+                f"({loaded / load_seconds if load_seconds else 0:,.0f} rows/sec)")
+
+    # Also on reruns: an interrupted first run leaves committed tickers behind but no indexes
+    create_indexes(target_engine)
+
+    if verify:
+        # Tickers found in the target up front were loaded by another run; checksum their source side too
+        for ticker in tickers:
+            if ticker in existing:
+                checksum = Checksum()
+                for page in iter_ticker_pages(engine, ticker, page_size):
+                    checksum.add(page)
+                source_sums[ticker] = (checksum.rows, checksum.value)
+
+        mismatched = []
+        for ticker, result in run_parallel(verify_ticker, target, sorted(source_sums), page_size, workers, debug):
+            if isinstance(result, Exception):
+                logger.error(f"{ticker}: verification failed: {type(result).__name__}: {result}")
+                mismatched.append(ticker)
+            elif result != source_sums[ticker]:
+                (source_rows, source_sum), (target_rows, target_sum) = source_sums[ticker], result
+                logger.error(f"{ticker}: source has {source_rows:,} rows (checksum {source_sum:016x}), "
+                             f"target {target_rows:,} ({target_sum:016x})")
+                mismatched.append(ticker)
+            else:
+                logger.debug(f"{ticker}: {result[0]:,} rows verified (checksum {result[1]:016x})")
+        if mismatched:
+            failed.extend(mismatched)
+        else:
+            logger.info(f"Verified row counts and checksums for {len(source_sums)} ticker(s)")
+
+    if failed:
+        logger.error(f"Failed ticker(s): {', '.join(sorted(set(failed)))}")
+        sys.exit(1)
+    logger.success(f"Migrated {loaded:,} rows for {len(pending)} ticker(s) in {time.perf_counter() - started:.1f}s. "
+                   f"Bring the target's schema up to date with `DATABASE_URL=<target> alembic upgrade head`, "
+                   f"then rebuild derived tables there with rollups.py and indicators.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+
+from compaction import compacted_rows
+from database import Stock, StockRollup, engine
+from settings import QUERY_CACHE_BYTES
+
+FIELDS = ("high", "low", "avg", "sale", "open", "close", "volume", "vwap", "transactions")
+DEFAULT_FIELDS = ("open", "high", "low", "close", "volume")
+ROLLUP_FIELDS = ("open", "high", "low", "close", "volume", "vwap", "bars")
+
+
+class BarCache:
+    """LRU cache of per-ticker bar arrays, bounded by the total bytes it holds.
+
+    Each entry remembers the ticker's newest bar time (its watermark) when it
+    was loaded. New bars are appended after the watermark, so an entry stays
+    valid while the watermark is unchanged or the cached range ends at or
+    before it. Writers in this process also call ``invalidate`` directly,
+    which covers rows inserted into the middle of a range by a backfill.
+    """
+
+    def __init__(self, max_bytes=QUERY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (ticker, start, end, fields, source) -> (watermark, arrays, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, watermark):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                cached_watermark, arrays, _ = entry
+                end = key[2]
+                if cached_watermark == watermark or (cached_watermark is not None and cached_watermark >= end - 1):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return arrays
+                self.pop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, watermark, arrays):
+        size = sum(array.nbytes for array in arrays.values())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.pop(key)
+            self.entries[key] = (watermark, arrays, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.pop(next(iter(self.entries)))
+
+    def pop(self, key):
+        _, _, size = self.entries.pop(key)
+        self.nbytes -= size
+
+    def invalidate(self, tickers=None):
+        """Drop cached ranges for ``tickers`` (all tickers if None)."""
+        with self.lock:
+            for key in list(self.entries):
+                if tickers is None or key[0] in tickers:
+                    self.pop(key)
+
+    def stats(self):
+        """Return (hits, misses, entries, bytes)."""
+        return self.hits, self.misses, len(self.entries), self.nbytes
+
+
+cache = BarCache()
+
+
+def invalidate(tickers=None):
+    """Forget cached bars for ``tickers``; called by writers after they commit new rows."""
+    cache.invalidate(tickers)
+
+
+def to_timestamp(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def watermarks(conn, tickers):
+    """Return {ticker: newest bar time} in one round trip of per-ticker index lookups."""
+    lookups = [select(func.max(Stock.time)).where(Stock.ticker == ticker).scalar_subquery() for ticker in tickers]
+    return dict(zip(tickers, conn.execute(select(*lookups)).one()))
+
+
+def load_bars(tickers, start, end, fields=DEFAULT_FIELDS, source=None, use_cache=True):
+    """Load bars for ``tickers`` with ``start <= time < end`` as NumPy arrays.
+
+    ``start``/``end`` are Unix timestamps or aware datetimes. Returns
+    ``{ticker: {"time": int64 array, field: float64 array, ...}}`` sorted by
+    time; a ticker without bars gets empty arrays. Tickers missing from the
+    cache are read together in a single query. Returned arrays are shared
+    with the cache and read-only.
+    """
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    fields = tuple(fields)
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    start, end = to_timestamp(start), to_timestamp(end)
+    tickers = list(dict.fromkeys(tickers))
+
+    result = {}
+    with engine.connect() as conn:
+        marks = watermarks(conn, tickers) if use_cache else {}
+        missing = []
+        for ticker in tickers:
+            arrays = cache.get((ticker, start, end, fields, source), marks[ticker]) if use_cache else None
+            if arrays is None:
+                missing.append(ticker)
+            else:
+                result[ticker] = arrays
+
+        if missing:
+            fetched = fetch_bars(conn, missing, start, end, fields, source)
+            for ticker in missing:
+                result[ticker] = fetched[ticker]
+                if use_cache:
+                    cache.put((ticker, start, end, fields, source), marks[ticker], fetched[ticker])
+
+    return {ticker: result[ticker] for ticker in tickers}
+
+
+def fetch_bars(conn, tickers, start, end, fields, source=None):
+    """Read the bars for ``tickers`` in one query and split them into per-ticker column arrays.
+
+    yfinance days moved to ``snapshot_days`` by compaction.py are merged in.
+    """
+    columns = [Stock.__table__.c[field] for field in fields]
+    query = (select(Stock.ticker, Stock.time, *columns)
+             .where(Stock.ticker.in_(tickers), Stock.time >= start, Stock.time < end)
+             .order_by(Stock.ticker, Stock.time))
+    if source is not None:
+        query = query.where(Stock.source == source)
+    rows = conn.execute(query).all()
+    if source in (None, "yfinance"):
+        compacted = [(row["ticker"], row["time"], *(row[field] for field in fields))
+                     for row in compacted_rows(conn, tickers, start, end)]
+        if compacted:
+            rows = sorted(rows + compacted, key=lambda row: (row[0], row[1]))
+    return split_columns(rows, tickers, fields)
+
+
+def split_columns(rows, tickers, fields):
+    """Turn (ticker, time, *fields) rows ordered by ticker into per-ticker read-only column arrays."""
+    names = ("time", *fields)
+    if rows:
+        ticker_column, *values = zip(*rows)
+        data = [np.array(values[0], dtype=np.int64)]
+        data += [np.array(column, dtype=np.float64) for column in values[1:]]  # NULL -> nan
+        ticker_column = np.array(ticker_column, dtype=object)
+    else:
+        ticker_column = np.array([], dtype=object)
+        data = [np.array([], dtype=np.int64)] + [np.array([], dtype=np.float64) for _ in fields]
+
+    # Rows are ordered by ticker, so each ticker is one contiguous run
+    bounds = {}
+    if rows:
+        starts = np.concatenate(([0], np.flatnonzero(ticker_column[1:] != ticker_column[:-1]) + 1))
+        stops = np.append(starts[1:], len(rows))
+        bounds = {ticker_column[lo]: (lo, hi) for lo, hi in zip(starts, stops)}
+
+    bars = {}
+    for ticker in tickers:
+        lo, hi = bounds.get(ticker, (0, 0))
+        arrays = {}
+        for name, column in zip(names, data):
+            # Copy so an evicted ticker doesn't keep the whole multi-ticker column alive
+            array = column[lo:hi].copy()
+            array.flags.writeable = False
+            arrays[name] = array
+        bars[ticker] = arrays
+    return bars
+
+
+def load_rollups(tickers, start, end, resolution="1d", source="polygon"):
+    """Load 5m/1h/1d rollup bars with buckets in [start, end) as NumPy arrays.
+
+    Returns ``{ticker: {"time": bucket start int64 array, field: float64 array}}``
+    for ROLLUP_FIELDS, like ``load_bars`` but without caching; a year of daily
+    bars is about 250 rows.
+    """
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    tickers = list(dict.fromkeys(tickers))
+    columns = [StockRollup.__table__.c[field] for field in ROLLUP_FIELDS]
+    query = (select(StockRollup.ticker, StockRollup.bucket, *columns)
+             .where(StockRollup.ticker.in_(tickers), StockRollup.resolution == resolution,
+                    StockRollup.source == source,
+                    StockRollup.bucket >= to_timestamp(start), StockRollup.bucket < to_timestamp(end))
+             .order_by(StockRollup.ticker, StockRollup.bucket))
+    with engine.connect() as conn:
+        rows = conn.execute(query).all()
+    return split_columns(rows, tickers, ROLLUP_FIELDS)
+
+
+def load_frame(tickers, start, end, fields=DEFAULT_FIELDS, source=None, use_cache=True):
+    """Like ``load_bars`` but returns one pandas DataFrame with ``ticker`` and ``time`` columns."""
+    import pandas as pd
+
+    bars = load_bars(tickers, start, end, fields, source, use_cache)
+    frames = [pd.DataFrame({"ticker": ticker, **arrays}) for ticker, arrays in bars.items()]
+    if not frames:
+        return pd.DataFrame(columns=["ticker", "time", *fields])
+    frame = pd.concat(frames, ignore_index=True)
+    frame["time"] = pd.to_datetime(frame["time"], unit="s", utc=True)
+    return frame
@@ -0,0 +1,68 @@
+import random
+import threading
+import time
+
+from loguru import logger
+from polygon.exceptions import BadResponse
+from urllib3.exceptions import MaxRetryError
+
+from metrics import count
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``rate`` acquisitions per ``period`` seconds.
+
+    The bucket starts full, so up to ``capacity`` (default ``rate``) calls can
+    burst before callers are throttled to the steady rate.
+    """
+
+    def __init__(self, rate, period=60.0, capacity=None):
+        self.rate = rate / period  # tokens per second
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_rate_limited(exc):
+    """Return True if ``exc`` is a Polygon HTTP 429 (too many requests) error."""
+    message = str(exc)
+    if isinstance(exc, BadResponse):
+        return "exceeded the maximum requests" in message or "429" in message
+    if isinstance(exc, MaxRetryError):
+        return "429" in message
+    return False
+
+
+def is_transient(exc):
+    """Return True if ``exc`` is worth retrying: rate limiting or a 5xx/connection failure."""
+    return is_rate_limited(exc) or isinstance(exc, MaxRetryError)
+
+
+def call_with_backoff(fn, max_retries=5, base_delay=2.0, max_delay=60.0, description="request"):
+    """Call ``fn()``, retrying transient failures with jittered exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries or not is_transient(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            reason = "Rate limited" if is_rate_limited(e) else f"{type(e).__name__}"
+            count("retries", reason="rate_limited" if is_rate_limited(e) else type(e).__name__)
+            logger.warning(f"{reason} on {description}, retrying in {delay:.1f}s "
+                           f"(attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
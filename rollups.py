@@ -0,0 +1,239 @@
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import click
+from loguru import logger
+from sqlalchemy import delete, func, insert, or_, select
+
+from compaction import compacted_rows
+from database import SnapshotDay, Stock, StockRollup, engine
+from settings import ROLLUP_REBUILD_DAYS
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+# Each resolution is aggregated from the one before it, starting from stocks rows
+RESOLUTIONS = ("5m", "1h", "1d")
+BUCKET_SECONDS = {"5m": 5 * 60, "1h": 60 * 60}
+SOURCES = ("polygon", "yfinance")
+
+
+def bucket_start(timestamp, resolution):
+    """Start of the bucket holding ``timestamp``; daily buckets start at ET midnight."""
+    if resolution == "1d":
+        day = datetime.fromtimestamp(timestamp, MARKET_TZ).date()
+        return int(datetime.combine(day, datetime.min.time(), MARKET_TZ).timestamp())
+    return timestamp - timestamp % BUCKET_SECONDS[resolution]
+
+
+def bucket_end(bucket, resolution):
+    if resolution == "1d":
+        day = datetime.fromtimestamp(bucket, MARKET_TZ).date() + timedelta(days=1)
+        return int(datetime.combine(day, datetime.min.time(), MARKET_TZ).timestamp())
+    return bucket + BUCKET_SECONDS[resolution]
+
+
+def aggregate(bars):
+    """Combine time-ordered (time, open, high, low, close, volume, vwap, count) tuples into one bucket."""
+    opens = [bar[1] for bar in bars if bar[1] is not None]
+    closes = [bar[4] for bar in bars if bar[4] is not None]
+    volume = sum(bar[5] or 0 for bar in bars)
+    weighted = [(bar[6], bar[5]) for bar in bars if bar[6] is not None and bar[5]]
+    if weighted:
+        vwap = sum(price * size for price, size in weighted) / sum(size for _, size in weighted)
+    else:
+        prices = [bar[6] for bar in bars if bar[6] is not None]
+        vwap = sum(prices) / len(prices) if prices else None
+    return {
+        "open": opens[0] if opens else None,
+        "high": max(bar[2] for bar in bars),
+        "low": min(bar[3] for bar in bars),
+        "close": closes[-1] if closes else None,
+        "volume": volume,
+        "vwap": vwap,
+        "bars": sum(bar[7] for bar in bars),
+    }
+
+
+def stock_bars(conn, ticker, source, start, end):
+    """``stocks`` rows in [start, end) as aggregate input tuples.
+
+    yfinance snapshot rows carry the day's running high and low, which would
+    give every 5m/1h bucket the day's range so far. Their bars use the prices
+    actually sampled in that minute instead (open, ``sale`` and close), so
+    yfinance rollup ranges span the once-a-minute samples and can be narrower
+    than the true range.
+    """
+    if source == "yfinance":
+        query = (select(Stock.time, Stock.open, Stock.sale, Stock.close, Stock.volume, Stock.vwap, Stock.avg)
+                 .where(Stock.ticker == ticker, Stock.source == source, Stock.time >= start, Stock.time < end)
+                 .order_by(Stock.time))
+        bars = [snapshot_bar(*row) for row in conn.execute(query)]
+        # Closed days compacted into snapshot_days are no longer in stocks
+        compacted = [snapshot_bar(row["time"], row["open"], row["sale"], row["close"], row["volume"],
+                                  row["vwap"], row["avg"])
+                     for row in compacted_rows(conn, [ticker], start, end)]
+        if compacted:
+            bars = sorted(bars + compacted, key=lambda bar: bar[0])
+        return bars
+
+    query = (select(Stock.time, func.coalesce(Stock.open, Stock.sale), Stock.high, Stock.low,
+                    func.coalesce(Stock.close, Stock.sale), Stock.volume, func.coalesce(Stock.vwap, Stock.avg))
+             .where(Stock.ticker == ticker, Stock.time >= start, Stock.time < end)
+             .order_by(Stock.time))
+    if source == "polygon":
+        # Rows written before the source column existed are Polygon bars
+        query = query.where(or_(Stock.source == source, Stock.source.is_(None)))
+    else:
+        query = query.where(Stock.source == source)
+    return [(*row, 1) for row in conn.execute(query)]
+
+
+def snapshot_bar(timestamp, open_, sale, close, volume, vwap, avg):
+    """Aggregate input tuple for a yfinance snapshot row, with high/low from its sampled prices."""
+    prices = [price for price in (open_, sale, close) if price is not None]
+    return (timestamp, coalesce(open_, sale), max(prices, default=None), min(prices, default=None),
+            coalesce(close, sale), volume, coalesce(vwap, avg), 1)
+
+
+def coalesce(value, fallback):
+    return fallback if value is None else value
+
+
+def rollup_bars(conn, ticker, source, resolution, start, end):
+    """Stored rollups in [start, end) as aggregate input tuples."""
+    query = (select(StockRollup.bucket, StockRollup.open, StockRollup.high, StockRollup.low, StockRollup.close,
+                    StockRollup.volume, StockRollup.vwap, StockRollup.bars)
+             .where(StockRollup.ticker == ticker, StockRollup.source == source,
+                    StockRollup.resolution == resolution,
+                    StockRollup.bucket >= start, StockRollup.bucket < end)
+             .order_by(StockRollup.bucket))
+    return [tuple(row) for row in conn.execute(query)]
+
+
+def refresh_range(conn, ticker, source, start, end):
+    """Recompute every 5m, 1h and 1d bucket of ``ticker``/``source`` overlapping [start, end).
+
+    Buckets are rebuilt bottom-up: 5m from ``stocks`` rows, 1h from the 5m
+    rollups and 1d from the 1h rollups, so each level reads at most a few
+    dozen rows per bucket. Buckets left without rows are deleted.
+    """
+    table = StockRollup.__table__
+    previous = None
+    for resolution in RESOLUTIONS:
+        start = bucket_start(start, resolution)
+        end = bucket_end(bucket_start(end - 1, resolution), resolution)
+        if previous is None:
+            bars = stock_bars(conn, ticker, source, start, end)
+        else:
+            bars = rollup_bars(conn, ticker, source, previous, start, end)
+
+        buckets = defaultdict(list)
+        for bar in bars:
+            buckets[bucket_start(bar[0], resolution)].append(bar)
+
+        conn.execute(delete(table).where(
+            table.c.ticker == ticker, table.c.source == source, table.c.resolution == resolution,
+            table.c.bucket >= start, table.c.bucket < end,
+        ))
+        if buckets:
+            conn.execute(insert(table), [
+                {"ticker": ticker, "resolution": resolution, "source": source, "bucket": bucket, **aggregate(group)}
+                for bucket, group in buckets.items()
+            ])
+        previous = resolution
+
+
+def update_rollups(conn, rows):
+    """Refresh the buckets touched by freshly written ``stocks`` rows, in the writer's transaction."""
+    spans = {}
+    for row in rows:
+        key = (row["ticker"], row.get("source") or "polygon")
+        low, high = spans.get(key, (row["time"], row["time"]))
+        spans[key] = (min(low, row["time"]), max(high, row["time"]))
+    for (ticker, source), (low, high) in spans.items():
+        refresh_range(conn, ticker, source, low, high + 1)
+
+
+def day_start(day):
+    return int(datetime.combine(day, datetime.min.time(), MARKET_TZ).timestamp())
+
+
+def bar_range(conn, ticker):
+    """(oldest, newest) bar time of ``ticker`` in stocks and compacted snapshot days, or (None, None)."""
+    stored = conn.execute(select(func.min(Stock.time), func.max(Stock.time)).where(Stock.ticker == ticker)).first()
+    compacted = conn.execute(select(func.min(SnapshotDay.first_time), func.max(SnapshotDay.last_time))
+                             .where(SnapshotDay.ticker == ticker)).first()
+    oldest = [time for time in (stored[0], compacted[0]) if time is not None]
+    newest = [time for time in (stored[1], compacted[1]) if time is not None]
+    return min(oldest, default=None), max(newest, default=None)
+
+
+def next_bar_time(conn, ticker, after):
+    """Time of ``ticker``'s first bar at or after ``after`` in stocks or compacted snapshot days, or None."""
+    stored = conn.execute(select(func.min(Stock.time)).where(Stock.ticker == ticker, Stock.time >= after)).scalar()
+    compacted = conn.execute(select(func.min(SnapshotDay.first_time))
+                             .where(SnapshotDay.ticker == ticker, SnapshotDay.last_time >= after)).scalar()
+    # A compacted day that started before ``after`` still has bars from ``after`` on
+    return min((max(time, after) for time in (stored, compacted) if time is not None), default=None)
+
+
+@click.command()
+@click.argument("tickers", nargs=-1)
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]),
+              help="First ET date to rebuild (default: oldest stored bar)")
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]),
+              help="Last ET date to rebuild, inclusive (default: newest stored bar)")
+@click.option("--chunk-days", default=ROLLUP_REBUILD_DAYS,
+              help=f"Days rebuilt per transaction (default: {ROLLUP_REBUILD_DAYS})")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+def main(tickers, start, end, chunk_days, debug):
+    """Rebuild 5m/1h/1d rollups from scratch for TICKERS (default: all) over a date range."""
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    with engine.connect() as conn:
+        if not tickers:
+            # Tickers whose days are all compacted have no stocks rows left
+            tickers = sorted(set(conn.execute(select(Stock.ticker).distinct()).scalars())
+                             | set(conn.execute(select(SnapshotDay.ticker).distinct()).scalars()))
+    logger.info(f"Rebuilding rollups for {len(tickers)} ticker(s)"
+                + (f" from {start.date()}" if start else "") + (f" to {end.date()}" if end else ""))
+
+    started = time.perf_counter()
+    for ticker in tickers:
+        with engine.connect() as conn:
+            oldest, newest = bar_range(conn, ticker)
+        if oldest is None:
+            logger.warning(f"No stored bars for {ticker}")
+            continue
+        first = start.date() if start else datetime.fromtimestamp(oldest, MARKET_TZ).date()
+        last = end.date() if end else datetime.fromtimestamp(newest, MARKET_TZ).date()
+        stop = last + timedelta(days=1)
+
+        day = first
+        while day < stop:
+            # Jump over days without bars; the chunk still covers the gap so stale rollups there are deleted
+            with engine.connect() as conn:
+                next_bar = next_bar_time(conn, ticker, day_start(day))
+            data_day = datetime.fromtimestamp(next_bar, MARKET_TZ).date() if next_bar is not None else stop
+            chunk_end = min(max(data_day, day) + timedelta(days=chunk_days), stop)
+            with engine.begin() as conn:
+                for source in SOURCES:
+                    refresh_range(conn, ticker, source, day_start(day), day_start(chunk_end))
+            logger.debug(f"{ticker}: rebuilt {day} to {chunk_end - timedelta(days=1)}")
+            day = chunk_end
+        logger.info(f"Rebuilt rollups for {ticker} from {first} to {last}")
+
+    logger.success(f"Rebuilt rollups for {len(tickers)} ticker(s) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,22 @@ load_dotenv()
 
 # Database settings
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///stocks.db")
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_PRE_PING = True
+DB_POOL_RECYCLE = 1800  # Seconds; below typical cloud proxy idle timeouts
+PARTITION_MONTHS_AHEAD = 3  # PostgreSQL monthly stocks partitions created ahead of time
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sql")  # sql, or tickstore for the mmap column store
+TICK_STORE_DIR = os.getenv("TICK_STORE_DIR", "tickstore")
+TICK_INDEX_STRIDE = 4096  # Bars per time index entry
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # KiB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # Milliseconds; lets the daemon and a backfill share the file
+}
 
 # API settings
 POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
@@ -19,4 +35,60 @@ LOG_FORMAT_DEBUG = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
 LOG_FORMAT_INFO = "{time:HH:mm:ss} | {level} | {message}"
 
 # Batch settings
-BATCH_COMMIT_SIZE = 1000
\ No newline at end of file
+BATCH_COMMIT_SIZE = 1000
+
+# Export settings
+EXPORT_PAGE_SIZE = 50000  # Rows read per keyset page
+EXPORT_SHARDS = 16
+EXPORT_WORKERS = 4
+
+# Query settings
+QUERY_CACHE_BYTES = 256 * 1024 * 1024  # Bar arrays kept by query.load_bars' LRU cache
+
+# Write-ahead spool settings (yfinance_fetcher.py --spool, spool.py)
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_SEGMENT_BYTES = 64 * 1024 * 1024  # Seal a segment once it reaches this size...
+SPOOL_SEAL_SECONDS = 5  # ...or this age, so drains pick rows up quickly
+SPOOL_FSYNC_SECONDS = 0  # Minimum seconds between fsyncs; 0 fsyncs every append
+SPOOL_DRAIN_SECONDS = 1  # Pause between drain passes
+SPOOL_MAX_BACKOFF_SECONDS = 60  # Longest wait between retries while the database is unreachable
+
+# Metrics settings (Prometheus textfile path and /metrics port; both off when unset)
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Rollup settings
+ROLLUP_REBUILD_DAYS = 7  # Days rebuilt per transaction by rollups.py
+
+# Indicator settings (names are <kind>_<window>: sma, ema, volatility, return; plus session vwap)
+INDICATORS = ("return_1", "sma_20", "sma_50", "ema_12", "ema_26", "volatility_20", "vwap")
+INDICATOR_CHUNK_DAYS = 30  # Days of bars read and written per transaction
+
+# Compaction settings (yfinance snapshot rows of closed days -> snapshot_days)
+COMPACT_KEEP_DAYS = 1  # Most recent ET days left as plain stocks rows; 1 compacts everything before today
+COMPACT_PRICE_DECIMALS = 4  # Prices with at most this many decimals are delta-encoded as integers
+
+# Backfill settings
+POLYGON_REQUESTS_PER_MINUTE = 5  # Free tier; raise to match your Polygon plan
+BACKFILL_WORKERS = 4
+BACKFILL_SHARD_DAYS = 7  # Small enough that a minute-bar shard fits in one list_aggs page
+BACKFILL_MAX_RETRIES = 5
+BACKFILL_QUEUE_BATCHES = 8  # Fetched batches buffered ahead of the DB writer
+AGGS_CACHE_DIR = os.getenv("AGGS_CACHE_DIR", "aggs_cache")  # Compressed list_aggs responses of closed windows
+
+# Monitor daemon settings
+MONITOR_INTERVAL_SECONDS = 60
+MONITOR_OFFSET_SECONDS = 5
+
+# Real-time fetch settings
+FETCH_WORKERS = 8
+FETCH_TIMEOUT_SECONDS = 20
+INTRADAY_VOLUME_WINDOW = 5  # Minutes searched back for the latest non-zero volume
+
+# Fundamentals cache settings (Ticker.info fields, TTL in seconds)
+FUNDAMENTALS_CACHE_FILE = os.getenv("FUNDAMENTALS_CACHE_FILE", "fundamentals_cache.json")
+FUNDAMENTALS_TTL_SECONDS = {
+    "previousClose": 24 * 60 * 60,  # Also expires at the ET date change
+    "marketCap": 15 * 60,
+    "trailingPE": 60 * 60,
+}
@@ -39,10 +39,11 @@ chmod +x "$MONITOR_SCRIPT"
 
 log_message "Starting market check..."
 
-# Check if we should start monitoring
-if $PYTHON_VENV "$MARKET_CHECK" should_start; then
-    # Get the market status for logging
-    MARKET_STATUS=$($PYTHON_VENV "$MARKET_CHECK" should_start 2>&1)
+# Check if we should start monitoring (one run gives both the decision and the reason to log)
+MARKET_STATUS=$($PYTHON_VENV "$MARKET_CHECK" should_start 2>&1)
+MARKET_CHECK_EXIT=$?
+
+if [ "$MARKET_CHECK_EXIT" -eq 0 ]; then
     log_message "Market check passed: $MARKET_STATUS"
     
     # Check if monitor is already running
@@ -89,8 +90,6 @@ if $PYTHON_VENV "$MARKET_CHECK" should_start; then
     fi
     
 else
-    # Get the reason why we shouldn't start
-    MARKET_STATUS=$($PYTHON_VENV "$MARKET_CHECK" should_start 2>&1)
     log_message "Market check failed, not starting: $MARKET_STATUS"
     exit 1
 fi
\ No newline at end of file
@@ -0,0 +1,340 @@
+import fcntl
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+
+import click
+from loguru import logger
+
+from metrics import count, stage
+from settings import (
+    SPOOL_DIR,
+    SPOOL_DRAIN_SECONDS,
+    SPOOL_FSYNC_SECONDS,
+    SPOOL_MAX_BACKOFF_SECONDS,
+    SPOOL_SEAL_SECONDS,
+    SPOOL_SEGMENT_BYTES,
+)
+
+LOCK_FILE = "LOCK"
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".log"
+SEGMENT_PATTERN = re.compile(r"^segment-(\d{12})\.(open|log)$")
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_record(row):
+    """One spool line: CRC32 of the JSON payload in hex, a space, the payload and a newline."""
+    payload = json.dumps(row, separators=(",", ":")).encode()
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def read_segment(path):
+    """Return (rows, damaged line count) for a spool segment.
+
+    A line whose checksum doesn't match, or a final line without its newline
+    (a write torn by a crash), is skipped.
+    """
+    rows = []
+    damaged = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                damaged += 1
+                continue
+            checksum, _, payload = line[:-1].partition(b" ")
+            try:
+                if int(checksum, 16) != zlib.crc32(payload):
+                    raise ValueError("checksum mismatch")
+                rows.append(json.loads(payload))
+            except ValueError:
+                damaged += 1
+    return rows, damaged
+
+
+class Spool:
+    """Durable local queue of ``stocks`` rows: a directory of append-only segment files.
+
+    The writing process appends to ``segment-N.open`` and fsyncs once per
+    ``append`` call (or at most every ``fsync_seconds``), then renames the
+    segment to ``segment-N.log`` once it is ``segment_bytes`` large or
+    ``seal_seconds`` old. Drainers only read sealed segments and delete a
+    segment after its rows are committed; a segment that is replayed after a
+    crash is harmless because ``stocks`` ignores duplicate (ticker, time) rows.
+
+    Only one process may write to a spool directory at a time; ``LOCK`` is
+    held with ``flock`` while a writer is open.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 seal_seconds=SPOOL_SEAL_SECONDS, fsync_seconds=SPOOL_FSYNC_SECONDS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.seal_seconds = seal_seconds
+        self.fsync_seconds = fsync_seconds
+        self.lock = threading.Lock()
+        self.lock_file = None
+        self.active = None
+        self.active_path = None
+        self.active_created = None
+        self.last_fsync = 0.0
+        self.sequence = None
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        """Return [(sequence, state, path)] for every segment, oldest first."""
+        found = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                found.append((int(match.group(1)), match.group(2), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def sealed_segments(self):
+        return [path for _, state, path in self.segments() if state == "log"]
+
+    def try_lock(self, timeout=0.0):
+        """Take the writer lock, waiting up to ``timeout`` seconds; returns False if another process holds it."""
+        if self.lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), "a")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    return False
+                time.sleep(0.05)
+        self.lock_file = lock_file
+        # Segments left open by a writer that died are complete up to their last fsync
+        for _, state, path in self.segments():
+            if state == "open":
+                self.seal_path(path)
+                logger.info(f"Sealed {os.path.basename(path)} left open by a previous writer")
+        return True
+
+    def seal_path(self, path):
+        os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        fsync_dir(self.directory)
+
+    def open_segment(self):
+        if self.sequence is None:
+            existing = self.segments()
+            self.sequence = existing[-1][0] + 1 if existing else 1
+        self.active_path = os.path.join(self.directory, f"segment-{self.sequence:012d}{OPEN_SUFFIX}")
+        self.sequence += 1
+        self.active = open(self.active_path, "ab")
+        self.active_created = time.monotonic()
+        fsync_dir(self.directory)
+
+    def append(self, rows):
+        """Append ``rows`` durably; returns once they are fsynced (subject to ``fsync_seconds``)."""
+        if not rows:
+            return
+        # A standalone drainer holds the lock for a moment while it seals orphaned segments
+        if not self.try_lock(timeout=5.0):
+            raise RuntimeError(f"Another process is writing to the spool in {self.directory}")
+        data = b"".join(encode_record(row) for row in rows)
+        with self.lock:
+            if self.active is None:
+                self.open_segment()
+            self.active.write(data)
+            self.active.flush()
+            now = time.monotonic()
+            if now - self.last_fsync >= self.fsync_seconds:
+                os.fsync(self.active.fileno())
+                self.last_fsync = now
+            if self.active.tell() >= self.segment_bytes or now - self.active_created >= self.seal_seconds:
+                self.seal_active()
+
+    def seal_active(self):
+        """Fsync, close and seal the open segment so drainers can pick it up (caller holds ``lock``)."""
+        if self.active is None:
+            return
+        os.fsync(self.active.fileno())
+        self.active.close()
+        self.seal_path(self.active_path)
+        self.active = None
+        self.active_path = None
+
+    def seal_stale(self, max_age=None):
+        """Seal the open segment if it is older than ``max_age`` (default ``seal_seconds``)."""
+        max_age = self.seal_seconds if max_age is None else max_age
+        with self.lock:
+            if self.active is not None and time.monotonic() - self.active_created >= max_age:
+                self.seal_active()
+
+    def release(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def close(self):
+        with self.lock:
+            self.seal_active()
+        self.release()
+
+    def drain(self, writer, limit=None):
+        """Load sealed segments, oldest first, through ``writer``; returns the number of rows loaded.
+
+        Each segment is deleted only after the writer has committed all of its
+        rows. On an error the segment stays on disk for the next call.
+        """
+        loaded = 0
+        for path in self.sealed_segments()[:limit]:
+            try:
+                rows, damaged = read_segment(path)
+            except FileNotFoundError:
+                continue  # Loaded by another drainer meanwhile
+
+            if damaged:
+                logger.warning(f"Skipped {damaged} damaged line(s) in {os.path.basename(path)}")
+                count("errors", damaged, stage="spool_read")
+            with stage("drain"):
+                try:
+                    for row in rows:
+                        writer.add(row)
+                    writer.flush()
+                except Exception:
+                    writer.discard()
+                    raise
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            loaded += len(rows)
+            count("rows", len(rows), stage="drain")
+            logger.debug(f"Drained {len(rows)} row(s) from {os.path.basename(path)}")
+        if loaded:
+            fsync_dir(self.directory)
+        return loaded
+
+    def backlog(self):
+        """Return (segments, bytes) waiting to be drained, including the open segment."""
+        sizes = [os.path.getsize(path) for _, _, path in self.segments()]
+        return len(sizes), sum(sizes)
+
+
+def drain_loop(spool, writer, stop, interval=SPOOL_DRAIN_SECONDS, max_backoff=SPOOL_MAX_BACKOFF_SECONDS):
+    """Drain ``spool`` through ``writer`` until ``stop`` (a ``threading.Event``) is set.
+
+    Failed loads (the database is down, a lock timed out, ...) are retried
+    with exponential backoff up to ``max_backoff`` seconds; rows stay in the
+    spool meanwhile. When this process is the spool's writer, the open segment
+    is sealed once it is ``seal_seconds`` old so rows don't wait for the next
+    append to be loaded; otherwise segments orphaned by a writer that died
+    are sealed whenever no writer is running.
+    """
+    failures = 0
+    while True:
+        if spool.lock_file is not None:
+            spool.seal_stale()
+        elif spool.try_lock():
+            spool.release()
+        try:
+            spool.drain(writer)
+            if failures:
+                logger.info(f"Spool drain recovered after {failures} failed attempt(s)")
+            failures = 0
+            delay = interval
+        except Exception as e:
+            failures += 1
+            delay = min(max_backoff, interval * 2 ** failures)
+            segments, size = spool.backlog()
+            logger.warning(f"Spool drain failed ({type(e).__name__}: {e}); {segments} segment(s), "
+                           f"{size / 1e6:.1f} MB waiting, retrying in {delay:.1f}s")
+            count("errors", stage="drain")
+        if stop.wait(delay):
+            return
+
+
+class DrainThread(threading.Thread):
+    """Background ``drain_loop`` for a process that also writes to the spool."""
+
+    def __init__(self, spool, writer, interval=SPOOL_DRAIN_SECONDS):
+        super().__init__(name="spool-drain", daemon=True)
+        self.spool = spool
+        self.writer = writer
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        drain_loop(self.spool, self.writer, self.stop_event, self.interval)
+
+    def stop(self, timeout=30.0):
+        """Stop after one last drain attempt of everything already appended."""
+        self.stop_event.set()
+        self.join(timeout)
+        drain_remaining(self.spool, self.writer)
+
+
+def drain_remaining(spool, writer):
+    """Seal the open segment and try once to load everything spooled so far."""
+    spool.seal_stale(max_age=0)
+    try:
+        spool.drain(writer)
+    except Exception as e:
+        segments, size = spool.backlog()
+        logger.warning(f"Left {segments} segment(s), {size / 1e6:.1f} MB in {spool.directory} "
+                       f"({type(e).__name__}: {e}); load them with: python spool.py")
+
+
+@click.command()
+@click.option("--spool-dir", default=SPOOL_DIR, help=f"Spool directory (default: {SPOOL_DIR})")
+@click.option("--follow", is_flag=True, help="Keep running and drain new segments as they are sealed")
+@click.option("--interval", default=SPOOL_DRAIN_SECONDS,
+              help=f"Seconds between drain passes with --follow (default: {SPOOL_DRAIN_SECONDS})")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+def main(spool_dir, follow, interval, debug):
+    """Load rows spooled by `yfinance_fetcher.py --spool` (or `--writer spool`) into stocks.
+
+    Without --follow, drains every sealed segment once and exits. Segments
+    left open by a writer that is no longer running are sealed first.
+    """
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+
+    from writers import get_writer
+
+    spool = Spool(spool_dir)
+    if spool.try_lock():
+        # No writer is running, so open segments are orphans; sealing them lets them drain
+        spool.release()
+    segments, size = spool.backlog()
+    logger.info(f"{segments} segment(s), {size / 1e6:.1f} MB in {spool_dir}")
+
+    writer = get_writer()
+    started = time.perf_counter()
+    if follow:
+        stop = threading.Event()
+        try:
+            drain_loop(spool, writer, stop, interval)
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+    else:
+        rows = spool.drain(writer)
+        logger.success(f"Loaded {rows:,} row(s) into stocks in {time.perf_counter() - started:.1f}s")
+    spool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# settings.py reads these at import time, so point the database and the local
+# stores at a scratch directory before any test module imports the pipeline
+SCRATCH = tempfile.mkdtemp(prefix="stonks-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{SCRATCH}/stocks.db"
+for variable in ("TICK_STORE_DIR", "SPOOL_DIR", "AGGS_CACHE_DIR"):
+    os.environ[variable] = os.path.join(SCRATCH, variable.lower())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
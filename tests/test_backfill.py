@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+from click.testing import CliRunner
+
+import backfill
+from fake_sources import FakePolygonClient
+
+
+def test_shards_planned_on_later_days_reuse_earlier_checkpoints():
+    first_day = date(2024, 6, 12)
+    first = backfill.plan_shards(["AAPL"], 90, 7, today=first_day)
+    # What record_checkpoints keeps from the first run: every shard that ended before its day
+    done = {"AAPL": [(shard.start, shard.end) for shard in first if shard.end < first_day]}
+
+    for later in range(1, 7):
+        second = backfill.plan_shards(["AAPL"], 90, 7, today=first_day + timedelta(days=later))
+        pending = [shard for shard in second if not backfill.is_completed(shard, done)]
+        # Only the cells holding the first run's last (unfinished) day and the days since are fetched again
+        assert pending and pending[0].start <= first_day <= pending[0].end
+        assert all(shard.start > first_day for shard in pending[1:])
+
+
+def test_shards_follow_a_fixed_grid():
+    shards = backfill.plan_shards(["AAPL"], 30, 7, today=date(2024, 6, 12))
+    assert shards[0].start == date(2024, 5, 13)
+    assert shards[-1].end == date(2024, 6, 12)
+    for shard in shards[1:]:
+        assert shard.start.weekday() == backfill.SHARD_EPOCH.weekday()
+    for shard in shards[:-1]:
+        assert (shard.end - backfill.SHARD_EPOCH).days % 7 == 6
+    assert all(later.start == earlier.end + timedelta(days=1) for earlier, later in zip(shards, shards[1:]))
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.tokens = 0
+
+    def acquire(self):
+        self.tokens += 1
+
+
+def test_every_page_of_a_response_takes_a_token():
+    client = FakePolygonClient()
+    limiter = CountingLimiter()
+    # About 70,000 regular-session minutes, so the client follows a second page
+    shard = backfill.Shard("AAPL", date(2024, 1, 2), date(2024, 9, 30), "2024-01-02", "2024-09-30")
+    count = backfill.fetch_shard(client, limiter, shard, "minute", 1, 10000, 0, lambda item: None)
+    assert count > backfill.PAGE_LIMIT
+    assert client.requests == limiter.tokens == 2
+
+
+def test_shards_longer_than_a_page_are_refused():
+    result = CliRunner().invoke(backfill.main, ["AAPL", "--shard-days", "60"])
+    assert result.exit_code == 2
+    assert "--shard-days 60" in result.output
@@ -0,0 +1,51 @@
+from datetime import date
+
+from click.testing import CliRunner
+from sqlalchemy import select
+
+import compaction
+import export_data
+import rollups
+from database import StockRollup, engine
+from writers import insert_ignore_statement
+
+DAY = date(2024, 3, 5)
+
+
+def test_export_refuses_while_days_are_compacted(tmp_path):
+    start, _ = compaction.day_bounds(DAY)
+    rows = [{"ticker": "CMPT", "time": start + 14 * 3600 + 60 * i, "high": 101.0, "low": 99.0, "avg": 100.0,
+             "sale": 100.0 + i, "open": 100.0, "close": 100.0 + i, "volume": 1000 + i, "vwap": None,
+             "transactions": None, "source": "yfinance", "meta": None} for i in range(3)]
+    with engine.begin() as conn:
+        conn.execute(insert_ignore_statement(conn), rows)
+    assert compaction.compact_day("CMPT", DAY)[0] == 3
+
+    output = tmp_path / "dump.sql"
+    result = CliRunner().invoke(export_data.main, ["-o", str(output)])
+    assert result.exit_code == 1
+    assert "compaction.py --expand" in result.output
+    assert not output.exists()
+
+    assert compaction.expand_day("CMPT", DAY) == 3
+    result = CliRunner().invoke(export_data.main, ["-o", str(output)])
+    assert result.exit_code == 0, result.output
+    assert "CMPT" in output.read_text()
+
+
+def test_rollup_rebuild_covers_fully_compacted_tickers():
+    start, _ = compaction.day_bounds(DAY)
+    rows = [{"ticker": "RLUP", "time": start + 15 * 3600 + 60 * i, "high": 101.0, "low": 99.0, "avg": 100.0,
+             "sale": 100.0 + i, "open": 100.0, "close": 100.0 + i, "volume": 10, "vwap": None,
+             "transactions": None, "source": "yfinance", "meta": None} for i in range(3)]
+    with engine.begin() as conn:
+        conn.execute(insert_ignore_statement(conn), rows)
+    assert compaction.compact_day("RLUP", DAY)[0] == 3
+
+    result = CliRunner().invoke(rollups.main, ["RLUP"])
+    assert result.exit_code == 0, result.output
+    with engine.connect() as conn:
+        daily = conn.execute(select(StockRollup).where(StockRollup.ticker == "RLUP",
+                                                       StockRollup.resolution == "1d")).one()
+    assert (daily.open, daily.close, daily.volume) == (100.0, 102.0, 30)
+    compaction.expand_day("RLUP", DAY)
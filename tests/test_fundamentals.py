@@ -0,0 +1,33 @@
+import threading
+import time
+
+from fundamentals import FundamentalsCache
+
+
+class SlowTicker:
+    def __init__(self, release):
+        self.release = release
+        self.calls = 0
+
+    @property
+    def info(self):
+        self.calls += 1
+        self.release.wait(5)
+        return {"previousClose": 100.0, "marketCap": 10 ** 12}
+
+
+def test_slow_info_fetch_is_abandoned_and_fills_the_cache_later():
+    cache = FundamentalsCache(path=None, ttls={"previousClose": 3600, "marketCap": 3600})
+    release = threading.Event()
+    ticker = SlowTicker(release)
+
+    started = time.monotonic()
+    assert cache.get("SLOW", ticker, timeout=0.1) == {"previousClose": None, "marketCap": None}
+    assert time.monotonic() - started < 1
+    # Still running: a second lookup waits on the same fetch instead of starting another
+    assert cache.get("SLOW", ticker, timeout=0.1) == {"previousClose": None, "marketCap": None}
+
+    release.set()
+    assert cache.get("SLOW", ticker, timeout=5) == {"previousClose": 100.0, "marketCap": 10 ** 12}
+    assert ticker.calls == 1
+    assert cache.get("SLOW", ticker) == {"previousClose": 100.0, "marketCap": 10 ** 12}
@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+
+import indicators
+
+
+def recursive_ema(values, alpha):
+    out, previous = [], values[0]
+    for value in values:
+        previous = alpha * value + (1 - alpha) * previous
+        out.append(previous)
+    return np.array(out)
+
+
+def bars(closes):
+    n = len(closes)
+    times = 1_700_000_000 + 60 * np.arange(n, dtype=np.int64)
+    return {"time": times, "high": closes + 0.5, "low": closes - 0.5, "close": closes,
+            "volume": np.full(n, 100.0), "vwap": np.full(n, np.nan)}
+
+
+def closes(n):
+    return 100 * np.exp(np.cumsum(np.random.default_rng(7).normal(0, 0.001, n)))
+
+
+def test_ema_1_is_the_closes_and_keeps_state_json_safe():
+    values = closes(50)
+    result, state = indicators.compute(bars(values), ["ema_1"], {})
+    np.testing.assert_array_equal(result["ema_1"], values)
+    json.dumps(state, allow_nan=False)
+
+
+def test_ema_matches_the_recursion_across_blocks_and_chunks():
+    values = closes(5000)
+    for window in (2, 12, 26, 200):
+        alpha = 2.0 / (window + 1)
+        expected = recursive_ema(values, alpha)
+        # One call spans many unrolled blocks
+        np.testing.assert_allclose(indicators.ema(values, alpha), expected, rtol=1e-10)
+
+        # Incremental updates in uneven chunks continue from the saved state
+        name, state, parts = f"ema_{window}", {}, []
+        for lo, hi in ((0, 1), (1, 700), (700, 701), (701, 3333), (3333, 5000)):
+            chunk = bars(values[lo:hi])
+            chunk["time"] = chunk["time"] + 60 * lo
+            result, state = indicators.compute(chunk, [name], json.loads(json.dumps(state, allow_nan=False)))
+            parts.append(result[name])
+        np.testing.assert_allclose(np.concatenate(parts), expected, rtol=1e-10)
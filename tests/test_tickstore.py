@@ -0,0 +1,52 @@
+import multiprocessing
+
+from click.testing import CliRunner
+from sqlalchemy import select
+
+import tickstore
+import writers
+from database import Stock, engine
+
+
+def test_to_db_writes_stocks_when_tick_store_is_the_backend(tmp_path, monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "tickstore")
+    monkeypatch.setattr(writers, "STORAGE_BACKEND", "tickstore")
+    store = tickstore.TickStore(str(tmp_path))
+    store.append_rows([
+        {"ticker": "TSTK", "time": 1_700_000_000 + 60 * i, "open": 10.0 + i, "high": 11.0 + i, "low": 9.0 + i,
+         "close": 10.5 + i, "sale": 10.5 + i, "avg": 10.0 + i, "volume": 100.0, "vwap": None, "source": "polygon"}
+        for i in range(3)
+    ])
+
+    result = CliRunner().invoke(tickstore.main, ["--store", str(tmp_path), "to-db", "TSTK"])
+
+    assert result.exit_code == 0, result.output
+    with engine.connect() as conn:
+        rows = conn.execute(select(Stock.time, Stock.close, Stock.vwap).where(Stock.ticker == "TSTK")
+                            .order_by(Stock.time)).all()
+    assert [(row.time, row.close, row.vwap) for row in rows] == [
+        (1_700_000_000 + 60 * i, 10.5 + i, None) for i in range(3)
+    ]
+    assert store.series("TSTK").latest_time() == 1_700_000_120
+
+
+def append_minutes(path, first, count):
+    series = tickstore.TickSeries(path)
+    for i in range(first, first + count):
+        series.append({name: [1_700_000_000 + 60 * i] if name == "time" else [float(i)]
+                       for name in tickstore.COLUMNS})
+
+
+def test_appends_from_several_processes_all_survive(tmp_path):
+    path = str(tmp_path / "polygon" / "TSTK")
+    # Each process owns a block of minutes; appends behind another process's newest bar are merged
+    processes = [multiprocessing.get_context("fork").Process(target=append_minutes, args=(path, 40 * n, 40))
+                 for n in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    times = tickstore.TickSeries(path).read(0, 2 ** 62)["time"]
+    assert times.tolist() == [1_700_000_000 + 60 * i for i in range(160)]
@@ -0,0 +1,319 @@
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import click
+import numpy as np
+from loguru import logger
+from sqlalchemy import or_, select
+
+from compaction import require_expanded
+from database import Stock, engine
+from settings import BATCH_COMMIT_SIZE, TICK_INDEX_STRIDE, TICK_STORE_DIR
+
+# Fixed-width columns, one file each; missing values are stored as nan
+COLUMNS = {
+    "time": np.int64,
+    "high": np.float64,
+    "low": np.float64,
+    "avg": np.float64,
+    "sale": np.float64,
+    "open": np.float64,
+    "close": np.float64,
+    "volume": np.float64,
+    "vwap": np.float64,
+}
+SOURCES = ("polygon", "yfinance")
+STATE_FILE = "STATE"
+LOCK_FILE = "LOCK"
+INDEX_FILE = "time.idx"
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TickSeries:
+    """Append-only column files for one source/ticker, sorted by time and unique on it.
+
+    ``STATE`` holds the committed row count and the current generation
+    directory. Appends write past the committed length, fsync, then replace
+    ``STATE`` atomically, so a crash mid-append leaves only an uncommitted
+    tail that readers ignore and the next append truncates. Rows older than
+    the newest stored bar can't be appended in place; they are merged into a
+    new generation that replaces the old one the same way. Writers hold
+    ``LOCK`` with ``flock`` while appending, so appends from several processes
+    take turns instead of truncating each other's rows.
+
+    ``time.idx`` keeps every TICK_INDEX_STRIDE-th time, so a range lookup
+    binary-searches the small index and then one stride of the time column.
+    """
+
+    def __init__(self, path, stride=TICK_INDEX_STRIDE):
+        self.path = path
+        self.stride = stride
+        self.lock = threading.Lock()
+
+    def state(self):
+        try:
+            with open(os.path.join(self.path, STATE_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "rows": 0}
+
+    def save_state(self, state):
+        tmp_path = os.path.join(self.path, f"{STATE_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, STATE_FILE))
+        fsync_dir(self.path)
+
+    def generation_path(self, generation):
+        return os.path.join(self.path, f"gen-{generation:06d}")
+
+    def columns(self, state=None):
+        """Return ({column: read-only memmap}, time index) for the committed rows."""
+        state = state or self.state()
+        rows = state["rows"]
+        if rows == 0:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}, np.empty(0, np.int64)
+        directory = self.generation_path(state["generation"])
+        arrays = {name: np.memmap(os.path.join(directory, f"{name}.col"), dtype=dtype, mode="r", shape=(rows,))
+                  for name, dtype in COLUMNS.items()}
+        index = np.fromfile(os.path.join(directory, INDEX_FILE), dtype=np.int64, count=-(-rows // self.stride))
+        return arrays, index
+
+    def search(self, times, index, value, side="left"):
+        """Binary search ``times`` for ``value`` using the sparse ``index`` to pick one stride."""
+        block = max(int(np.searchsorted(index, value, side=side)) - 1, 0)
+        lo = block * self.stride
+        hi = min(lo + 2 * self.stride, len(times))
+        return lo + int(np.searchsorted(times[lo:hi], value, side=side))
+
+    def read(self, start, end, fields=None):
+        """Return {column: array} for bars with ``start <= time < end`` as zero-copy memmap slices."""
+        arrays, index = self.columns()
+        lo = self.search(arrays["time"], index, start)
+        hi = self.search(arrays["time"], index, end)
+        return {name: arrays[name][lo:hi] for name in ("time", *(fields or [c for c in COLUMNS if c != "time"]))}
+
+    def latest_time(self):
+        arrays, _ = self.columns()
+        return int(arrays["time"][-1]) if len(arrays["time"]) else None
+
+    def append(self, batch):
+        """Store ``batch`` ({column: array}); returns how many new bars were stored."""
+        order = np.argsort(batch["time"], kind="stable")
+        batch = {name: np.asarray(batch[name], dtype=dtype)[order] for name, dtype in COLUMNS.items()}
+        # Keep the first row per time, like ON CONFLICT DO NOTHING within a batch
+        keep = np.concatenate(([True], batch["time"][1:] != batch["time"][:-1]))
+        batch = {name: values[keep] for name, values in batch.items()}
+
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            # Released when the file is closed; STATE is only read once it is held
+            with open(os.path.join(self.path, LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                return self.append_locked(batch)
+
+    def append_locked(self, batch):
+        """Store a sorted, time-unique ``batch`` while holding the series lock."""
+        state = self.state()
+        latest = self.latest_time() if state["rows"] else None
+        if latest is not None and batch["time"][0] <= latest:
+            return self.merge(state, batch)
+
+        directory = self.generation_path(state["generation"])
+        os.makedirs(directory, exist_ok=True)
+        rows = state["rows"]
+        for name in COLUMNS:
+            self.append_file(os.path.join(directory, f"{name}.col"), rows * 8, batch[name])
+        # Index entries for every stride boundary the new rows cross
+        first_entry = -(-rows // self.stride)
+        positions = np.arange(first_entry * self.stride, rows + len(batch["time"]), self.stride) - rows
+        self.append_file(os.path.join(directory, INDEX_FILE), first_entry * 8, batch["time"][positions])
+
+        self.save_state({"generation": state["generation"], "rows": rows + len(batch["time"])})
+        return len(batch["time"])
+
+    @staticmethod
+    def append_file(path, committed_bytes, values):
+        """Append ``values`` after the committed bytes of ``path``, dropping any uncommitted tail."""
+        with open(path, "ab") as f:
+            f.truncate(committed_bytes)
+            f.write(np.ascontiguousarray(values).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def merge(self, state, batch):
+        """Rewrite the series with ``batch`` merged in, as a new generation."""
+        arrays, _ = self.columns(state)
+        existing = arrays["time"]
+        new = ~np.isin(batch["time"], existing)
+        if not new.any():
+            return 0
+        merged = {name: np.concatenate((arrays[name], batch[name][new])) for name in COLUMNS}
+        order = np.argsort(merged["time"], kind="stable")
+
+        generation = state["generation"] + 1
+        directory = self.generation_path(generation)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        for name in COLUMNS:
+            self.append_file(os.path.join(directory, f"{name}.col"), 0, merged[name][order])
+        self.append_file(os.path.join(directory, INDEX_FILE), 0, merged["time"][order][::self.stride])
+        fsync_dir(directory)
+
+        self.save_state({"generation": generation, "rows": len(order)})
+        # Open memmaps of the old generation stay readable after the unlink
+        shutil.rmtree(self.generation_path(state["generation"]), ignore_errors=True)
+        logger.debug(f"Merged {int(new.sum())} out-of-order bar(s) into {self.path} (generation {generation})")
+        return int(new.sum())
+
+
+class TickStore:
+    """Directory of TickSeries laid out as ``root/<source>/<ticker>/``."""
+
+    def __init__(self, root=TICK_STORE_DIR):
+        self.root = root
+        self.series_cache = {}
+        self.lock = threading.Lock()
+
+    def series(self, ticker, source="polygon"):
+        with self.lock:
+            key = (source, ticker)
+            if key not in self.series_cache:
+                self.series_cache[key] = TickSeries(os.path.join(self.root, source, ticker))
+            return self.series_cache[key]
+
+    def tickers(self, source="polygon"):
+        path = os.path.join(self.root, source)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def read(self, ticker, start, end, fields=None, source="polygon"):
+        return self.series(ticker, source).read(start, end, fields)
+
+    def latest_time(self, ticker, source="polygon"):
+        return self.series(ticker, source).latest_time()
+
+    def append_rows(self, rows):
+        """Store ``stocks``-style row dicts; returns how many new bars were stored."""
+        groups = {}
+        for row in rows:
+            groups.setdefault((row.get("source") or "polygon", row["ticker"]), []).append(row)
+        stored = 0
+        for (source, ticker), group in groups.items():
+            batch = {name: [nan_if_none(row.get(name)) for row in group] for name in COLUMNS}
+            stored += self.series(ticker, source).append(batch)
+        return stored
+
+
+def nan_if_none(value):
+    return np.nan if value is None else value
+
+
+def none_if_nan(value):
+    return None if value != value else value
+
+
+@click.group()
+@click.option("--store", default=TICK_STORE_DIR, help=f"Tick store directory (default: {TICK_STORE_DIR})")
+@click.option("--debug", is_flag=True, help="Enable debug logging")
+@click.pass_context
+def main(ctx, store, debug):
+    """Mirror bars between the stocks table and the memory-mapped tick store."""
+
+    # Configure logging
+    logger.remove()
+    if debug:
+        logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+    else:
+        logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
+    ctx.obj = TickStore(store)
+
+
+@main.command("to-store")
+@click.argument("tickers", nargs=-1)
+@click.option("--source", default="polygon", type=click.Choice(SOURCES), help="Source to copy (default: polygon)")
+@click.option("--page-size", default=100000, help="Rows read per page (default: 100000)")
+@click.pass_obj
+def to_store(store, tickers, source, page_size):
+    """Copy stocks rows for TICKERS (default: all) into the tick store.
+
+    Each ticker resumes after the newest bar already in the store, so rows
+    older than that are not copied; remove the ticker's store directory to
+    copy it again from scratch.
+    """
+    source_filter = or_(Stock.source == source, Stock.source.is_(None)) if source == "polygon" \
+        else Stock.source == source
+    with engine.connect() as conn:
+        if not tickers:
+            tickers = conn.execute(
+                select(Stock.ticker).where(source_filter).distinct().order_by(Stock.ticker)
+            ).scalars().all()
+        if source == "yfinance":
+            require_expanded(conn, "tickstore.py to-store", tickers)
+
+    started = time.perf_counter()
+    total = 0
+    columns = [Stock.__table__.c[name] for name in COLUMNS]
+    for ticker in tickers:
+        series = store.series(ticker, source)
+        after = series.latest_time()
+        stored = 0
+        while True:
+            query = (select(*columns).where(Stock.ticker == ticker, source_filter)
+                     .order_by(Stock.time).limit(page_size))
+            if after is not None:
+                query = query.where(Stock.time > after)
+            with engine.connect() as conn:
+                page = conn.execute(query).all()
+            if not page:
+                break
+            values = list(zip(*page))
+            stored += series.append({name: [nan_if_none(v) for v in values[i]] for i, name in enumerate(COLUMNS)})
+            after = page[-1].time
+        total += stored
+        logger.info(f"{ticker}: stored {stored:,} new bar(s)")
+
+    logger.success(f"Copied {total:,} bar(s) into {store.root} in {time.perf_counter() - started:.1f}s")
+
+
+@main.command("to-db")
+@click.argument("tickers", nargs=-1)
+@click.option("--source", default="polygon", type=click.Choice(SOURCES), help="Source to copy (default: polygon)")
+@click.option("--batch-size", default=BATCH_COMMIT_SIZE, help=f"Rows per batch (default: {BATCH_COMMIT_SIZE})")
+@click.pass_obj
+def to_db(store, tickers, source, batch_size):
+    """Copy tick store bars for TICKERS (default: all) into stocks; existing (ticker, time) rows are kept."""
+    from writers import get_writer, sql_writer_name
+
+    started = time.perf_counter()
+    # Explicitly a SQL writer: "auto" is the tick store itself when STORAGE_BACKEND=tickstore
+    writer = get_writer(name=sql_writer_name(), batch_size=batch_size)
+    with writer:
+        for ticker in tickers or store.tickers(source):
+            arrays, _ = store.series(ticker, source).columns()
+            for lo in range(0, len(arrays["time"]), batch_size):
+                chunk = {name: arrays[name][lo:lo + batch_size].tolist() for name in COLUMNS}
+                for i, bar_time in enumerate(chunk["time"]):
+                    row = {name: none_if_nan(chunk[name][i]) for name in COLUMNS if name != "time"}
+                    writer.add({**row, "ticker": ticker, "time": bar_time, "source": source})
+            logger.info(f"{ticker}: queued {len(arrays['time']):,} bar(s)")
+
+    logger.success(f"Wrote {writer.rows_written:,} bar(s) to stocks in {time.perf_counter() - started:.1f}s "
+                   "(rows already present were skipped)")
+
+
+if __name__ == "__main__":
+    main()
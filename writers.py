@@ -0,0 +1,237 @@
+import io
+import json
+import time
+
+from loguru import logger
+
+from database import Stock, engine as default_engine
+from metrics import count, stage
+from query import invalidate
+from rollups import update_rollups
+from settings import BATCH_COMMIT_SIZE, STORAGE_BACKEND
+
+STOCK_COLUMNS = ("ticker", "time", "high", "low", "avg", "sale",
+                 "open", "close", "volume", "vwap", "transactions", "source", "meta")
+
+
+class BulkWriter:
+    """Buffer ``stocks`` rows (dicts keyed by STOCK_COLUMNS) and write them in batches.
+
+    Each batch of ``batch_size`` rows is written and committed in its own
+    transaction. Rows whose (ticker, time) already exists are skipped, so
+    re-running a load is idempotent. The base class uses a Core
+    ``executemany`` insert, which works on any database SQLAlchemy supports
+    (SQLite bulk-load pragmas are set on every connection by ``database.engine``).
+
+    With ``rollups``, the 5m/1h/1d rollup buckets touched by a batch are
+    recomputed in the same transaction.
+    """
+
+    name = "core"
+
+    def __init__(self, engine=None, batch_size=BATCH_COMMIT_SIZE, rollups=True):
+        self.engine = engine if engine is not None else default_engine
+        self.batch_size = batch_size
+        self.rollups = rollups
+        self.buffer = []
+        self.rows_written = 0
+        self.write_seconds = 0.0
+
+    def discard(self):
+        """Drop buffered rows without writing them."""
+        self.buffer = []
+
+    def add(self, row):
+        """Queue one row; returns True if this call flushed a batch."""
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """Write and commit all buffered rows."""
+        if not self.buffer:
+            return
+        started = time.perf_counter()
+        with self.engine.connect() as conn, conn.begin() as transaction:
+            with stage("write", writer=self.name):
+                self.prepare(conn)
+                self.write(conn, self.buffer)
+            if self.rollups:
+                with stage("rollups", writer=self.name):
+                    update_rollups(conn, self.buffer)
+            with stage("commit", writer=self.name):
+                transaction.commit()
+        self.write_seconds += time.perf_counter() - started
+        self.rows_written += len(self.buffer)
+        count("rows", len(self.buffer), stage="write", writer=self.name)
+        invalidate({row["ticker"] for row in self.buffer})
+        logger.debug(f"{self.name} writer committed {len(self.buffer)} rows")
+        self.buffer = []
+
+    def prepare(self, conn):
+        """Per-transaction connection setup hook."""
+
+    def write(self, conn, rows):
+        conn.execute(insert_ignore_statement(conn), rows)
+
+    def rows_per_second(self):
+        return self.rows_written / self.write_seconds if self.write_seconds else 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # On error, drop the unwritten batch like a session rollback would
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+        return False
+
+
+class PostgresCopyWriter(BulkWriter):
+    """Stream batches into PostgreSQL with ``COPY ... FROM STDIN``.
+
+    COPY can't skip conflicting rows, so each batch is copied into a temporary
+    staging table and moved into ``stocks`` with ``ON CONFLICT DO NOTHING``.
+    """
+
+    name = "copy"
+
+    def write(self, conn, rows):
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(copy_value(row.get(column), column == "meta") for column in STOCK_COLUMNS))
+            buf.write("\n")
+        buf.seek(0)
+
+        table = Stock.__tablename__
+        columns = ", ".join(STOCK_COLUMNS)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(
+                f"CREATE TEMP TABLE {table}_stage ON COMMIT DROP AS "
+                f"SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            cursor.copy_expert(f"COPY {table}_stage ({columns}) FROM STDIN", buf)
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_stage "
+                f"ON CONFLICT (ticker, time) DO NOTHING"
+            )
+        finally:
+            cursor.close()
+
+
+class TickStoreWriter(BulkWriter):
+    """Append batches to the memory-mapped tick store instead of the ``stocks`` table.
+
+    Only the fixed-width bar columns are kept; ``transactions`` and ``meta``
+    are dropped and rollups are not maintained. Mirror the store into
+    ``stocks`` with ``python tickstore.py to-db``.
+    """
+
+    name = "tickstore"
+
+    def __init__(self, engine=None, batch_size=BATCH_COMMIT_SIZE, rollups=False):
+        super().__init__(engine, batch_size, rollups=False)
+        from tickstore import TickStore
+        self.store = TickStore()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        started = time.perf_counter()
+        with stage("write", writer=self.name):
+            stored = self.store.append_rows(self.buffer)
+        self.write_seconds += time.perf_counter() - started
+        self.rows_written += len(self.buffer)
+        count("rows", len(self.buffer), stage="write", writer=self.name)
+        logger.debug(f"{self.name} writer stored {stored} new of {len(self.buffer)} rows")
+        self.buffer = []
+
+
+class SpoolWriter(BulkWriter):
+    """Append batches to the local write-ahead spool instead of the database.
+
+    ``flush`` returns as soon as the rows are fsynced to the spool, so a slow
+    or unreachable database doesn't hold up the caller. A ``spool.DrainThread``
+    (or ``python spool.py``) loads them into ``stocks`` later through a
+    database writer, which maintains rollups.
+    """
+
+    name = "spool"
+
+    def __init__(self, engine=None, batch_size=BATCH_COMMIT_SIZE, rollups=True):
+        super().__init__(engine, batch_size, rollups)
+        from spool import Spool
+        self.spool = Spool()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        started = time.perf_counter()
+        with stage("spool_append", writer=self.name):
+            self.spool.append(self.buffer)
+        self.write_seconds += time.perf_counter() - started
+        self.rows_written += len(self.buffer)
+        count("rows", len(self.buffer), stage="write", writer=self.name)
+        logger.debug(f"{self.name} writer spooled {len(self.buffer)} rows")
+        self.buffer = []
+
+
+def insert_ignore_statement(conn, table=None, index_elements=("ticker", "time")):
+    """Return an INSERT into ``table`` (default ``stocks``) that skips conflicting rows.
+
+    ``index_elements`` names the unique key to check; pass None to skip rows
+    that conflict with any unique constraint.
+    """
+    table = table if table is not None else Stock.__table__
+    index_elements = list(index_elements) if index_elements else None
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    return table.insert()
+
+
+def copy_value(value, is_json=False):
+    """Format one value for PostgreSQL's COPY text format."""
+    if value is None:
+        return r"\N"
+    if is_json:
+        value = json.dumps(value)
+    elif isinstance(value, float):
+        return repr(value)
+    elif not isinstance(value, str):
+        return str(value)
+    return (value.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+WRITERS = {
+    "core": BulkWriter,
+    "copy": PostgresCopyWriter,
+    "tickstore": TickStoreWriter,
+    "spool": SpoolWriter,
+}
+
+
+def sql_writer_name(engine=None):
+    """Name of the fastest writer into the ``stocks`` table: COPY on PostgreSQL, executemany elsewhere."""
+    engine = engine if engine is not None else default_engine
+    return "copy" if engine.dialect.name == "postgresql" else "core"
+
+
+def get_writer(engine=None, name="auto", batch_size=BATCH_COMMIT_SIZE, rollups=True):
+    """Return a writer for ``engine``; ``auto`` picks the configured backend's fastest writer."""
+    engine = engine if engine is not None else default_engine
+    if name == "auto" and STORAGE_BACKEND == "tickstore":
+        name = "tickstore"
+    elif name == "auto":
+        name = sql_writer_name(engine)
+    return WRITERS[name](engine, batch_size, rollups)
@@ -1,130 +1,376 @@
+import signal
 import sys
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime
 
 import click
 import yfinance as yf
 from loguru import logger
 
-from database import Stock, get_session
+from database import ensure_partitions
+from fundamentals import FundamentalsCache
+from intraday import IntradayState
+from metrics import count, instrumented, stage, with_stage_records, write_textfile
+from spool import DrainThread, drain_remaining
+from settings import (
+    FETCH_TIMEOUT_SECONDS,
+    FETCH_WORKERS,
+    INTRADAY_VOLUME_WINDOW,
+    METRICS_FILE,
+    METRICS_PORT,
+    MONITOR_INTERVAL_SECONDS,
+    MONITOR_OFFSET_SECONDS,
+)
+from writers import get_writer
 
 
 @click.command()
 @click.argument("tickers", nargs=-1, required=True)
+@click.option("--daemon", is_flag=True, help="Stay resident and fetch on every interval boundary")
+@click.option("--interval", default=MONITOR_INTERVAL_SECONDS,
+              help=f"Seconds between daemon cycles (default: {MONITOR_INTERVAL_SECONDS})")
+@click.option("--offset", default=MONITOR_OFFSET_SECONDS,
+              help=f"Seconds past each boundary to run the daemon cycle (default: {MONITOR_OFFSET_SECONDS})")
+@click.option("--workers", default=FETCH_WORKERS,
+              help=f"Number of tickers fetched concurrently (default: {FETCH_WORKERS})")
+@click.option("--timeout", default=FETCH_TIMEOUT_SECONDS,
+              help=f"Seconds before a single ticker fetch is abandoned (default: {FETCH_TIMEOUT_SECONDS})")
+@click.option("--spool", is_flag=True,
+              help="Append rows to the local write-ahead spool and load them into the database "
+                   "in the background, so cycles don't wait on (or fail with) the database")
+@click.option("--metrics-file", default=METRICS_FILE,
+              help="Write Prometheus metrics to this textfile after each cycle (default: $METRICS_FILE)")
+@click.option("--metrics-port", default=METRICS_PORT,
+              help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running (default: off)")
+@click.option("--profile", type=click.Path(dir_okay=False),
+              help="Profile the run with the sampling profiler and write the stats to this file on exit")
+@click.option("--log-json", is_flag=True, help="Emit log records as JSON lines")
 @click.option("--debug", is_flag=True, help="Enable debug logging")
-def main(tickers, debug):
+def main(tickers, daemon, interval, offset, workers, timeout, spool, metrics_file, metrics_port, profile,
+         log_json, debug):
     """Fetch current stock data for one or more TICKERS and save to database.
-    
+
     Examples:
         python yfinance_fetcher.py AAPL
         python yfinance_fetcher.py AAPL MSFT GOOGL
+        python yfinance_fetcher.py --daemon AAPL MSFT GOOGL
     """
     # Configure logging
     logger.remove()
-    if debug:
+    if log_json:
+        # Per-stage timings are DEBUG records; JSON logs carry them without --debug too
+        logger.add(sys.stderr, level="DEBUG", serialize=True, filter=None if debug else with_stage_records)
+    elif debug:
         logger.add(sys.stderr, level="DEBUG", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
     else:
         logger.add(sys.stderr, level="INFO", format="{time:HH:mm:ss} | {level} | {message}")
-    
+
+    with instrumented(metrics_file, metrics_port, profile):
+        if daemon:
+            run_daemon(tickers, interval, offset, debug, workers, timeout, metrics_file, spool)
+        elif spool:
+            writer = get_writer(name="spool")
+            fetch_cycle(writer, tickers, debug, workers=workers, timeout=timeout)
+            # Load what was just spooled (and any backlog) now if the database is reachable
+            drain_remaining(writer.spool, get_writer())
+            writer.spool.close()
+        else:
+            fetch_cycle(get_writer(), tickers, debug, workers=workers, timeout=timeout)
+
+
+def fetch_cycle(writer, tickers, debug=False, yf_tickers=None,
+                workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT_SECONDS, states=None,
+                fundamentals=None, in_flight=None):
+    """Fetch one snapshot per ticker and commit them through ``writer`` (a ``BulkWriter``).
+
+    Tickers are fetched concurrently on up to ``workers`` threads. A ticker that
+    has been running for longer than ``timeout`` seconds is abandoned for this
+    cycle so one slow symbol cannot hold up the others.
+
+    ``yf_tickers`` and ``states`` are optional dicts of ``yf.Ticker`` objects
+    and ``IntradayState`` objects keyed by symbol that are reused across calls,
+    so a resident process keeps yfinance and intraday state warm. Missing
+    states are rebuilt from the database. ``fundamentals`` is an optional
+    ``FundamentalsCache``; one is loaded from disk if not given.
+
+    An abandoned fetch keeps running in the background and still updates its
+    ticker's state. ``in_flight`` is an optional set, reused across calls, of
+    tickers whose fetch thread hasn't returned yet; those tickers are skipped
+    until it does, so no two threads ever share a state.
+    """
+    if yf_tickers is None:
+        yf_tickers = {}
+    if states is None:
+        states = {}
+    if fundamentals is None:
+        fundamentals = FundamentalsCache()
+    if in_flight is None:
+        in_flight = set()
+
+    stalled = [ticker_symbol for ticker_symbol in tickers if ticker_symbol in in_flight]
+    if stalled:
+        logger.warning(f"Skipping {len(stalled)} ticker(s) still being fetched by an earlier cycle: "
+                       f"{', '.join(stalled)}")
+        count("skipped", len(stalled), source="yfinance")
+        tickers = [ticker_symbol for ticker_symbol in tickers if ticker_symbol not in in_flight]
+        if not tickers:
+            return
+
     logger.info(f"Fetching data for {len(tickers)} ticker(s): {', '.join(tickers)}")
-    
-    session = get_session()
+
     current_time = int(time.time())
-    
+
+    # Create ticker objects and intraday state up front (or reuse the ones from a previous cycle)
+    for ticker_symbol in tickers:
+        if ticker_symbol not in yf_tickers:
+            yf_tickers[ticker_symbol] = yf.Ticker(ticker_symbol)
+
+    missing = [ticker_symbol for ticker_symbol in tickers if ticker_symbol not in states]
+    if missing:
+        try:
+            with writer.engine.connect() as conn:
+                for ticker_symbol in missing:
+                    states[ticker_symbol] = IntradayState.restore(conn, ticker_symbol)
+        except Exception as e:
+            # Without the database, start from today's full history instead
+            logger.warning(f"Could not restore intraday state: {type(e).__name__}: {e}")
+            for ticker_symbol in missing:
+                states.setdefault(ticker_symbol, IntradayState(ticker_symbol))
+
+    started_at = {}
+
+    def run(ticker_symbol):
+        # Marked here rather than at submit, so a future cancelled before it starts never holds the ticker
+        in_flight.add(ticker_symbol)
+        started_at[ticker_symbol] = time.monotonic()
+        try:
+            return fetch_ticker(ticker_symbol, yf_tickers[ticker_symbol], states[ticker_symbol],
+                                fundamentals, debug, timeout)
+        finally:
+            in_flight.discard(ticker_symbol)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(tickers))),
+                                  thread_name_prefix="fetch")
+    pending = {executor.submit(run, ticker_symbol): ticker_symbol for ticker_symbol in tickers}
+    saved = 0
+
     try:
-        for ticker_symbol in tickers:
-            logger.debug(f"Processing {ticker_symbol}")
-            
-            try:
-                # Create ticker object
-                ticker = yf.Ticker(ticker_symbol)
-                
-                # Get current info
-                info = ticker.info
-                
-                # Get 1-minute data for prices and volume
-                logger.debug(f"Fetching 1-minute data")
-                minute_data = ticker.history(period="1d", interval="1m", prepost=True)
-                
-                if minute_data.empty:
-                    logger.warning(f"No 1-minute data available for {ticker_symbol}")
+        while pending:
+            done, _ = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                ticker_symbol = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing {ticker_symbol}: {type(e).__name__}: {e}")
+                    count("errors", stage="fetch", source="yfinance")
+                    continue
+
+                if record is None:
                     continue
-                
-                # Get current price from latest 1-minute bar
-                current_price = float(minute_data['Close'].iloc[-1])
-                
-                # Calculate high/low/avg for today from 1-minute data
-                high = minute_data['High'].max()
-                low = minute_data['Low'].min()
-                avg = (high + low) / 2
-                
-                # Get volume from most recent non-zero minute (within last 5 minutes)
-                volume = 0
-                for i in range(1, min(6, len(minute_data) + 1)):
-                    potential_volume = int(minute_data['Volume'].iloc[-i])
-                    if potential_volume > 0:
-                        volume = potential_volume
-                        if i == 1:
-                            logger.debug(f"Using current minute volume: {volume:,}")
-                        else:
-                            logger.debug(f"Using volume from {i} minute(s) ago: {volume:,}")
-                        break
-                
-                if debug:
-                    last_5_volumes = minute_data['Volume'].tail(5).values
-                    last_5_times = minute_data.tail(5).index.strftime('%H:%M').values
-                    logger.debug(f"Last 5 minutes volume: {list(zip(last_5_times, last_5_volumes))}")
-                
-                if volume == 0:
-                    logger.debug("No volume found in last 5 minutes")
-                
-                # Get the most recent data point from 1-minute data
-                latest_row = minute_data.iloc[-1]
-                
-                logger.info(f"{ticker_symbol}: Price=${current_price:.2f}, "
-                           f"High=${high:.2f}, Low=${low:.2f}, Volume={volume:,}")
-                
-                # Create Stock record
-                stock = Stock(
-                    ticker=ticker_symbol,
-                    time=current_time,
-                    high=float(high),
-                    low=float(low),
-                    avg=float(avg),
-                    sale=float(current_price),
-                    meta={
-                        "source": "yfinance",
-                        "volume": int(volume),
-                        "open": float(latest_row['Open']),
-                        "close": float(latest_row['Close']),
-                        "day_high": float(info.get('dayHigh', high)),
-                        "day_low": float(info.get('dayLow', low)),
-                        "previous_close": float(info.get('previousClose', 0)),
-                        "market_cap": info.get('marketCap'),
-                        "pe_ratio": info.get('trailingPE'),
-                        "timestamp": datetime.now().isoformat()
-                    }
-                )
-                
-                session.add(stock)
-                logger.debug(f"Added {ticker_symbol} to session")
-                
-            except Exception as e:
-                logger.error(f"Error processing {ticker_symbol}: {type(e).__name__}: {e}")
-                continue
-        
+
+                writer.add({"ticker": ticker_symbol, "time": current_time, **record})
+                saved += 1
+                logger.debug(f"Added {ticker_symbol} to batch")
+
+            now = time.monotonic()
+            for future, ticker_symbol in list(pending.items()):
+                started = started_at.get(ticker_symbol)
+                if started is not None and now - started > timeout:
+                    logger.error(f"Timed out processing {ticker_symbol} after {timeout}s")
+                    count("timeouts", source="yfinance")
+                    future.cancel()
+                    del pending[future]
+
         # Commit all records
-        session.commit()
-        logger.success(f"Successfully saved data for {len(tickers)} ticker(s)")
-        
+        writer.flush()
+        logger.success(f"Successfully saved data for {saved}/{len(tickers)} ticker(s)")
+
+        fundamentals.save()
+        hits, misses = fundamentals.stats()
+        logger.debug(f"Fundamentals cache: {hits} hit(s), {misses} miss(es)")
+
     except Exception as e:
-        session.rollback()
+        writer.discard()
         logger.error(f"Database error: {type(e).__name__}: {e}")
         raise
     finally:
-        session.close()
-        logger.debug("Database session closed")
+        # Don't block on abandoned fetches; their threads finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_ticker(ticker_symbol, ticker, state, fundamentals, debug=False, timeout=FETCH_TIMEOUT_SECONDS):
+    """Fetch the current snapshot for one ticker.
+
+    Only the 1-minute bars newer than the last one recorded in ``state`` (an
+    ``IntradayState``) are downloaded; day high/low and recent volume come from
+    the running state, and ``Ticker.info`` fields come from ``fundamentals``
+    (a ``FundamentalsCache``). Returns the column values for a ``stocks`` row (without
+    ``ticker`` and ``time``), or None if no minute data is available.
+    """
+    logger.debug(f"Processing {ticker_symbol}")
+
+    # Get cached fundamentals (only hits the network when a field has expired)
+    with stage("fundamentals", source="yfinance"):
+        info = fundamentals.get(ticker_symbol, ticker, timeout)
+
+    # Get new 1-minute bars for prices and volume
+    start = state.fetch_start()
+    with stage("history", source="yfinance"):
+        if start is None:
+            logger.debug(f"{ticker_symbol}: Fetching today's 1-minute data")
+            minute_data = ticker.history(period="1d", interval="1m", prepost=True, timeout=timeout)
+        else:
+            logger.debug(f"{ticker_symbol}: Fetching 1-minute data since {start.strftime('%H:%M')}")
+            minute_data = ticker.history(start=start, interval="1m", prepost=True, timeout=timeout)
+    count("rows", len(minute_data), stage="fetch", source="yfinance")
+
+    with stage("transform", source="yfinance"):
+        state.update(minute_data)
+
+    if state.last_bar is None:
+        logger.warning(f"No 1-minute data available for {ticker_symbol}")
+        return None
+
+    logger.debug(f"{ticker_symbol}: Merged {len(minute_data)} new bar(s)")
+
+    # Get current price from latest 1-minute bar
+    bar_open, _, _, bar_close, _ = state.last_bar
+    current_price = bar_close
+
+    # High/low/avg for today from the running state
+    high = state.high
+    low = state.low
+    avg = (high + low) / 2
+
+    # Get volume from most recent non-zero minute (within the volume window)
+    volume, bars_ago = state.recent_volume()
+    if bars_ago == 1:
+        logger.debug(f"{ticker_symbol}: Using current minute volume: {volume:,}")
+    elif bars_ago is not None:
+        logger.debug(f"{ticker_symbol}: Using volume from {bars_ago} minute(s) ago: {volume:,}")
+
+    if debug:
+        logger.debug(f"{ticker_symbol}: Last {INTRADAY_VOLUME_WINDOW} minutes volume: {state.recent_volumes()}")
+
+    if volume == 0:
+        logger.debug(f"{ticker_symbol}: No volume found in last {INTRADAY_VOLUME_WINDOW} minutes")
+
+    logger.info(f"{ticker_symbol}: Price=${current_price:.2f}, "
+               f"High=${high:.2f}, Low=${low:.2f}, Volume={volume:,}")
+
+    return {
+        "high": float(high),
+        "low": float(low),
+        "avg": float(avg),
+        "sale": float(current_price),
+        "open": bar_open,
+        "close": bar_close,
+        "volume": int(volume),
+        "vwap": None,
+        "transactions": None,
+        "source": "yfinance",
+        "meta": {
+            "day_high": float(high),
+            "day_low": float(low),
+            "previous_close": float(info.get('previousClose') or 0),
+            "market_cap": info.get('marketCap'),
+            "pe_ratio": info.get('trailingPE'),
+            "timestamp": datetime.now().isoformat()
+        },
+    }
+
+
+def next_deadline(now, interval, offset):
+    """Return the first ``interval`` boundary (shifted by ``offset``) strictly after ``now``."""
+    return ((now - offset) // interval + 1) * interval + offset
+
+
+def run_daemon(tickers, interval, offset, debug=False,
+               workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT_SECONDS, metrics_file=None, spool=False):
+    """Run fetch cycles on wall-clock boundaries until SIGTERM/SIGINT.
+
+    Deadlines are computed from the wall clock rather than by accumulating
+    sleeps, so the schedule does not drift. A cycle that overruns its interval
+    skips the boundaries it missed instead of queueing extra cycles behind it.
+    With ``metrics_file``, the Prometheus textfile is rewritten after every cycle.
+
+    With ``spool``, cycles write to the local write-ahead spool and a
+    background thread loads it into the database, retrying while the
+    database is unavailable.
+
+    Partitions are checked before the first cycle of each day; a database
+    that is down at startup only fails those cycles, not the daemon.
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, stopping after current cycle")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logger.info(f"Starting monitor daemon for {len(tickers)} ticker(s), "
+                f"every {interval}s at +{offset}s")
+
+    drainer = None
+    if spool:
+        writer = get_writer(name="spool")
+        drainer = DrainThread(writer.spool, get_writer())
+        drainer.start()
+        logger.info(f"Spooling rows to {writer.spool.directory}")
+    else:
+        writer = get_writer()
+    yf_tickers = {}
+    states = {}
+    in_flight = set()
+    fundamentals = FundamentalsCache()
+    partitions_checked = None  # Date of the last successful ensure_partitions
+    deadline = next_deadline(time.time(), interval, offset)
+
+    try:
+        while not stop.wait(max(0.0, deadline - time.time())):
+            lateness = time.time() - deadline
+            started = time.monotonic()
+
+            if partitions_checked != date.today():
+                try:
+                    ensure_partitions()
+                    partitions_checked = date.today()
+                except Exception as e:
+                    logger.warning(f"Could not check partitions, retrying next cycle"
+                                   f"{' (rows are spooled meanwhile)' if spool else ''}: {type(e).__name__}: {e}")
+
+            try:
+                with stage("cycle", source="yfinance"):
+                    fetch_cycle(writer, tickers, debug, yf_tickers, workers, timeout, states, fundamentals,
+                                in_flight)
+            except Exception:
+                # fetch_cycle already rolled back and logged; keep the daemon alive
+                count("errors", stage="cycle", source="yfinance")
+
+            duration = time.monotonic() - started
+            if metrics_file:
+                write_textfile(metrics_file)
+            logger.info(f"Cycle {datetime.fromtimestamp(deadline).strftime('%H:%M:%S')} "
+                        f"started {lateness:.2f}s late, took {duration:.2f}s")
+
+            following = next_deadline(time.time(), interval, offset)
+            skipped = int(round((following - deadline) / interval)) - 1
+            if skipped > 0:
+                logger.warning(f"Cycle overran its interval, skipping {skipped} cycle(s)")
+            deadline = following
+    finally:
+        if drainer is not None:
+            drainer.stop()
+            writer.spool.close()
+        hits, misses = fundamentals.stats()
+        logger.info(f"Monitor daemon stopped (fundamentals cache: {hits} hit(s), {misses} miss(es))")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()